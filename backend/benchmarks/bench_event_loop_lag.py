@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+事件循环延迟基准测试
+在混合流量（聊天：查询agent + 保存消息；列表：会话列表 + 消息列表）下，
+对比旧实现（async接口中直接执行同步查询）与新实现（AsyncSession）的事件循环延迟。
+延迟由一个每5ms唤醒一次的探针任务测量（实际唤醒时间 - 预期唤醒时间），
+它反映了同一进程中其他SSE流被卡住的时长
+
+用法: cd backend && python benchmarks/bench_event_loop_lag.py [并发数] [持续秒数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core import json_codec
+from core.database import AsyncSessionLocal, Base, SessionLocal, async_session_scope
+from core.adapter import ChatRequest
+from core.adapter.base import StreamChunk
+from core.chat_service import ChatService
+from core.stream_accumulator import StreamAccumulator
+from models import Agent, Merchant, User, Message, Conversation
+from routers import messages, sessions
+
+N_CONVERSATIONS = 200
+MESSAGES_PER_CONVERSATION = 50
+PROBE_INTERVAL = 0.005
+
+
+def setup_database(path: str):
+    sync_engine = create_engine(f"sqlite:///{path}", json_serializer=json_codec.dumps_str, json_deserializer=json_codec.loads)
+    SessionLocal.configure(bind=sync_engine)
+    Base.metadata.create_all(bind=sync_engine)
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", json_serializer=json_codec.dumps_str, json_deserializer=json_codec.loads
+    )
+    AsyncSessionLocal.configure(bind=async_engine)
+
+    db = SessionLocal()
+    merchant = Merchant(name="bench", api_key="bench", balance=0)
+    db.add(merchant)
+    db.commit()
+    user = User(merchant_id=merchant.id, username="bench", email="bench@example.com", password_hash="x")
+    db.add(user)
+    db.commit()
+    agent = Agent(merchant_id=merchant.id, name="bench", type="dify", created_by=user.id, config={"stream": True})
+    db.add(agent)
+    db.commit()
+    ids = (merchant.id, user.id, agent.id)
+    for i in range(N_CONVERSATIONS):
+        db.add(Conversation(id=f"seed-{i:05d}", merchant_id=merchant.id, user_id=user.id, agent_id=agent.id,
+                            title=f"seed {i}", status="active"))
+    db.flush()
+    db.bulk_insert_mappings(Message, [
+        {"conversation_id": f"seed-{i:05d}", "merchant_id": merchant.id, "user_id": user.id, "agent_id": agent.id,
+         "role": "agent", "content": "历史消息内容 " * 20, "workflow_events": [{"event": "message_end"}],
+         "created_at": datetime.utcnow()}
+        for i in range(N_CONVERSATIONS) for _ in range(MESSAGES_PER_CONVERSATION)
+    ])
+    db.commit()
+    db.close()
+    return sync_engine, async_engine, ids
+
+
+def build_accumulator(request: ChatRequest) -> StreamAccumulator:
+    accumulator = StreamAccumulator(request)
+    for i in range(20):
+        accumulator.add(StreamChunk(message=f"tok{i} ", metadata={"event": "message", "content": f"tok{i} "}))
+    accumulator.add(StreamChunk(message="", metadata={"event": "message_end", "usage": {"total_tokens": 10}}))
+    return accumulator
+
+
+# ---- 旧实现：async接口中直接使用同步会话 ----
+
+async def old_chat(request: ChatRequest):
+    db = SessionLocal()
+    try:
+        db.query(Agent).filter(Agent.id == request.agent_id).first()
+        conversation = db.query(Conversation).filter(Conversation.id == request.conversation_id).first()
+        if not conversation:
+            db.add(Conversation(id=request.conversation_id, merchant_id=request.merchant_id, user_id=request.user_id,
+                                agent_id=request.agent_id, title=request.get_query_text()[:100], status="active"))
+            db.commit()
+        accumulator = build_accumulator(request)
+        db.add(Message(conversation_id=request.conversation_id, merchant_id=request.merchant_id, user_id=request.user_id,
+                       agent_id=request.agent_id, role="user", content=request.get_query_text()))
+        db.add(Message(conversation_id=request.conversation_id, merchant_id=request.merchant_id, user_id=request.user_id,
+                       agent_id=request.agent_id, role="agent", content=accumulator.full_message,
+                       workflow_events=accumulator.workflow_events))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def old_lists(conversation_id: str):
+    db = SessionLocal()
+    try:
+        conversations = db.query(Conversation).order_by(Conversation.updated_at.desc()).limit(100).all()
+        for conversation in conversations:
+            db.query(func.count(Message.id)).filter(Message.conversation_id == conversation.id).scalar()
+        db.query(Message).filter(Message.conversation_id == conversation_id).limit(100).all()
+    finally:
+        db.close()
+
+
+# ---- 新实现：AsyncSession（直接调用路由函数和ChatService） ----
+
+async def new_chat(request: ChatRequest):
+    service = ChatService()
+    await service._load_agent(request)
+    await service.save_stream_result(request, build_accumulator(request))
+
+
+async def new_lists(conversation_id: str):
+    async with async_session_scope() as db:
+        await sessions.read_conversations(skip=0, limit=100, db=db, current_user=None, merchant_id=None)
+    async with async_session_scope() as db:
+        await messages.read_messages(skip=0, limit=100, session_id=None, conversation_id=conversation_id,
+                                     db=db, current_user=None)
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def worker(index: int, chat, lists, ids, deadline: float, counter: dict):
+    merchant_id, user_id, agent_id = ids
+    n = 0
+    while time.perf_counter() < deadline:
+        if n % 2 == 0:
+            request = ChatRequest(query=f"question {index}-{n}", user_id=user_id, merchant_id=merchant_id,
+                                  agent_id=agent_id, conversation_id=f"w{index}-{n}-{counter['mode']}")
+            await chat(request)
+        else:
+            await lists(f"seed-{(index + n) % N_CONVERSATIONS:05d}")
+        n += 1
+        counter["requests"] += 1
+        # 模拟请求之间的网络间隔
+        await asyncio.sleep(0.001)
+
+
+async def run(mode: str, chat, lists, ids, concurrency: int, duration: float):
+    lags = []
+    stop = asyncio.Event()
+    counter = {"requests": 0, "mode": mode}
+    probe_task = asyncio.create_task(probe(lags, stop))
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(worker(i, chat, lists, ids, deadline, counter) for i in range(concurrency)))
+    stop.set()
+    await probe_task
+
+    lags.sort()
+    p50 = lags[len(lags) // 2] * 1000
+    p99 = lags[int(len(lags) * 0.99)] * 1000
+    print(f"{mode:<13} requests={counter['requests']:<6} loop_lag p50={p50:6.2f}ms "
+          f"p99={p99:6.2f}ms max={lags[-1] * 1000:6.2f}ms")
+
+
+async def main(concurrency: int, duration: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_engine, async_engine, ids = setup_database(os.path.join(tmp, "bench.db"))
+        print(f"concurrency={concurrency} duration={duration}s conversations={N_CONVERSATIONS} "
+              f"messages={N_CONVERSATIONS * MESSAGES_PER_CONVERSATION}")
+        await run("sync-on-loop", old_chat, old_lists, ids, concurrency, duration)
+        await run("async", new_chat, new_lists, ids, concurrency, duration)
+        await async_engine.dispose()
+        sync_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    ))
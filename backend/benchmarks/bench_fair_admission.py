@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+全局名额公平调度基准测试
+一个商户一次性涌入大量请求，其他商户按固定间隔发请求，
+对比先到先得（Bulkhead）与加权公平排队（FairScheduler）下各商户的排队等待时间（p50/p99）
+
+用法: cd backend && python benchmarks/bench_fair_admission.py [全局名额] [吵闹商户请求数] [每个请求耗时毫秒]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, Bulkhead, FairScheduler
+
+NOISY = "noisy"
+QUIET_MERCHANTS = ["quiet-1", "quiet-2", "quiet-3"]
+# 商户 -> 权重
+WEIGHTS = {NOISY: 1, "quiet-1": 1, "quiet-2": 1, "quiet-3": 2}
+
+
+async def request(bulkhead: Bulkhead, merchant: str, hold: float, priority: int, waits: dict):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    ticket = {}
+    if isinstance(bulkhead, FairScheduler):
+        ticket = {"merchant_id": merchant, "weight": WEIGHTS[merchant], "priority": priority}
+    await bulkhead.acquire(start + 3600, **ticket)
+    waits.setdefault(merchant, []).append(loop.time() - start)
+    try:
+        await asyncio.sleep(hold)
+    finally:
+        bulkhead.release(hold)
+
+
+async def run(name: str, bulkhead: Bulkhead, noisy_requests: int, hold: float):
+    waits = {}
+    tasks = [asyncio.create_task(request(bulkhead, NOISY, hold, PRIORITY_BATCH, waits))
+             for _ in range(noisy_requests)]
+    await asyncio.sleep(0)
+    # 其他商户在吵闹商户的请求排队期间陆续到达（交互式请求）
+    for _ in range(noisy_requests // 10):
+        for merchant in QUIET_MERCHANTS:
+            tasks.append(asyncio.create_task(request(bulkhead, merchant, hold, PRIORITY_INTERACTIVE, waits)))
+        await asyncio.sleep(hold)
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    print(f"{name}: drained in {(time.perf_counter() - started) * 1000:.0f}ms")
+    for merchant in [NOISY] + QUIET_MERCHANTS:
+        samples = sorted(waits[merchant])
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(f"  {merchant:<8} weight={WEIGHTS[merchant]} n={len(samples):<4} "
+              f"wait p50={statistics.median(samples) * 1000:7.1f}ms p99={p99 * 1000:7.1f}ms")
+
+
+async def main(limit: int, noisy_requests: int, hold_ms: float):
+    hold = hold_ms / 1000
+    queue_size = noisy_requests * 2
+    print(f"limit={limit} noisy_requests={noisy_requests} hold={hold_ms}ms")
+    await run("fifo", Bulkhead("global", "all", limit, queue_size), noisy_requests, hold)
+    await run("fair", FairScheduler(limit, queue_size), noisy_requests, hold)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 400,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 20.0
+    ))
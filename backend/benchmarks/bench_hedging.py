@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+多端点对冲基准测试
+两个模拟的Dify副本，少量请求会遇到长尾延迟，
+对比单端点、多端点负载均衡、多端点+对冲下阻塞chat调用的p50/p99延迟和上游请求数
+
+用法: cd backend && python benchmarks/bench_hedging.py [请求数] [长尾比例] [长尾延迟毫秒]
+"""
+
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from core.adapter import ChatRequest, EndpointRegistry, HttpClientRegistry
+from core.adapter.dify_adapter import DifyAdapter
+
+API_KEY = "bench-key"
+REPLICAS = ["http://dify-a.bench/v1", "http://dify-b.bench/v1"]
+BASE_LATENCY = 0.02
+
+SCENARIOS = {
+    "single": {"base_url": REPLICAS[0]},
+    "balanced": {"base_url": REPLICAS[0], "endpoints": [{"base_url": url} for url in REPLICAS]},
+    "hedged": {"base_url": REPLICAS[0], "endpoints": [{"base_url": url} for url in REPLICAS], "hedge": True},
+}
+
+upstream_calls = []
+
+
+def make_handler(tail_ratio: float, tail_latency: float):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        upstream_calls.append(request.url.host)
+        delay = tail_latency if random.random() < tail_ratio else BASE_LATENCY * random.uniform(0.8, 1.2)
+        await asyncio.sleep(delay)
+        body = {"answer": "ok", "conversation_id": "c", "message_id": "m", "metadata": {"usage": {"total_tokens": 1}}}
+        return httpx.Response(200, content=json.dumps(body).encode(), headers={"content-type": "application/json"})
+    return handler
+
+
+async def run(name: str, config: dict, n_requests: int):
+    config = {"api_key": API_KEY, "type": "chat", **config}
+    request = ChatRequest(query="你好", user_id=1, merchant_id=1, agent_id=1)
+    EndpointRegistry.clear()
+    upstream_calls.clear()
+    latencies = []
+    # 分批并发，先积累延迟样本再开始对冲
+    for _ in range(n_requests // 10):
+        async def one():
+            start = time.perf_counter()
+            await DifyAdapter(config).chat(request)
+            latencies.append(time.perf_counter() - start)
+        await asyncio.gather(*(one() for _ in range(10)))
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<9} p50={statistics.median(latencies) * 1000:7.1f}ms p99={p99 * 1000:7.1f}ms "
+          f"upstream_calls={len(upstream_calls)}")
+
+
+async def main(n_requests: int, tail_ratio: float, tail_ms: float):
+    handler = make_handler(tail_ratio, tail_ms / 1000)
+    for url in REPLICAS:
+        HttpClientRegistry._clients[(url, API_KEY)] = httpx.AsyncClient(
+            base_url=url, transport=httpx.MockTransport(handler)
+        )
+    print(f"requests={n_requests} tail_ratio={tail_ratio} tail={tail_ms}ms")
+    for name, config in SCENARIOS.items():
+        random.seed(0)
+        await run(name, config, n_requests)
+    await HttpClientRegistry.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.03,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 500.0
+    ))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+上游HTTP连接复用基准测试
+对比“每次请求新建httpx.AsyncClient”与HttpClientRegistry共享客户端
+在本地模拟上游上建立的TCP连接数与耗时
+
+用法: cd backend && python benchmarks/bench_http_pool.py [请求数]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from core.adapter.http_client import HttpClientRegistry
+
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 11\r\n"
+    b"Connection: keep-alive\r\n\r\n"
+    b'{"ok":true}'
+)
+
+
+class FakeUpstream:
+    """极简keep-alive HTTP服务器，只统计建立的连接数"""
+
+    def __init__(self):
+        self.connections = 0
+        self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                writer.write(RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def run_per_request(base_url: str, n: int):
+    """旧行为：每次请求都创建并关闭一个客户端"""
+    for _ in range(n):
+        client = httpx.AsyncClient(base_url=base_url, timeout=60.0)
+        try:
+            response = await client.post("/chat-messages", json={"query": "hi"})
+            response.raise_for_status()
+        finally:
+            await client.aclose()
+
+
+async def run_pooled(base_url: str, n: int):
+    """新行为：从注册表借用共享客户端"""
+    for _ in range(n):
+        client = HttpClientRegistry.get_client(base_url, "bench-key")
+        response = await client.post("/chat-messages", json={"query": "hi"})
+        response.raise_for_status()
+    await HttpClientRegistry.shutdown()
+
+
+async def main(n: int):
+    for name, runner in (("per-request client", run_per_request), ("pooled client", run_pooled)):
+        upstream = FakeUpstream()
+        base_url = await upstream.start()
+        start = time.perf_counter()
+        await runner(base_url, n)
+        elapsed = time.perf_counter() - start
+        await upstream.stop()
+        print(f"{name:<20} requests={n} connections={upstream.connections} "
+              f"total={elapsed * 1000:.1f}ms per_request={elapsed / n * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+JSON编解码基准测试
+模拟流式聊天中每个事件的JSON工作量：解析上游事件、序列化metadata统计长度、
+序列化转发给客户端的事件，对比标准库json与core.json_codec（orjson后端）
+
+用法: cd backend && python benchmarks/bench_json_codec.py [事件数]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import json_codec
+
+UPSTREAM_EVENT = json.dumps({
+    "event": "agent_message",
+    "task_id": "5ad4cb98-f0c7-4085-b384-88c403be6290",
+    "id": "5e52ce04-874b-4d27-9045-b3bc80def685",
+    "message_id": "5e52ce04-874b-4d27-9045-b3bc80def685",
+    "conversation_id": "45701982-8118-4bc5-8e9b-64562b4555f2",
+    "answer": "您好，请问有什么可以帮您？",
+    "created_at": 1705398420
+})
+
+
+def stdlib_event():
+    data = json.loads(UPSTREAM_EVENT)
+    metadata = {
+        "event": data["event"], "workflow_run_id": None, "task_id": data["task_id"],
+        "from_variable_selector": None, "id": data["id"], "created_at": data["created_at"],
+        "content": data["answer"]
+    }
+    length = len(json.dumps(metadata))
+    frame = f"data: {json.dumps(metadata)}\n\n"
+    return length + len(frame)
+
+
+def codec_event():
+    data = json_codec.loads(UPSTREAM_EVENT)
+    metadata = {
+        "event": data["event"], "workflow_run_id": None, "task_id": data["task_id"],
+        "from_variable_selector": None, "id": data["id"], "created_at": data["created_at"],
+        "content": data["answer"]
+    }
+    length = len(json_codec.dumps(metadata))
+    frame = b"data: " + json_codec.dumps(metadata) + b"\n\n"
+    return length + len(frame)
+
+
+def bench(name, fn, n):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<24} {best / n * 1e6:6.2f}us/event")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"json_codec backend: {json_codec.BACKEND}")
+    bench("stdlib json", stdlib_event, n)
+    bench(f"json_codec ({json_codec.BACKEND})", codec_event, n)
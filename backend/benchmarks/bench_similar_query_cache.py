@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+近似问题缓存基准测试
+生成一组基础问题及其改写（增删标点、空格、语气词、全角字符），
+统计改写问题的命中率、不同问题的误命中率，以及索引条目数不同时单次查找的耗时和内存占用
+
+用法: cd backend && python benchmarks/bench_similar_query_cache.py [基础问题数（最多84）] [相似度阈值]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.config import settings
+from core.similar_query_cache import SimilarIndex, fingerprint
+
+SUBJECTS = ["退货", "退款", "换货", "发票", "优惠券", "会员积分", "物流", "运费", "保修", "安装服务", "预约到店", "修改地址"]
+ACTIONS = ["怎么申请", "需要多久", "有什么条件", "在哪里查看", "可以取消吗", "收费吗", "怎么联系客服处理"]
+PREFIXES = ["", "请问", "你好，", "想问一下"]
+PARTICLES = ["", "呢", "吗", "呀", "啊"]
+PUNCTUATION = ["", "？", "?", "！", "。", "??"]
+
+
+def base_questions(n: int):
+    """互不相同的问题（主题+动作的组合不重复），前缀随机"""
+    pairs = [(subject, action) for subject in SUBJECTS for action in ACTIONS]
+    random.shuffle(pairs)
+    return [f"{random.choice(PREFIXES)}{subject}{action}" for subject, action in pairs[:n]]
+
+
+def reword(question: str) -> str:
+    """只改标点、空格、语气词和全半角"""
+    if random.random() < 0.3:
+        position = random.randint(1, len(question) - 1)
+        question = question[:position] + " " + question[position:]
+    question = question + random.choice(PARTICLES) + random.choice(PUNCTUATION)
+    if random.random() < 0.3:
+        question = question.replace("?", "？").replace(",", "，")
+    return question
+
+
+def hit_rates(n_questions: int, threshold: float):
+    index = SimilarIndex(settings.SIMILAR_QUERY_MAX_ENTRIES, settings.SIMILAR_QUERY_MAX_BYTES)
+    questions = base_questions(n_questions)
+    cached, unseen = questions[: len(questions) // 2], questions[len(questions) // 2:]
+    for question in cached:
+        index.add("bench", *fingerprint(question), question.encode("utf-8"), 3600)
+
+    hits = correct = 0
+    for question in cached:
+        found = index.lookup("bench", *fingerprint(reword(question)), threshold)
+        hits += found is not None
+        correct += found is not None and found[0].decode("utf-8") == question
+    false_hits = sum(index.lookup("bench", *fingerprint(question), threshold) is not None for question in unseen)
+    print(f"threshold={threshold} cached={len(cached)} reworded_hit_rate={hits / len(cached):.2%} "
+          f"correct={correct}/{hits} false_hit_rate={false_hits / max(len(unseen), 1):.2%}")
+
+
+def lookup_latency(threshold: float):
+    signature, numbers = fingerprint("会员积分在哪里查看")
+    for entries in (100, 1000, 10000):
+        index = SimilarIndex(entries, 1 << 30)
+        for i in range(entries):
+            index.add("bench", *fingerprint(f"问题{i}的内容是什么"), b"x" * 200, 3600)
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            index.lookup("bench", signature, numbers, threshold)
+        elapsed = (time.perf_counter() - start) / rounds
+        print(f"entries={entries:<6} lookup={elapsed * 1e6:8.1f}us memory={index.memory_bytes() / 1024:8.1f}KB")
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 84
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else settings.SIMILAR_QUERY_THRESHOLD
+    hit_rates(n, threshold)
+    lookup_latency(threshold)
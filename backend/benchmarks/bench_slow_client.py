@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+慢客户端基准测试
+模拟按模型速度输出的Dify流和读取较慢的客户端（每帧之间等待），
+对比不解耦与各个慢客户端策略下上游连接读完（释放）的时间、客户端收完的时间和收到的帧数
+
+用法: cd backend && python benchmarks/bench_slow_client.py [token数] [token间隔毫秒] [客户端每帧耗时毫秒]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bench_stream_coalescing import BASE_URL, API_KEY, setup_database
+from core.adapter import ChatRequest, HttpClientRegistry
+from core.agent_cache import AgentCache
+from core.database import SessionLocal
+from models import Agent
+from routers.chat import stream_chat_response
+
+# 名称 -> Agent.config中的缓冲配置
+SCENARIOS = {
+    "unbuffered": {"stream_buffer_bytes": 0},
+    "block": {"stream_buffer_bytes": 16384, "stream_slow_client_policy": "block"},
+    "coalesce": {"stream_buffer_bytes": 16384, "stream_slow_client_policy": "coalesce"},
+    "drop": {"stream_buffer_bytes": 16384, "stream_slow_client_policy": "drop"},
+}
+
+# 当前这一轮上游流读完的时间
+upstream_done = []
+
+
+def make_handler(n_tokens: int, interval: float):
+    async def stream():
+        for i in range(n_tokens):
+            await asyncio.sleep(interval)
+            event = {"event": "message", "task_id": "t", "id": "m", "message_id": "m",
+                     "conversation_id": "c", "answer": f"词{i} ", "created_at": 1705398420}
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+        yield b'data: {"event": "message_end", "task_id": "t", "message_id": "m", "usage": {"total_tokens": 10}}\n\n'
+        upstream_done.append(time.perf_counter())
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+    return handler
+
+
+def create_agents(merchant_id: int, user_id: int):
+    db = SessionLocal()
+    agents = {}
+    for name, buffering in SCENARIOS.items():
+        agent = Agent(
+            merchant_id=merchant_id, name=f"slow-{name}", type="dify", created_by=user_id,
+            config={"base_url": BASE_URL, "api_key": API_KEY, "stream": True, "type": "chat", **buffering}
+        )
+        db.add(agent)
+        db.commit()
+        agents[name] = agent.id
+    db.close()
+    return agents
+
+
+async def run(name: str, agent_id: int, merchant_id: int, user_id: int, client_delay: float):
+    request = ChatRequest(query="写一段话", user_id=user_id, merchant_id=merchant_id,
+                          agent_id=agent_id, conversation_id=f"slow-{name}")
+    frames = 0
+    start = time.perf_counter()
+    async for frame in stream_chat_response(request, None):
+        frames += 1
+        await asyncio.sleep(client_delay)
+    client_done = time.perf_counter() - start
+    # drop策略下上游在客户端断开后继续读取，等待它结束
+    while not upstream_done:
+        await asyncio.sleep(0.01)
+    released = upstream_done.pop() - start
+    print(f"{name:<11} upstream_released={released * 1000:7.1f}ms client_done={client_done * 1000:7.1f}ms frames={frames}")
+
+
+async def main(n_tokens: int, interval_ms: float, client_ms: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, (merchant_id, user_id), _ = setup_database(os.path.join(tmp, "bench.db"), [])
+        agents = create_agents(merchant_id, user_id)
+        HttpClientRegistry._clients[(BASE_URL, API_KEY)] = httpx.AsyncClient(
+            base_url=BASE_URL, transport=httpx.MockTransport(make_handler(n_tokens, interval_ms / 1000))
+        )
+        print(f"tokens={n_tokens} interval={interval_ms}ms client={client_ms}ms/frame")
+        for name, agent_id in agents.items():
+            await run(name, agent_id, merchant_id, user_id, client_ms / 1000)
+        await HttpClientRegistry.shutdown()
+        AgentCache.clear()
+        await engine.dispose()
+        SessionLocal.kw["bind"].dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 2.0,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 6.0
+    ))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+SSE解码微基准测试
+对比旧的 aiter_lines() + line[6:] 逐行解析与新的 SSEDecoder 字节级增量解码，
+输入为模拟的Dify message事件流，分别按“每个chunk一条事件”和随机大小切分为网络chunk
+
+用法: cd backend && python benchmarks/bench_sse_decoder.py [事件数]
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from core.parser.sse_decoder import aiter_sse
+
+
+def build_chunks(n_events: int, random_split: bool):
+    """构造Dify风格的SSE字节流，按事件或随机大小切分为chunk"""
+    lines = []
+    for i in range(n_events):
+        event = {
+            "event": "message",
+            "task_id": "5ad4cb98-f0c7-4085-b384-88c403be6290",
+            "id": "5e52ce04-874b-4d27-9045-b3bc80def685",
+            "message_id": "5e52ce04-874b-4d27-9045-b3bc80def685",
+            "conversation_id": "45701982-8118-4bc5-8e9b-64562b4555f2",
+            "answer": f"token{i} ",
+            "created_at": 1705398420
+        }
+        lines.append(f"data: {json.dumps(event)}\n\n")
+        if i % 50 == 0:
+            lines.append("event: ping\n\n")
+    if not random_split:
+        # 上游逐事件flush：每个网络chunk恰好是一条事件
+        return [line.encode("utf-8") for line in lines]
+
+    payload = "".join(lines).encode("utf-8")
+    rng = random.Random(42)
+    chunks = []
+    pos = 0
+    while pos < len(payload):
+        size = rng.randint(64, 1024)
+        chunks.append(payload[pos:pos + size])
+        pos += size
+    return chunks
+
+
+class ChunkStream(httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+async def old_framing(chunks) -> int:
+    """旧实现（仅分帧）：逐行读取并切片"""
+    response = httpx.Response(200, stream=ChunkStream(chunks))
+    count = 0
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            count += 1
+    return count
+
+
+async def new_framing(chunks) -> int:
+    """新实现（仅分帧）：SSEDecoder按字节增量分帧"""
+    response = httpx.Response(200, stream=ChunkStream(chunks))
+    count = 0
+    async for sse_event in aiter_sse(response.aiter_bytes()):
+        if sse_event.data == "[DONE]":
+            break
+        count += 1
+    return count
+
+
+async def old_loop(chunks) -> int:
+    """旧实现：逐行读取、切片并解析JSON"""
+    response = httpx.Response(200, stream=ChunkStream(chunks))
+    count = 0
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            try:
+                data = json.loads(data_str)
+                if data.get("event"):
+                    count += 1
+            except json.JSONDecodeError:
+                continue
+    return count
+
+
+async def new_loop(chunks) -> int:
+    """新实现：SSEDecoder分帧并解析JSON"""
+    response = httpx.Response(200, stream=ChunkStream(chunks))
+    count = 0
+    async for sse_event in aiter_sse(response.aiter_bytes()):
+        if sse_event.data == "[DONE]":
+            break
+        try:
+            data = json.loads(sse_event.data)
+            if data.get("event"):
+                count += 1
+        except json.JSONDecodeError:
+            continue
+    return count
+
+
+async def bench(name: str, runner, chunks, rounds: int = 10):
+    best = float("inf")
+    count = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        count = await runner(chunks)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<24} events={count} chunks={len(chunks)} "
+          f"best={best * 1000:.1f}ms chunks/sec={len(chunks) / best:,.0f} events/sec={count / best:,.0f}")
+
+
+async def main(n_events: int):
+    for random_split in (False, True):
+        chunks = build_chunks(n_events, random_split)
+        print("== random chunk sizes ==" if random_split else "== one event per chunk ==")
+        await bench("aiter_lines (framing)", old_framing, chunks)
+        await bench("SSEDecoder (framing)", new_framing, chunks)
+        await bench("aiter_lines + json", old_loop, chunks)
+        await bench("SSEDecoder + json", new_loop, chunks)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+流式文本块合并基准测试
+模拟快速模型（每隔几毫秒一个token）的Dify流，对比不合并与按不同窗口合并时
+转发给客户端的SSE帧数、字节数，以及首个文本帧的延迟
+
+用法: cd backend && python benchmarks/bench_stream_coalescing.py [token数] [token间隔毫秒]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core import json_codec
+from core.database import AsyncSessionLocal, Base, SessionLocal
+from core.adapter import ChatRequest, HttpClientRegistry
+from core.agent_cache import AgentCache
+from models import Agent, Merchant, User
+from routers.chat import stream_chat_response
+
+BASE_URL = "http://dify.coalesce/v1"
+API_KEY = "coalesce-key"
+
+
+def make_handler(n_tokens: int, interval: float):
+    async def stream():
+        for i in range(n_tokens):
+            await asyncio.sleep(interval)
+            event = {"event": "message", "task_id": "t", "id": "m", "message_id": "m",
+                     "conversation_id": "c", "answer": f"词{i} ", "created_at": 1705398420}
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+        yield b'data: {"event": "message_end", "task_id": "t", "message_id": "m", "usage": {"total_tokens": 10}}\n\n'
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+    return handler
+
+
+def setup_database(path: str, windows):
+    SessionLocal.configure(bind=create_engine(f"sqlite:///{path}"))
+    Base.metadata.create_all(bind=SessionLocal.kw["bind"])
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", json_serializer=json_codec.dumps_str, json_deserializer=json_codec.loads
+    )
+    AsyncSessionLocal.configure(bind=engine)
+
+    db = SessionLocal()
+    merchant = Merchant(name="bench", api_key="bench", balance=0)
+    db.add(merchant)
+    db.commit()
+    user = User(merchant_id=merchant.id, username="bench", email="bench@example.com", password_hash="x")
+    db.add(user)
+    db.commit()
+    agents = {}
+    for window in windows:
+        agent = Agent(
+            merchant_id=merchant.id, name=f"coalesce-{window}", type="dify", created_by=user.id,
+            config={"base_url": BASE_URL, "api_key": API_KEY, "stream": True, "type": "chat",
+                    "stream_coalesce_ms": window}
+        )
+        db.add(agent)
+        db.commit()
+        agents[window] = agent.id
+    ids = (merchant.id, user.id)
+    db.close()
+    return engine, ids, agents
+
+
+async def run(window: int, agent_id: int, merchant_id: int, user_id: int):
+    request = ChatRequest(query="写一段话", user_id=user_id, merchant_id=merchant_id,
+                          agent_id=agent_id, conversation_id=f"coalesce-{window}")
+    frames = 0
+    text_frames = 0
+    total_bytes = 0
+    first_text = None
+    content = []
+    start = time.perf_counter()
+    async for frame in stream_chat_response(request, None):
+        frames += 1
+        total_bytes += len(frame)
+        if frame.startswith(b'data: {"event":"message"'):
+            text_frames += 1
+            content.append(json_codec.loads(frame[6:])["content"])
+            if first_text is None:
+                first_text = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    name = "off" if window == 0 else f"{window}ms"
+    print(f"coalesce={name:<6} frames={frames:<5} text_frames={text_frames:<5} bytes={total_bytes:<7} "
+          f"first_text={first_text * 1000:6.1f}ms total={elapsed * 1000:7.1f}ms chars={len(''.join(content))}")
+
+
+async def main(n_tokens: int, interval_ms: float):
+    windows = [0, 15, 30, 50]
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, (merchant_id, user_id), agents = setup_database(os.path.join(tmp, "bench.db"), windows)
+        HttpClientRegistry._clients[(BASE_URL, API_KEY)] = httpx.AsyncClient(
+            base_url=BASE_URL, transport=httpx.MockTransport(make_handler(n_tokens, interval_ms / 1000))
+        )
+        print(f"tokens={n_tokens} interval={interval_ms}ms")
+        for window in windows:
+            await run(window, agents[window], merchant_id, user_id)
+        await HttpClientRegistry.shutdown()
+        AgentCache.clear()
+        await engine.dispose()
+        SessionLocal.kw["bind"].dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    ))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+流式响应压缩基准测试
+先录制一个流实际发送的SSE帧（verbose/compact × 不合并/合并30ms），
+再按每帧flush的方式分别用identity、gzip、br（已安装brotli时）压缩，
+对比每个流的线上字节数和压缩额外消耗的CPU时间（取多轮最小值）
+
+用法: cd backend && python benchmarks/bench_stream_compression.py [token数] [轮数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bench_stream_coalescing import BASE_URL, API_KEY, make_handler, setup_database
+from core.adapter import ChatRequest, HttpClientRegistry
+from core.agent_cache import AgentCache
+from core.compression import SUPPORTED_ENCODINGS, StreamCompressor
+from core.database import SessionLocal
+from core.stream_format import STREAM_FORMATS
+from routers.chat import stream_chat_response
+
+
+async def record(stream_format: str, window: int, agent_id: int, merchant_id: int, user_id: int):
+    request = ChatRequest(query="写一段话", user_id=user_id, merchant_id=merchant_id,
+                          agent_id=agent_id, conversation_id=f"compress-{stream_format}-{window}")
+    return [frame async for frame in stream_chat_response(request, None, stream_format)]
+
+
+def compress_frames(frames, encoding: str):
+    compressor = StreamCompressor(encoding)
+    output = [compressor.compress(frame) for frame in frames]
+    output.append(compressor.finish())
+    return output
+
+
+def check_incremental(frames, encoding: str):
+    """每帧flush后，客户端已收到的数据必须能解压出该帧的全部内容"""
+    if encoding == "br":
+        import brotli
+        decompressor = brotli.Decompressor()
+        feed = decompressor.process
+    else:
+        decompressor = zlib.decompressobj(31)
+        feed = decompressor.decompress
+    compressor = StreamCompressor(encoding)
+    for frame in frames:
+        assert feed(compressor.compress(frame)) == frame
+
+
+def measure(frames, encoding: str, rounds: int):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.process_time()
+        output = compress_frames(frames, encoding)
+        best = min(best, time.process_time() - start)
+    return sum(len(chunk) for chunk in output), best
+
+
+async def main(n_tokens: int, rounds: int):
+    windows = [0, 30]
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, (merchant_id, user_id), agents = setup_database(os.path.join(tmp, "bench.db"), windows)
+        HttpClientRegistry._clients[(BASE_URL, API_KEY)] = httpx.AsyncClient(
+            base_url=BASE_URL, transport=httpx.MockTransport(make_handler(n_tokens, 0.002))
+        )
+        print(f"tokens={n_tokens} rounds={rounds} encodings={','.join(SUPPORTED_ENCODINGS)}")
+        for window in windows:
+            for stream_format in STREAM_FORMATS:
+                frames = await record(stream_format, window, agents[window], merchant_id, user_id)
+                raw = sum(len(frame) for frame in frames)
+                name = "off" if window == 0 else f"{window}ms"
+                print(f"format={stream_format:<8} coalesce={name:<5} frames={len(frames):<5} identity={raw}")
+                for encoding in SUPPORTED_ENCODINGS:
+                    check_incremental(frames, encoding)
+                    size, cpu = measure(frames, encoding, rounds)
+                    print(f"    {encoding:<5} bytes={size:<7} ratio={size / raw:5.1%} "
+                          f"cpu={cpu * 1000:6.2f}ms/stream ({cpu / len(frames) * 1e6:5.1f}us/frame)")
+        await HttpClientRegistry.shutdown()
+        AgentCache.clear()
+        await engine.dispose()
+        SessionLocal.kw["bind"].dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    ))
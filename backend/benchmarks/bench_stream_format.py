@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+流式传输格式基准测试
+对比verbose（默认，完整Dify元数据）与compact（文本事件只发送增量）格式下
+每个流发送给客户端的字节数，分别在不合并和合并文本块（30ms）时测量
+
+用法: cd backend && python benchmarks/bench_stream_format.py [token数] [token间隔毫秒]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bench_stream_coalescing import BASE_URL, API_KEY, make_handler, setup_database
+from core.adapter import ChatRequest, HttpClientRegistry
+from core.agent_cache import AgentCache
+from core.database import SessionLocal
+from core.stream_format import STREAM_FORMATS
+from routers.chat import stream_chat_response
+
+
+async def run(stream_format: str, window: int, agent_id: int, merchant_id: int, user_id: int):
+    request = ChatRequest(query="写一段话", user_id=user_id, merchant_id=merchant_id,
+                          agent_id=agent_id, conversation_id=f"format-{stream_format}-{window}")
+    frames = 0
+    total_bytes = 0
+    async for frame in stream_chat_response(request, None, stream_format):
+        frames += 1
+        total_bytes += len(frame)
+    name = "off" if window == 0 else f"{window}ms"
+    print(f"format={stream_format:<8} coalesce={name:<5} frames={frames:<5} bytes={total_bytes}")
+
+
+async def main(n_tokens: int, interval_ms: float):
+    windows = [0, 30]
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, (merchant_id, user_id), agents = setup_database(os.path.join(tmp, "bench.db"), windows)
+        HttpClientRegistry._clients[(BASE_URL, API_KEY)] = httpx.AsyncClient(
+            base_url=BASE_URL, transport=httpx.MockTransport(make_handler(n_tokens, interval_ms / 1000))
+        )
+        print(f"tokens={n_tokens} interval={interval_ms}ms")
+        for window in windows:
+            for stream_format in STREAM_FORMATS:
+                await run(stream_format, window, agents[window], merchant_id, user_id)
+        await HttpClientRegistry.shutdown()
+        AgentCache.clear()
+        await engine.dispose()
+        SessionLocal.kw["bind"].dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    ))
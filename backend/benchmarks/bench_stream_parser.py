@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+流式事件解析基准测试
+对比旧实现（if/elif链 + 每块构造pydantic ChatResponse + 路由层复制metadata）
+与新实现（查表分发 + StreamChunk）在 message/agent_message/text_chunk 事件上的
+单块CPU耗时与内存占用
+
+用法: cd backend && python benchmarks/bench_stream_parser.py [事件数]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.adapter.base import ChatRequest, ChatResponse
+from core.parser.dify_parser import DifyResponseParser
+
+REQUEST = ChatRequest(query="你好", user_id=1, merchant_id=1, agent_id=1, conversation_id="c-1")
+
+EVENTS = {
+    "message": {
+        "event": "message", "task_id": "t-1", "id": "m-1", "message_id": "m-1",
+        "conversation_id": "c-1", "answer": "你好", "created_at": 1705398420
+    },
+    "agent_message": {
+        "event": "agent_message", "task_id": "t-1", "id": "m-1", "message_id": "m-1",
+        "conversation_id": "c-1", "answer": "你好", "created_at": 1705398420
+    },
+    "text_chunk": {
+        "event": "text_chunk", "task_id": "t-1", "workflow_run_id": "w-1",
+        "data": {"text": "你好", "from_variable_selector": ["1745912968134", "text"]}
+    },
+}
+
+
+def old_parse(data, event, request):
+    """旧实现：字符流事件分支 + pydantic模型 + 路由层copy"""
+    if event == "text_chunk" or event == "message" or event == "agent_message":
+        if event == "text_chunk":
+            chunk_data = data.get("data", {})
+            text = chunk_data.get("text", "")
+            task_id = data.get("task_id")
+            workflow_run_id = data.get("workflow_run_id")
+            from_variable_selector = chunk_data.get("from_variable_selector")
+            message_id = None
+            created_at = None
+            id_value = None
+        else:
+            text = data.get("answer", "")
+            task_id = data.get("task_id")
+            message_id = data.get("message_id")
+            created_at = data.get("created_at")
+            id_value = data.get("id")
+            workflow_run_id = None
+            from_variable_selector = None
+        response = ChatResponse(
+            message=text,
+            conversation_id=request.conversation_id,
+            message_id=task_id or message_id or "",
+            metadata={
+                "event": event,
+                "workflow_run_id": workflow_run_id,
+                "task_id": task_id,
+                "from_variable_selector": from_variable_selector,
+                "id": id_value,
+                "created_at": created_at
+            }
+        )
+        event_data = response.metadata.copy()
+        if event_data.get("event") in ["text_chunk", "message", "agent_message"] and response.message:
+            event_data["content"] = response.message
+        return response, event_data
+    return None
+
+
+def new_parse(data, event, request):
+    """新实现：查表分发 + StreamChunk，content已在提取时写入"""
+    chunk = DifyResponseParser.parse_streaming_event(data, event, False, request)
+    event_data = chunk.metadata
+    if "content" not in event_data and chunk.message:
+        event_data = {**event_data, "content": chunk.message}
+    return chunk, event_data
+
+
+def measure(name, fn, n):
+    for event, data in EVENTS.items():
+        # CPU
+        best = float("inf")
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(n):
+                fn(data, event, REQUEST)
+            best = min(best, time.perf_counter() - start)
+
+        # 内存：保留全部结果，统计每块占用字节数
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [fn(data, event, REQUEST) for _ in range(n)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+
+        print(f"{name:<4} {event:<14} {best / n * 1e6:6.2f}us/chunk  {(after - before) / n:7.1f} bytes/chunk")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    measure("old", old_parse, n)
+    measure("new", new_parse, n)
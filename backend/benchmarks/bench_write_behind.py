@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+消息写回基准测试
+对比同步写库（每次聊天一个事务）与异步写回（后台批量executemany）时，
+请求路径上保存一次聊天的耗时和全部写入完成的总耗时
+
+用法: cd backend && python benchmarks/bench_write_behind.py [聊天数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core import json_codec
+from core.config import settings
+from core.database import AsyncSessionLocal, Base, SessionLocal
+from core.adapter import ChatRequest
+from core.chat_service import ChatService
+from core.message_persister import MessagePersister
+from core.stream_accumulator import StreamAccumulator
+from core.adapter.base import StreamChunk
+from models import Agent, Merchant, User, Message
+
+
+def setup_database(path: str):
+    # 同步引擎只用于建表和准备数据，写入使用异步引擎
+    SessionLocal.configure(bind=create_engine(f"sqlite:///{path}"))
+    Base.metadata.create_all(bind=SessionLocal.kw["bind"])
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", json_serializer=json_codec.dumps_str, json_deserializer=json_codec.loads
+    )
+    AsyncSessionLocal.configure(bind=engine)
+    db = SessionLocal()
+    merchant = Merchant(name="bench", api_key="bench", balance=0)
+    db.add(merchant)
+    db.commit()
+    user = User(merchant_id=merchant.id, username="bench", email="bench@example.com", password_hash="x")
+    db.add(user)
+    db.commit()
+    agent = Agent(merchant_id=merchant.id, name="bench", type="dify", created_by=user.id, config={})
+    db.add(agent)
+    db.commit()
+    ids = (merchant.id, user.id, agent.id)
+    db.close()
+    return engine, ids
+
+
+def build_accumulator(request: ChatRequest) -> StreamAccumulator:
+    accumulator = StreamAccumulator(request)
+    for i in range(20):
+        accumulator.add(StreamChunk(message=f"tok{i} ", metadata={"event": "message", "content": f"tok{i} "}))
+    accumulator.add(StreamChunk(message="", metadata={"event": "message_end", "usage": {"total_tokens": 10}}))
+    return accumulator
+
+
+async def run(n_chats: int, write_behind: bool):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, (merchant_id, user_id, agent_id) = setup_database(os.path.join(tmp, "bench.db"))
+        settings.MESSAGE_WRITE_BEHIND = write_behind
+        settings.MESSAGE_SPOOL_PATH = os.path.join(tmp, "spool.jsonl")
+        await MessagePersister.startup()
+
+        service = ChatService()
+        latencies = []
+        start = time.perf_counter()
+        for i in range(n_chats):
+            request = ChatRequest(
+                query=f"question {i}", user_id=user_id, merchant_id=merchant_id,
+                agent_id=agent_id, conversation_id=f"bench-{i:06d}"
+            )
+            accumulator = build_accumulator(request)
+            t0 = time.perf_counter()
+            await service.save_stream_result(request, accumulator)
+            latencies.append(time.perf_counter() - t0)
+            # 模拟请求之间让出事件循环
+            await asyncio.sleep(0)
+        await MessagePersister.shutdown()
+        elapsed = time.perf_counter() - start
+
+        db = SessionLocal()
+        saved = db.query(func.count(Message.id)).scalar()
+        db.close()
+        await engine.dispose()
+        SessionLocal.kw["bind"].dispose()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    name = "write-behind" if write_behind else "sync"
+    print(f"{name:<13} chats={n_chats} messages_saved={saved} "
+          f"request_path p50={p50:8.1f}us p99={p99:8.1f}us total={elapsed:.2f}s")
+
+
+async def main(n_chats: int):
+    await run(n_chats, False)
+    await run(n_chats, True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
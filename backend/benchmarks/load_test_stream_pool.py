@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+流式聊天数据库连接占用压测
+使用容量为5（无溢出）的连接池，并发运行数百个流式聊天（上游为慢速的模拟Dify），
+验证上游流式传输期间不占用数据库连接：所有流都能完成、消息全部落库，
+并统计同时被借出的最大连接数
+
+用法: cd backend && python benchmarks/load_test_stream_pool.py [并发数] [每个流的事件数]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import httpx
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core import json_codec
+from core.database import AsyncSessionLocal, Base, SessionLocal
+from core.adapter import ChatRequest, HttpClientRegistry
+from models import Agent, Merchant, User, Message
+from routers.chat import stream_chat_response
+
+BASE_URL = "http://dify.loadtest/v1"
+API_KEY = "loadtest-key"
+POOL_SIZE = 5
+
+
+def make_handler(n_events: int, delay: float):
+    """模拟Dify：每个事件之间间隔delay秒"""
+    async def stream():
+        for i in range(n_events):
+            await asyncio.sleep(delay)
+            yield f"data: {json.dumps({'event': 'message', 'task_id': 't', 'message_id': 'm', 'answer': f'tok{i} '})}\n\n".encode()
+        yield b'data: {"event": "message_end", "task_id": "t", "message_id": "m", "usage": {"total_tokens": 10}}\n\n'
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+    return handler
+
+
+def setup_database(path: str):
+    # 同步引擎只用于建表和准备数据，聊天链路使用异步引擎
+    SessionLocal.configure(bind=create_engine(f"sqlite:///{path}"))
+    Base.metadata.create_all(bind=SessionLocal.kw["bind"])
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        pool_size=POOL_SIZE,
+        max_overflow=0,
+        pool_timeout=5,
+        json_serializer=json_codec.dumps_str,
+        json_deserializer=json_codec.loads
+    )
+    AsyncSessionLocal.configure(bind=engine)
+
+    stats = {"checked_out": 0, "max_checked_out": 0}
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def on_checkout(*args):
+        stats["checked_out"] += 1
+        stats["max_checked_out"] = max(stats["max_checked_out"], stats["checked_out"])
+
+    @event.listens_for(engine.sync_engine, "checkin")
+    def on_checkin(*args):
+        stats["checked_out"] -= 1
+
+    db = SessionLocal()
+    merchant = Merchant(name="loadtest", api_key="loadtest", balance=0)
+    db.add(merchant)
+    db.commit()
+    user = User(merchant_id=merchant.id, username="loadtest", email="loadtest@example.com", password_hash="x")
+    db.add(user)
+    db.commit()
+    agent = Agent(
+        merchant_id=merchant.id, name="loadtest", type="dify", created_by=user.id,
+        config={"base_url": BASE_URL, "api_key": API_KEY, "stream": True, "type": "chat"}
+    )
+    db.add(agent)
+    db.commit()
+    ids = (merchant.id, user.id, agent.id)
+    db.close()
+    return engine, stats, ids
+
+
+async def run_stream(index: int, merchant_id: int, user_id: int, agent_id: int) -> bool:
+    request = ChatRequest(
+        query=f"question {index}", user_id=user_id, merchant_id=merchant_id,
+        agent_id=agent_id, conversation_id=f"loadtest-{index:05d}"
+    )
+    done = False
+    async for frame in stream_chat_response(request, None):
+        if frame == b"data: [DONE]\n\n":
+            done = True
+        elif b'"error"' in frame[:20]:
+            return False
+    return done
+
+
+async def main(concurrency: int, n_events: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, stats, (merchant_id, user_id, agent_id) = setup_database(os.path.join(tmp, "loadtest.db"))
+        HttpClientRegistry._clients[(BASE_URL, API_KEY)] = httpx.AsyncClient(
+            base_url=BASE_URL, transport=httpx.MockTransport(make_handler(n_events, 0.05))
+        )
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_stream(i, merchant_id, user_id, agent_id) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        db = SessionLocal()
+        saved = db.query(func.count(Message.id)).scalar()
+        db.close()
+        await HttpClientRegistry.shutdown()
+        await engine.dispose()
+        SessionLocal.kw["bind"].dispose()
+
+    ok = sum(results)
+    print(f"pool_size={POOL_SIZE} max_overflow=0 concurrent_streams={concurrency} events_per_stream={n_events}")
+    print(f"completed={ok}/{concurrency} messages_saved={saved} elapsed={elapsed:.2f}s "
+          f"max_connections_checked_out={stats['max_checked_out']}")
+    if ok != concurrency or stats["max_checked_out"] > POOL_SIZE:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    ))
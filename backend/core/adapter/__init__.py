@@ -1,11 +1,16 @@
-from .base import BaseAdapter, ChatRequest, ChatResponse
+from .base import BaseAdapter, ChatRequest, ChatResponse, StreamChunk
 from .factory import AdapterFactory
 from .dify_adapter import DifyAdapter
+from .endpoints import EndpointRegistry
+from .http_client import HttpClientRegistry
 
 __all__ = [
     "BaseAdapter",
     "ChatRequest",
     "ChatResponse",
+    "StreamChunk",
     "AdapterFactory",
-    "DifyAdapter"
+    "DifyAdapter",
+    "EndpointRegistry",
+    "HttpClientRegistry"
 ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from typing import Dict, Any, AsyncGenerator, Optional, List
-from pydantic import BaseModel, Field, validator, root_validator
+from pydantic import BaseModel, Field, PrivateAttr, validator, root_validator
 
 class Message(BaseModel):
     """OpenAI格式的消息"""
@@ -20,6 +21,28 @@ class ChatRequest(BaseModel):
     merchant_id: int
     agent_id: int
     extra_data: Optional[Dict[str, Any]] = None
+    
+    # 本地对话对应的上游（Dify）对话ID，由ChatService查出后设置，不从请求体读取
+    _upstream_conversation_id: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def upstream_conversation_id(self) -> Optional[str]:
+        return self._upstream_conversation_id
+
+    @upstream_conversation_id.setter
+    def upstream_conversation_id(self, value: Optional[str]):
+        self._upstream_conversation_id = value
+
+    # 智能体是否开启了续用上游对话，由ChatService设置；未开启时不记录上游返回的对话ID
+    _forward_conversation: bool = PrivateAttr(default=False)
+
+    @property
+    def forward_conversation(self) -> bool:
+        return self._forward_conversation
+
+    @forward_conversation.setter
+    def forward_conversation(self, value: bool):
+        self._forward_conversation = value
 
     @root_validator(pre=True)
     def validate_query_or_messages(cls, values):
@@ -63,6 +86,20 @@ class ChatResponse(BaseModel):
     total_tokens_estimated: Optional[int] = None  # 新增：估算的总token数
     estimated_cost: Optional[float] = None       # 新增：估算的费用
 
+@dataclass(slots=True)
+class StreamChunk:
+    """流式响应块 - 流式热路径内部使用的轻量对象
+
+    字段与ChatResponse保持一致，避免每个token块都构造一次pydantic模型。
+    """
+    message: str
+    conversation_id: Optional[str] = None
+    message_id: Optional[str] = None
+    metadata: Optional[Dict[str, Any]] = None
+    total_tokens: Optional[int] = None
+    total_tokens_estimated: Optional[int] = None
+    estimated_cost: Optional[float] = None
+
 class BaseAdapter(ABC):
     """平台适配器基类"""
     
@@ -75,7 +112,7 @@ class BaseAdapter(ABC):
         pass
     
     @abstractmethod
-    async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[ChatResponse, None]:
+    async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[StreamChunk, None]:
         """处理流式聊天请求"""
         pass
     
@@ -89,6 +126,10 @@ class BaseAdapter(ABC):
         """删除对话"""
         pass
     
+    async def stop(self, task_id: str, request: ChatRequest) -> bool:
+        """通知上游停止生成（客户端断开时调用），不支持时返回False"""
+        return False
+    
     @abstractmethod
     async def close(self):
         """关闭适配器连接"""
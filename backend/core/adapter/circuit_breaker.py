@@ -0,0 +1,148 @@
+"""
+上游端点的熔断器
+
+    closed     正常放行，在最近 ENDPOINT_BREAKER_WINDOW 次调用的滑动窗口里统计失败率和慢调用率
+    open       直接拒绝（快速失败），ENDPOINT_BREAKER_OPEN_SECONDS 秒后进入half_open
+    half_open  只放行 ENDPOINT_BREAKER_HALF_OPEN_CALLS 个探测请求，全部成功则closed，任一失败则重新open；
+               只统计本轮探测请求的结果，熔断前发出、探测期间才返回的请求不计入
+
+closed状态下满足任一条件时open：
+    - 连续失败 ENDPOINT_BREAKER_CONSECUTIVE_FAILURES 次（流量小时也能尽快熔断）；
+    - 窗口内调用数不少于 ENDPOINT_BREAKER_MIN_CALLS，且失败率达到 ENDPOINT_BREAKER_FAILURE_RATE；
+    - 同上，且慢调用（超过 ENDPOINT_BREAKER_SLOW_SECONDS）比例达到 ENDPOINT_BREAKER_SLOW_RATE。
+失败指连接错误、超时、5xx和429；其他4xx和被取消的调用不计入。
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+from core.config import settings
+from core.metrics import Metrics
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """端点熔断中，请求未发出"""
+
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"Upstream {endpoint} is unavailable (circuit open), retry after {retry_after}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """一个端点的熔断器"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = STATE_CLOSED
+        # 最近调用的结果：(是否失败, 是否慢调用)
+        self.window: Deque[Tuple[bool, bool]] = deque(maxlen=max(settings.ENDPOINT_BREAKER_WINDOW, 1))
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes = 0  # half_open状态下进行中的探测请求数
+        self.probe_successes = 0
+        self.round = 0  # 进入half_open的次数，探测请求用它标识所属的一轮
+
+    def _open_seconds(self) -> float:
+        return settings.ENDPOINT_BREAKER_OPEN_SECONDS
+
+    def retry_after(self) -> int:
+        remaining = self.opened_at + self._open_seconds() - time.monotonic()
+        return max(int(remaining + 0.999), 1)
+
+    def allows(self) -> bool:
+        """当前是否可以发出请求（不占用探测名额，用于选择端点）"""
+        if self.state == STATE_OPEN:
+            return time.monotonic() - self.opened_at >= self._open_seconds()
+        if self.state == STATE_HALF_OPEN:
+            return self.probes < settings.ENDPOINT_BREAKER_HALF_OPEN_CALLS
+        return True
+
+    def acquire(self) -> int:
+        """发出请求前调用，熔断中时抛出UpstreamUnavailable
+
+        返回探测标记：half_open状态下的探测请求为本轮的编号（非0），其他请求为0；
+        请求结束时原样传给release和record
+        """
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self.opened_at < self._open_seconds():
+                Metrics.incr("upstream_breaker_rejected_total", endpoint=self.name)
+                raise UpstreamUnavailable(self.name, self.retry_after())
+            self._transition(STATE_HALF_OPEN)
+        if self.state == STATE_HALF_OPEN:
+            if self.probes >= settings.ENDPOINT_BREAKER_HALF_OPEN_CALLS:
+                Metrics.incr("upstream_breaker_rejected_total", endpoint=self.name)
+                raise UpstreamUnavailable(self.name, 1)
+            self.probes += 1
+            return self.round
+        return 0
+
+    def _current_probe(self, probe: int) -> bool:
+        return probe != 0 and probe == self.round and self.state == STATE_HALF_OPEN
+
+    def release(self, probe: int):
+        """请求结束（无论结果）时调用，本轮的探测请求归还探测名额"""
+        if self._current_probe(probe) and self.probes > 0:
+            self.probes -= 1
+
+    def record(self, failed: bool, latency: float = 0.0, probe: int = 0):
+        """记录一次调用结果，probe为acquire的返回值"""
+        slow = not failed and latency > settings.ENDPOINT_BREAKER_SLOW_SECONDS > 0
+        if self.state == STATE_HALF_OPEN:
+            if not self._current_probe(probe):
+                # 熔断前（或上一轮）发出的请求在探测期间返回，不代表端点已恢复
+                return
+            if failed or slow:
+                self._transition(STATE_OPEN)
+            else:
+                self.probe_successes += 1
+                if self.probe_successes >= settings.ENDPOINT_BREAKER_HALF_OPEN_CALLS:
+                    self._transition(STATE_CLOSED)
+            return
+        if self.state == STATE_OPEN:
+            # 熔断前发出的请求陆续返回，不影响状态
+            return
+
+        self.window.append((failed, slow))
+        self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+        if 0 < settings.ENDPOINT_BREAKER_CONSECUTIVE_FAILURES <= self.consecutive_failures:
+            self._transition(STATE_OPEN)
+            return
+        calls = len(self.window)
+        if calls < max(settings.ENDPOINT_BREAKER_MIN_CALLS, 1):
+            return
+        failures = sum(1 for failed, _ in self.window if failed)
+        slow_calls = sum(1 for _, slow in self.window if slow)
+        if failures / calls >= settings.ENDPOINT_BREAKER_FAILURE_RATE or slow_calls / calls >= settings.ENDPOINT_BREAKER_SLOW_RATE:
+            self._transition(STATE_OPEN)
+
+    def _transition(self, state: str):
+        self.state = state
+        self.probes = 0
+        self.probe_successes = 0
+        if state == STATE_HALF_OPEN:
+            self.round += 1
+        elif state == STATE_OPEN:
+            self.opened_at = time.monotonic()
+            Metrics.incr("upstream_breaker_opened_total", endpoint=self.name)
+        elif state == STATE_CLOSED:
+            self.window.clear()
+            self.consecutive_failures = 0
+        Metrics.set("upstream_breaker_open", 0 if state == STATE_CLOSED else 1, endpoint=self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        calls = len(self.window)
+        snapshot = {
+            "state": self.state,
+            "calls": calls,
+            "failure_rate": round(sum(1 for failed, _ in self.window if failed) / calls, 3) if calls else 0.0,
+            "slow_rate": round(sum(1 for _, slow in self.window if slow) / calls, 3) if calls else 0.0,
+            "consecutive_failures": self.consecutive_failures
+        }
+        if self.state == STATE_OPEN:
+            snapshot["retry_after"] = self.retry_after()
+        return snapshot
@@ -1,392 +1,35 @@
+import asyncio
 import httpx
 import json
 import logging
-import os
+import math
+import time
 from typing import AsyncGenerator, Dict, Any, Optional
 from httpx import HTTPStatusError, RequestError
-from .base import ChatRequest, ChatResponse
+from .base import ChatRequest, ChatResponse, StreamChunk
+from .circuit_breaker import UpstreamUnavailable
+from .endpoints import Endpoint, EndpointRegistry, default_base_url
+from .timeouts import PHASE_CONNECT, PHASE_FIRST_EVENT, PHASE_IDLE, PHASE_TOTAL, UpstreamTimeout, UpstreamTimeouts
+# 按模块导入，用到时再取DifyResponseParser：dify_parser依赖core.adapter.base，先导入core.parser时这里拿到的是尚未执行完的模块
+from core.parser import dify_parser
+from core.parser.sse_decoder import aiter_sse
+from core import json_codec
+from core.metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
+# 停止生成请求的超时（秒），客户端已断开，不值得久等
+STOP_TIMEOUT = 5.0
 
-class DifyResponseParser:
-    """Dify响应解析器 - 统一处理流式和非流式响应"""
-    
-    @staticmethod
-    def parse_blocking_response(response_data: Dict[str, Any], is_workflow: bool) -> ChatResponse:
-        """解析非流式响应"""
-        if is_workflow:
-            # 工作流响应处理 - 根据Dify官方API文档结构
-            # 工作流响应结构有两种可能：
-            # 1. 直接包含状态字段: {"workflow_run_id", "task_id", "status", "outputs", "error", "elapsed_time", "total_tokens", "total_steps", "created_at", "finished_at"}
-            # 2. 嵌套在data字段中: {"task_id", "workflow_run_id", "data": {"status", "outputs", "error", "elapsed_time", "total_tokens", "total_steps", "created_at", "finished_at"}}
-            
-            # 检查是否是嵌套结构
-            if "data" in response_data and isinstance(response_data["data"], dict):
-                # 嵌套结构：从data字段提取实际数据
-                data = response_data["data"]
-                outputs = data.get("outputs", {})
-                workflow_run_id = response_data.get("workflow_run_id")
-                task_id = response_data.get("task_id")
-            else:
-                # 直接结构
-                data = response_data
-                outputs = response_data.get("outputs", {})
-                workflow_run_id = response_data.get("workflow_run_id")
-                task_id = response_data.get("task_id")
-            
-            # 从outputs字段提取消息内容
-            message = ""
-            if isinstance(outputs, dict):
-                # 优先从outputs.text提取消息
-                message = outputs.get("text", "")
-                # 如果没有text字段，尝试output字段（Dify工作流常用）
-                if not message:
-                    message = outputs.get("output", "")
-                # 如果还没有，尝试其他可能的文本字段
-                if not message:
-                    for key, value in outputs.items():
-                        if isinstance(value, str) and value.strip():
-                            message = value
-                            break
-                        elif isinstance(value, dict):
-                            # 检查嵌套字典中的文本字段
-                            nested_text = value.get("text", "")
-                            if nested_text:
-                                message = nested_text
-                                break
-            
-            total_tokens = data.get("total_tokens", 0)
-            return ChatResponse(
-                message=message,
-                conversation_id=response_data.get("conversation_id"),
-                message_id=task_id,
-                metadata={
-                    "workflow_run_id": workflow_run_id,
-                    "task_id": task_id,
-                    "status": data.get("status"),
-                    "elapsed_time": data.get("elapsed_time"),
-                    "total_tokens": total_tokens,
-                    "total_steps": data.get("total_steps"),
-                    "created_at": data.get("created_at"),
-                    "finished_at": data.get("finished_at"),
-                    "error": data.get("error")
-                },
-                total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
-            )
-        else:
-            # 聊天接口响应处理
-            usage = response_data.get("usage", {})
-            total_tokens = usage.get("total_tokens", 0)
-            return ChatResponse(
-                message=response_data.get("answer", ""),
-                conversation_id=response_data.get("conversation_id"),
-                message_id=response_data.get("message_id"),
-                metadata={
-                    "task_id": response_data.get("task_id"),
-                    "conversation_id": response_data.get("conversation_id"),
-                    "metadata": response_data.get("metadata"),
-                    "usage": usage,
-                    "retriever_resources": response_data.get("retriever_resources")
-                },
-                total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
-            )
-    
-    @staticmethod
-    def parse_streaming_event(data: Dict[str, Any], event: str, is_workflow: bool, request: ChatRequest) -> Optional[ChatResponse]:
-        """解析流式事件
-        
-        注意：workflow和chat-messages端点的事件流结构基本一致，
-        主要区别在于字符流事件名称不同：
-        - workflow端点使用 text_chunk 事件
-        - chat-messages端点使用 message 事件
-        其他事件（workflow_started, node_started, node_finished, workflow_finished, 
-        message_end, tts_message, tts_message_end, message_replace, error, ping）
-        的处理逻辑基本一致，可以统一处理。
-        """
-        
-        # 统一处理字符流事件
-        if event == "text_chunk" or event == "message" or event == "agent_message":
-            # 处理字符流事件
-            if event == "text_chunk":
-                # workflow端点的text_chunk事件
-                chunk_data = data.get("data", {})
-                text = chunk_data.get("text", "")
-                task_id = data.get("task_id")
-                workflow_run_id = data.get("workflow_run_id")
-                from_variable_selector = chunk_data.get("from_variable_selector")
-                # workflow事件没有这些字段
-                message_id = None
-                created_at = None
-                id_value = None
-            else:
-                # chat-messages端点的message事件或agent_message事件
-                text = data.get("answer", "")
-                task_id = data.get("task_id")
-                message_id = data.get("message_id")
-                created_at = data.get("created_at")
-                id_value = data.get("id")
-                workflow_run_id = None
-                from_variable_selector = None
-            
-            return ChatResponse(
-                message=text,
-                conversation_id=request.conversation_id,
-                message_id=task_id or message_id or "",
-                metadata={
-                    "event": event,  # 保持原始事件类型
-                    "workflow_run_id": workflow_run_id,
-                    "task_id": task_id,
-                    "from_variable_selector": from_variable_selector,
-                    "id": id_value,
-                    "created_at": created_at
-                }
-            )
-        
-        # 统一处理agent_thought事件
-        elif event == "agent_thought":
-            # 构建思考内容文本
-            thought_text = data.get("thought", "")
-            if not thought_text:
-                thought_text = data.get("observation", "")
-            
-            # 添加工具调用信息（如果有的话）
-            tool_info = ""
-            if data.get("tool") and data.get("tool_input"):
-                try:
-                    tool_input = data.get("tool_input")
-                    if isinstance(tool_input, str):
-                        tool_input = json.loads(tool_input)
-                    tool_info = f"\n\n[工具调用: {data['tool']}]\n"
-                    tool_info += f"参数: {json.dumps(tool_input, ensure_ascii=False, indent=2)}\n"
-                except Exception:
-                    # 如果tool_input不是有效的JSON，直接添加
-                    tool_info = f"\n\n[工具调用: {data['tool']}]\n"
-                    tool_info += f"参数: {data.get('tool_input', '')}\n"
-            
-            # 添加文件引用信息（如果有的话）
-            file_info = ""
-            if data.get("message_files") and isinstance(data.get("message_files"), list):
-                file_info = "\n\n[文件引用]:\n"
-                for i, file in enumerate(data["message_files"], 1):
-                    file_info += f"{i}. {file}\n"
-            
-            # 添加文件ID信息（如果有的话）
-            file_id_info = ""
-            if data.get("file_id"):
-                file_id_info = f"\n\n[文件ID]: {data['file_id']}\n"
-            
-            # 构建完整的思考内容
-            full_thought_content = thought_text + tool_info + file_info + file_id_info
-            
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("message_id"),
-                metadata={
-                    "event": event,
-                    "id": data.get("id"),
-                    "task_id": data.get("task_id"),
-                    "position": data.get("position"),
-                    "thought": data.get("thought"),
-                    "observation": data.get("observation"),
-                    "tool": data.get("tool"),
-                    "tool_input": data.get("tool_input"),
-                    "created_at": data.get("created_at"),
-                    "message_files": data.get("message_files", []),
-                    "file_id": data.get("file_id"),
-                    "conversation_id": data.get("conversation_id"),
-                    "full_thought_content": full_thought_content  # 添加完整思考内容到metadata
-                }
-            )
-        
-        # 统一处理message_file事件
-        elif event == "message_file":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("id"),
-                metadata={
-                    "event": event,
-                    "id": data.get("id"),
-                    "type": data.get("type"),
-                    "belongs_to": data.get("belongs_to"),
-                    "url": data.get("url"),
-                    "conversation_id": data.get("conversation_id")
-                }
-            )
-        
-        # 统一处理工作流相关事件
-        elif event == "workflow_finished":
-            # 工作流完成，发送最终响应
-            workflow_data = data.get("data", {})
-            outputs = workflow_data.get("outputs", {})
-            message = ""
-            if isinstance(outputs, dict):
-                message = outputs.get("text", "")
-                # 如果没有text字段，尝试其他可能的文本字段
-                if not message:
-                    for key, value in outputs.items():
-                        if isinstance(value, str):
-                            message = value
-                            break
-            
-            return ChatResponse(
-                message=message,
-                conversation_id=request.conversation_id,
-                message_id=data.get("task_id"),
-                metadata={
-                    "event": event,
-                    "status": workflow_data.get("status"),
-                    "elapsed_time": workflow_data.get("elapsed_time"),
-                    "total_tokens": workflow_data.get("total_tokens"),
-                    "total_steps": workflow_data.get("total_steps"),
-                    "finished_at": workflow_data.get("finished_at"),
-                    "error": workflow_data.get("error")
-                }
-            )
-        
-        elif event == "workflow_started":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("task_id"),
-                metadata={
-                    "event": event,
-                    "workflow_run_id": data.get("workflow_run_id"),
-                    "task_id": data.get("task_id"),
-                    "workflow_data": data.get("data")
-                }
-            )
-        
-        elif event == "node_started":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("task_id"),
-                metadata={
-                    "event": event,
-                    "workflow_run_id": data.get("workflow_run_id"),
-                    "task_id": data.get("task_id"),
-                    "node_data": data.get("data")
-                }
-            )
-        
-        elif event == "node_finished":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("task_id"),
-                metadata={
-                    "event": event,
-                    "workflow_run_id": data.get("workflow_run_id"),
-                    "task_id": data.get("task_id"),
-                    "node_data": data.get("data")
-                }
-            )
-        
-        # 统一处理消息相关事件
-        elif event == "message_end":
-            usage = data.get("usage", {})
-            total_tokens = usage.get("total_tokens", 0)
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("message_id"),
-                metadata={
-                    "event": event,
-                    "task_id": data.get("task_id"),
-                    "message_id": data.get("message_id"),
-                    "metadata": data.get("metadata"),
-                    "usage": usage,
-                    "retriever_resources": data.get("retriever_resources")
-                },
-                total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
-            )
-        
-        elif event == "tts_message":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("message_id"),
-                metadata={
-                    "event": event,
-                    "task_id": data.get("task_id"),
-                    "message_id": data.get("message_id"),
-                    "audio": data.get("audio"),
-                    "created_at": data.get("created_at")
-                }
-            )
-        
-        elif event == "tts_message_end":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("message_id"),
-                metadata={
-                    "event": event,
-                    "task_id": data.get("task_id"),
-                    "message_id": data.get("message_id"),
-                    "audio": data.get("audio"),
-                    "created_at": data.get("created_at")
-                }
-            )
-        
-        elif event == "message_replace":
-            return ChatResponse(
-                message=data.get("answer", ""),
-                conversation_id=request.conversation_id,
-                message_id=data.get("message_id"),
-                metadata={
-                    "event": event,
-                    "task_id": data.get("task_id"),
-                    "message_id": data.get("message_id"),
-                    "created_at": data.get("created_at")
-                }
-            )
-        
-        elif event == "error":
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("message_id"),
-                metadata={
-                    "event": event,
-                    "task_id": data.get("task_id"),
-                    "message_id": data.get("message_id"),
-                    "status": data.get("status"),
-                    "code": data.get("code"),
-                    "error_message": data.get("message")
-                }
-            )
-        
-        elif event == "ping":
-            # 心跳事件，不需要返回内容
-            return None
-        
-        # 处理workflow相关的statistics事件
-        elif event == "statistics":
-            total_tokens = data.get("total_tokens", 0)
-            return ChatResponse(
-                message="",
-                conversation_id=request.conversation_id,
-                message_id=data.get("task_id"),
-                metadata={
-                    "event": event,
-                    "workflow_run_id": data.get("workflow_run_id"),
-                    "task_id": data.get("task_id"),
-                    "status": data.get("status"),
-                    "elapsed_time": data.get("elapsed_time"),
-                    "total_tokens": total_tokens,
-                    "total_steps": data.get("total_steps"),
-                    "created_at": data.get("created_at"),
-                    "finished_at": data.get("finished_at"),
-                    "error": data.get("error")
-                },
-                total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
-            )
-        
-        return None
+
+def _deadline(when: float) -> Optional[float]:
+    """asyncio.timeout_at的截止时间，不限制时为None"""
+    return None if math.isinf(when) else when
+
+
+def _is_endpoint_failure(status_code: int) -> bool:
+    """端点本身的问题（服务端错误或该API Key被限流），其他4xx是请求本身的问题"""
+    return status_code >= 500 or status_code == 429
 
 
 class DifyAdapter:
@@ -394,17 +37,20 @@ class DifyAdapter:
 
     def __init__(self, config: Dict[str, Any]):
         self.config = config
-        # 优先使用配置中的base_url，如果没有则使用环境变量DIFY_BASE_URL，最后使用默认值
-        base_url = config.get("base_url") or os.getenv("DIFY_BASE_URL", "http://localhost/v1")
-        api_key = config.get("api_key", "")
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        self.client = httpx.AsyncClient(base_url=base_url, headers=headers, timeout=60.0)
-        self.parser = DifyResponseParser()
+        # 优先使用配置中的base_url，如果没有则使用环境变量DIFY_BASE_URL，最后使用默认值；
+        # 配置了多个端点时选择当前最快、最空闲的一个（见core/adapter/endpoints.py）
+        self.endpoints = EndpointRegistry.pool_for(config, default_base_url())
+        endpoint = self.endpoints.pick()
+        if endpoint is None:
+            raise ValueError("Dify agent has no upstream endpoint configured")
+        self._use(endpoint)
+        self.parser = dify_parser.DifyResponseParser()
+    
+    def _use(self, endpoint: Endpoint):
+        """切换到指定端点，停止生成等后续调用也发往该端点"""
+        self.endpoint = endpoint
+        # 从进程级注册表借用长连接客户端，避免每次请求重新建立TCP/TLS连接
+        self.client = endpoint.client
 
     async def chat(self, request: ChatRequest) -> ChatResponse:
         """发送聊天请求"""
@@ -438,14 +84,19 @@ class DifyAdapter:
                     "user": request.user_id,
                     "response_mode": "blocking"
                 }
+                # 续用上游对话（见core/upstream_conversations.py）
+                if request.upstream_conversation_id:
+                    payload["conversation_id"] = request.upstream_conversation_id
             
-            # if request.conversation_id:
-            #     payload["conversation_id"] = request.conversation_id
-                
-            response = await self.client.post(endpoint, json=payload)
-            response.raise_for_status()
+            timeouts = UpstreamTimeouts.from_config(self.config)
+            try:
+                response = await self._send_blocking(endpoint, payload, timeouts, is_workflow)
+            except HTTPStatusError as e:
+                if not self._conversation_expired(e.response, payload):
+                    raise
+                response = await self._send_blocking(endpoint, payload, timeouts, is_workflow)
             
-            response_data = response.json()
+            response_data = json_codec.loads(response.content)
             
             # 使用统一的解析器处理响应
             return self.parser.parse_blocking_response(response_data, is_workflow)
@@ -465,8 +116,94 @@ class DifyAdapter:
             logger.error(f"Dify API JSON decode error: {str(e)}")
             raise
 
-    async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[ChatResponse, None]:
+    async def _send_blocking(self, path: str, payload: Dict[str, Any], timeouts: UpstreamTimeouts, is_workflow: bool) -> httpx.Response:
+        """发送阻塞请求，开启hedge时对冲；续用上游对话时不对冲（两次请求都会追加到同一个上游对话中）"""
+        if not is_workflow and self.config.get("hedge") and "conversation_id" not in payload:
+            return await self._hedged_post(path, payload, timeouts)
+        return await self._post(self.endpoint, path, payload, timeouts)
+    
+    @staticmethod
+    def _conversation_expired(response: httpx.Response, payload: Dict[str, Any]) -> bool:
+        """带着上游对话ID的请求返回404（对话已过期或被删除）时去掉该ID，返回是否应开始新的上游对话重发"""
+        if response.status_code != 404 or "conversation_id" not in payload:
+            return False
+        logger.warning(f"Dify conversation {payload.pop('conversation_id')} not found, starting a new conversation")
+        Metrics.incr("upstream_conversation_expired_total")
+        return True
+    
+    async def _post(self, endpoint: Endpoint, path: str, payload: Dict[str, Any], timeouts: UpstreamTimeouts) -> httpx.Response:
+        """向指定端点发送阻塞请求并记录该端点的延迟和健康状况，端点熔断中时抛出UpstreamUnavailable"""
+        started, probe = endpoint.begin()
+        try:
+            # 阻塞调用只有连接和总预算两个阶段
+            try:
+                async with asyncio.timeout(None if math.isinf(timeouts.total) else timeouts.total):
+                    response = await endpoint.client.post(path, json=payload, timeout=timeouts.http_timeout(read=timeouts.total))
+            except TimeoutError:
+                endpoint.failure(probe)
+                raise UpstreamTimeout(PHASE_TOTAL, timeouts.total)
+            except (httpx.ConnectTimeout, httpx.PoolTimeout):
+                endpoint.failure(probe)
+                raise UpstreamTimeout(PHASE_CONNECT, timeouts.connect)
+            except RequestError:
+                endpoint.failure(probe)
+                raise
+            
+            if _is_endpoint_failure(response.status_code):
+                endpoint.failure(probe)
+            elif response.status_code < 400:
+                latency = time.monotonic() - started
+                endpoint.success(latency, probe)
+                self.endpoints.record_latency(latency)
+            response.raise_for_status()
+            return response
+        finally:
+            endpoint.end(probe)
+    
+    async def _hedged_post(self, path: str, payload: Dict[str, Any], timeouts: UpstreamTimeouts) -> httpx.Response:
+        """对冲请求：超过对冲延迟仍未返回时向另一个端点再发一次，取先成功的响应"""
+        primary = asyncio.ensure_future(self._post(self.endpoint, path, payload, timeouts))
+        attempts = {primary: self.endpoint}
+        try:
+            delay = self.config.get("hedge_delay") or self.endpoints.p95()
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=float(delay))
+                backup_endpoint = None if done else self.endpoints.pick(exclude=self.endpoint)
+                if backup_endpoint is not None and backup_endpoint.available():
+                    Metrics.incr("upstream_hedged_total", endpoint=backup_endpoint.name)
+                    backup = asyncio.ensure_future(self._post(backup_endpoint, path, payload, timeouts))
+                    attempts[backup] = backup_endpoint
+            
+            pending = set(attempts)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    # 先成功的胜出；都失败时抛出最后一个的异常
+                    task = succeeded[0] if succeeded else done.pop()
+                    if task is not primary and succeeded:
+                        Metrics.incr("upstream_hedge_wins_total", endpoint=attempts[task].name)
+                    self._use(attempts[task])
+                    return task.result()
+        finally:
+            # 取消落败（或调用方已取消）的请求，等待其完成端点统计
+            losers = [task for task in attempts if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+    
+    async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[StreamChunk, None]:
         """发送流式聊天请求"""
+        # 端点的进行中请求数覆盖整个流，延迟按首个有效事件的到达时间统计
+        try:
+            started, probe = self.endpoint.begin()
+        except UpstreamUnavailable as e:
+            # 熔断中：不发出请求，直接返回错误事件
+            logger.warning(f"Dify API stream rejected: {e}")
+            yield self._error_chunk(request, None, 503, "upstream_unavailable", str(e), retry_after=e.retry_after)
+            return
+        first_event = True
         try:
             # 根据智能体配置中的type类型判断是调用工作流接口还是聊天接口
             agent_type = self.config.get("type", "chat")  # 默认是chat类型
@@ -497,28 +234,82 @@ class DifyAdapter:
                     "user": str(request.user_id),
                     "response_mode": "streaming"
                 }
+                # 续用上游对话（见core/upstream_conversations.py）
+                if request.upstream_conversation_id:
+                    payload["conversation_id"] = request.upstream_conversation_id
             
-            # if request.conversation_id:
-            #     payload["conversation_id"] = request.conversation_id
-                
-            async with self.client.stream("POST", endpoint, json=payload) as response:
+            # 分阶段超时由下面的看门狗控制，httpx只负责连接超时，单次读取不设超时
+            timeouts = UpstreamTimeouts.from_config(self.config)
+            loop = asyncio.get_running_loop()
+            total_deadline = loop.time() + timeouts.total
+            first_deadline = min(loop.time() + timeouts.first_event, total_deadline)
+            phase = PHASE_TOTAL if total_deadline <= first_deadline else PHASE_FIRST_EVENT
+            task_id = None
+            
+            try:
+                # 等待响应头计入首个事件的预算
+                async with asyncio.timeout_at(_deadline(first_deadline)):
+                    while True:
+                        response = await self.client.send(
+                            self.client.build_request("POST", endpoint, json=payload, timeout=timeouts.http_timeout(read=math.inf)),
+                            stream=True
+                        )
+                        if not self._conversation_expired(response, payload):
+                            break
+                        await response.aclose()
+            except TimeoutError:
+                self.endpoint.failure(probe)
+                yield self._timeout_chunk(request, UpstreamTimeout(phase, getattr(timeouts, phase)), task_id)
+                return
+            except (httpx.ConnectTimeout, httpx.PoolTimeout):
+                self.endpoint.failure(probe)
+                yield self._timeout_chunk(request, UpstreamTimeout(PHASE_CONNECT, timeouts.connect), task_id)
+                return
+            
+            try:
                 response.raise_for_status()
                 
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]  # 移除 "data: " 前缀
-                        if data_str.strip() == "[DONE]":
-                            break
-                        
-                        try:
-                            data = json.loads(data_str)
-                            event = data.get("event") # 使用统一的解析器处理事件
-                            chat_response = self.parser.parse_streaming_event(data, event, is_workflow, request)
-                            if chat_response:
-                                yield chat_response
-                        
-                        except json.JSONDecodeError:
-                            continue
+                # 按SSE规范增量解码字节流（支持多行data、注释行、event/id字段）
+                sse_events = aiter_sse(response.aiter_bytes())
+                deadline = first_deadline
+                while True:
+                    try:
+                        async with asyncio.timeout_at(_deadline(deadline)):
+                            sse_event = await sse_events.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except TimeoutError:
+                        self.endpoint.failure(probe)
+                        yield self._timeout_chunk(request, UpstreamTimeout(phase, getattr(timeouts, phase)), task_id)
+                        return
+                    
+                    if sse_event.data == "[DONE]":
+                        break
+                    
+                    try:
+                        data = json_codec.loads(sse_event.data)
+                        # 事件类型优先取JSON中的event，其次取SSE的event字段
+                        event = data.get("event") or sse_event.event
+                        # 使用统一的解析器处理事件
+                        chat_response = self.parser.parse_streaming_event(data, event, is_workflow, request)
+                    except json.JSONDecodeError:
+                        chat_response = None
+                    
+                    # 收到第一个有效事件后改为空闲预算，ping也算作活动
+                    if chat_response or phase == PHASE_IDLE:
+                        phase = PHASE_IDLE
+                        deadline = min(loop.time() + timeouts.idle, total_deadline)
+                        if deadline == total_deadline:
+                            phase = PHASE_TOTAL
+                    
+                    if chat_response:
+                        if first_event:
+                            first_event = False
+                            self.endpoint.success(time.monotonic() - started, probe)
+                        task_id = task_id or (chat_response.metadata or {}).get("task_id")
+                        yield chat_response
+            finally:
+                await response.aclose()
         
         except HTTPStatusError as e:
             # 对于流式响应，如果已经关闭，不能再次读取内容
@@ -535,10 +326,51 @@ class DifyAdapter:
                 f"\nRequest: {e.request.content.decode('utf-8') if e.request.content else 'None'}"
                 f"\nResponse: {response_content}"
             )
+            if _is_endpoint_failure(e.response.status_code):
+                self.endpoint.failure(probe)
             raise
         except RequestError as e:
             logger.error(f"Dify API network error in stream: {str(e)}")
+            self.endpoint.failure(probe)
             raise
+        finally:
+            self.endpoint.end(probe)
+
+    @staticmethod
+    def _error_chunk(request: ChatRequest, task_id: Optional[str], status: int, code: str, message: str, **extra) -> StreamChunk:
+        """与Dify错误事件相同结构的error事件"""
+        return StreamChunk(
+            message="",
+            conversation_id=request.conversation_id,
+            message_id=task_id,
+            metadata={
+                "event": "error",
+                "task_id": task_id,
+                "message_id": None,
+                "status": status,
+                "code": code,
+                **extra,
+                "error_message": message
+            }
+        )
+
+    @classmethod
+    def _timeout_chunk(cls, request: ChatRequest, error: UpstreamTimeout, task_id: Optional[str]) -> StreamChunk:
+        """超时转换为error事件"""
+        logger.warning(f"Dify API stream aborted: {error}")
+        return cls._error_chunk(request, task_id, 504, "upstream_timeout", str(error), phase=error.phase)
+
+    async def stop(self, task_id: str, request: ChatRequest) -> bool:
+        """停止生成（best-effort，失败只记录日志）"""
+        is_workflow = self.config.get("type", "chat") == "workflow"
+        endpoint = f"/workflows/tasks/{task_id}/stop" if is_workflow else f"/chat-messages/{task_id}/stop"
+        try:
+            response = await self.client.post(endpoint, json={"user": str(request.user_id)}, timeout=STOP_TIMEOUT)
+            response.raise_for_status()
+            return True
+        except (HTTPStatusError, RequestError) as e:
+            logger.warning(f"Dify stop request failed for task {task_id}: {str(e)}")
+            return False
 
     async def get_conversation_history(self, conversation_id: str) -> Dict[str, Any]:
         """获取对话历史"""
@@ -547,5 +379,8 @@ class DifyAdapter:
         return response.json()
 
     async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
\ No newline at end of file
+        """释放适配器
+
+        HTTP客户端由HttpClientRegistry统一管理并在应用关闭时释放，这里不关闭共享连接
+        """
+        pass
@@ -0,0 +1,200 @@
+"""
+智能体的多个上游端点（多个Dify副本 / 多个API Key）
+
+在 Agent.config 中用 endpoints 列出端点，每项未写的字段沿用顶层的 base_url / api_key：
+    {"base_url": "http://dify-a/v1", "api_key": "app-xxx",
+     "endpoints": [{}, {"base_url": "http://dify-b/v1"}, {"api_key": "app-yyy"}]}
+未配置 endpoints 时只有顶层这一个端点（与之前相同）。
+
+选择：跳过熔断中的端点，取 延迟EWMA × (进行中请求数 + 1) 最小者。
+每个端点有一个熔断器（见core/adapter/circuit_breaker.py），所有端点都熔断时请求直接失败（UpstreamUnavailable），
+不再等待连接或读取超时。
+端点状态按 (base_url, api_key) 在进程内共享，多个智能体使用同一端点时共同维护其健康状况。
+AgentCache加载新的智能体配置后调用 EndpointRegistry.retain，移除已不被任何缓存中的智能体使用的端点组和端点
+（修改了端点配置或已删除的智能体）。
+
+对冲（只用于阻塞的chat调用，Agent.config 中 hedge=true）：
+请求在 hedge_delay 秒（未配置时为该组端点最近延迟的p95）内未返回时，向另一个端点再发一次，
+取先成功的响应并取消另一个。样本不足 UPSTREAM_HEDGE_MIN_SAMPLES 时不对冲。
+"""
+
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+import httpx
+from core.config import settings
+from core.metrics import Metrics
+from .circuit_breaker import CircuitBreaker
+from .http_client import HttpClientRegistry
+
+# 延迟EWMA的平滑系数
+LATENCY_ALPHA = 0.2
+# 每组端点保留的延迟样本数（用于计算p95）
+LATENCY_SAMPLES = 200
+
+
+class Endpoint:
+    """一个上游端点及其运行状态"""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        # 指标标签，不暴露完整的API Key
+        self.name = f"{base_url}#{api_key[-4:]}" if api_key else base_url
+        self.latency_ewma: Optional[float] = None
+        self.in_flight = 0
+        self.breaker = CircuitBreaker(self.name)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return HttpClientRegistry.get_client(self.base_url, self.api_key)
+
+    def available(self) -> bool:
+        return self.breaker.allows()
+
+    def begin(self) -> Tuple[float, int]:
+        """开始一个请求，返回 (开始时间, 熔断器的探测标记)；熔断中时抛出UpstreamUnavailable
+
+        探测标记需要原样传给 end、success 和 failure
+        """
+        probe = self.breaker.acquire()
+        self.in_flight += 1
+        Metrics.set("upstream_endpoint_in_flight", self.in_flight, endpoint=self.name)
+        return time.monotonic(), probe
+
+    def end(self, probe: int):
+        self.in_flight -= 1
+        self.breaker.release(probe)
+        Metrics.set("upstream_endpoint_in_flight", self.in_flight, endpoint=self.name)
+
+    def success(self, latency: float, probe: int = 0):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += LATENCY_ALPHA * (latency - self.latency_ewma)
+        self.breaker.record(False, latency, probe)
+        Metrics.set("upstream_endpoint_latency_ewma", round(self.latency_ewma, 4), endpoint=self.name)
+
+    def failure(self, probe: int = 0):
+        self.breaker.record(True, probe=probe)
+        Metrics.incr("upstream_endpoint_failures_total", endpoint=self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.name,
+            "in_flight": self.in_flight,
+            "latency_ewma": None if self.latency_ewma is None else round(self.latency_ewma, 4),
+            "breaker": self.breaker.snapshot()
+        }
+
+
+class EndpointPool:
+    """一个智能体可用的一组端点"""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        self.endpoints = endpoints
+        # 最近成功请求的延迟（秒），对冲延迟取其p95
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def pick(self, exclude: Optional[Endpoint] = None) -> Optional[Endpoint]:
+        """选择延迟EWMA × (进行中请求数 + 1) 最小的可用端点
+
+        exclude之外没有端点时返回None；全部熔断时返回最早熔断的端点，由调用方在发出请求时快速失败
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint is not exclude]
+        if not candidates:
+            return None
+        available = [endpoint for endpoint in candidates if endpoint.available()]
+        if not available:
+            return min(candidates, key=lambda endpoint: endpoint.breaker.opened_at)
+
+        # 还没有延迟样本的端点按已知端点的平均值估计，避免新端点一开始就被挤满
+        known = [endpoint.latency_ewma for endpoint in available if endpoint.latency_ewma is not None]
+        default = sum(known) / len(known) if known else 1.0
+        return min(available, key=lambda endpoint: (
+            (endpoint.latency_ewma if endpoint.latency_ewma is not None else default) * (endpoint.in_flight + 1),
+            random.random()
+        ))
+
+    def record_latency(self, latency: float):
+        self.latencies.append(latency)
+
+    def p95(self) -> Optional[float]:
+        """最近延迟的p95，样本不足时返回None"""
+        if len(self.latencies) < max(settings.UPSTREAM_HEDGE_MIN_SAMPLES, 1):
+            return None
+        samples = sorted(self.latencies)
+        return samples[min(len(samples) - 1, math.ceil(len(samples) * 0.95) - 1)]
+
+
+def default_base_url() -> str:
+    """未配置base_url时使用的地址：环境变量DIFY_BASE_URL，没有时为本地默认值"""
+    return os.getenv("DIFY_BASE_URL", "http://localhost/v1")
+
+
+def parse_endpoints(config: Dict[str, Any], default_base_url: str) -> Tuple[Tuple[str, str], ...]:
+    """从Agent.config中解析 (base_url, api_key) 列表"""
+    base_url = config.get("base_url") or default_base_url
+    api_key = config.get("api_key", "")
+    entries = config.get("endpoints") or [{}]
+    result = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"base_url": entry}
+        pair = (entry.get("base_url") or base_url, entry.get("api_key") or api_key)
+        if pair not in result:
+            result.append(pair)
+    return tuple(result)
+
+
+class EndpointRegistry:
+    """进程级端点注册表"""
+
+    _endpoints: Dict[Tuple[str, str], Endpoint] = {}
+    _pools: Dict[Tuple[Tuple[str, str], ...], EndpointPool] = {}
+
+    @classmethod
+    def pool_for(cls, config: Dict[str, Any], default_base_url: str) -> EndpointPool:
+        """获取（必要时创建）智能体配置对应的端点组，端点列表相同的智能体共用一组"""
+        pairs = parse_endpoints(config, default_base_url)
+        pool = cls._pools.get(pairs)
+        if pool is None:
+            endpoints = []
+            for pair in pairs:
+                endpoint = cls._endpoints.get(pair)
+                if endpoint is None:
+                    endpoint = cls._endpoints[pair] = Endpoint(*pair)
+                endpoints.append(endpoint)
+            pool = cls._pools[pairs] = EndpointPool(endpoints)
+        return pool
+
+    @classmethod
+    def retain(cls, configs: Iterable[Dict[str, Any]]):
+        """只保留这些智能体配置使用的端点组和端点，其余的不再被引用，直接移除
+
+        正在进行的请求仍持有移除前的端点对象，不受影响
+        """
+        keys = {parse_endpoints(config, default_base_url()) for config in configs}
+        for key in [key for key in cls._pools if key not in keys]:
+            del cls._pools[key]
+        # 按配置而不是剩余的端点组判断，配置修改后仍在使用的端点保留熔断和延迟状态
+        used = {pair for key in keys for pair in key}
+        for pair in [pair for pair in cls._endpoints if pair not in used]:
+            del cls._endpoints[pair]
+
+    @classmethod
+    def endpoints(cls) -> List[Endpoint]:
+        return list(cls._endpoints.values())
+
+    @classmethod
+    def snapshot(cls) -> List[Dict[str, Any]]:
+        """各端点的状态（健康检查接口使用）"""
+        return [endpoint.snapshot() for endpoint in cls._endpoints.values()]
+
+    @classmethod
+    def clear(cls):
+        cls._endpoints.clear()
+        cls._pools.clear()
@@ -0,0 +1,77 @@
+import httpx
+import logging
+from typing import Dict, Tuple
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClientRegistry:
+    """进程级上游HTTP客户端注册表
+
+    按 (base_url, api_key) 复用长连接的 httpx.AsyncClient，
+    适配器只借用客户端，不负责关闭；统一在应用生命周期结束时关闭。
+    """
+
+    _clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+
+    @classmethod
+    def _build_client(cls, base_url: str, api_key: str) -> httpx.AsyncClient:
+        """创建带连接池配置的客户端"""
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        limits = httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY
+        )
+
+        http2 = settings.UPSTREAM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                # 未安装h2时回退到HTTP/1.1
+                logger.warning("UPSTREAM_HTTP2 is enabled but 'h2' is not installed, falling back to HTTP/1.1")
+                http2 = False
+
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=settings.UPSTREAM_TIMEOUT,
+            limits=limits,
+            http2=http2
+        )
+
+    @classmethod
+    def get_client(cls, base_url: str, api_key: str) -> httpx.AsyncClient:
+        """获取（必要时创建）指定上游的共享客户端"""
+        key = (base_url, api_key)
+        client = cls._clients.get(key)
+        if client is None or client.is_closed:
+            client = cls._build_client(base_url, api_key)
+            cls._clients[key] = client
+        return client
+
+    @classmethod
+    async def startup(cls):
+        """应用启动时调用，清理残留的客户端"""
+        await cls.shutdown()
+
+    @classmethod
+    async def shutdown(cls):
+        """应用关闭时调用，关闭所有共享客户端"""
+        clients = list(cls._clients.values())
+        cls._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing upstream client: {e}")
+
+    @classmethod
+    def size(cls) -> int:
+        """当前缓存的客户端数量"""
+        return len(cls._clients)
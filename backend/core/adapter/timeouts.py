@@ -0,0 +1,67 @@
+"""
+上游调用的分阶段超时
+
+    connect      建立连接（含从连接池获取连接）
+    first_event  发出请求到收到第一个有效事件（不含ping），阻塞调用时不使用
+    idle         两个事件之间的最长间隔（ping也算作活动）
+    total        整个请求/流的总预算
+
+在 Agent.config 中按智能体配置 timeout_connect / timeout_first_event / timeout_idle / timeout_total（秒），
+未配置时使用全局默认值 UPSTREAM_*_TIMEOUT；0表示该阶段不限制。
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import httpx
+from core.config import settings
+
+# 阶段名称，也用于错误事件的phase字段
+PHASE_CONNECT = "connect"
+PHASE_FIRST_EVENT = "first_event"
+PHASE_IDLE = "idle"
+PHASE_TOTAL = "total"
+
+
+class UpstreamTimeout(Exception):
+    """上游某个阶段超出预算"""
+
+    def __init__(self, phase: str, budget: float):
+        super().__init__(f"Upstream {phase} timeout after {budget:g}s")
+        self.phase = phase
+        self.budget = budget
+
+
+def _seconds(value: Any, default: float) -> float:
+    """转换为秒数，0或负数表示不限制（inf）"""
+    try:
+        seconds = float(default if value is None else value)
+    except (TypeError, ValueError):
+        seconds = float(default)
+    return seconds if seconds > 0 else math.inf
+
+
+def _or_none(seconds: float) -> Optional[float]:
+    return None if math.isinf(seconds) else seconds
+
+
+@dataclass(slots=True)
+class UpstreamTimeouts:
+    connect: float
+    first_event: float
+    idle: float
+    total: float
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "UpstreamTimeouts":
+        return cls(
+            connect=_seconds(config.get("timeout_connect"), settings.UPSTREAM_CONNECT_TIMEOUT),
+            first_event=_seconds(config.get("timeout_first_event"), settings.UPSTREAM_FIRST_EVENT_TIMEOUT),
+            idle=_seconds(config.get("timeout_idle"), settings.UPSTREAM_IDLE_TIMEOUT),
+            total=_seconds(config.get("timeout_total"), settings.UPSTREAM_TOTAL_TIMEOUT)
+        )
+
+    def http_timeout(self, read: float) -> httpx.Timeout:
+        """httpx的超时配置：连接/获取连接池连接用connect，单次读取用read（由调用方按阶段给出）"""
+        connect = _or_none(self.connect)
+        return httpx.Timeout(connect=connect, read=_or_none(read), write=connect, pool=connect)
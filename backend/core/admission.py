@@ -0,0 +1,378 @@
+"""
+上游调用的准入控制（舱壁隔离）
+
+每个智能体、每个商户各有一个并发上限（同时进行中的上游调用数）和一个有界等待队列：
+    - 未达上限时立即放行；
+    - 达到上限时排队等待，最多等待 ADMISSION_QUEUE_TIMEOUT 秒；
+    - 队列已满或等待超时时立即拒绝（AdmissionRejected，路由返回429并带Retry-After）。
+先占用商户名额，再占用智能体名额，最后占用全局名额（固定顺序，避免互相等待）。
+
+并发上限：
+    商户    ADMISSION_MAX_PER_MERCHANT
+    智能体  Agent.config 中的 max_concurrency，未配置时为 ADMISSION_MAX_PER_AGENT
+    全局    ADMISSION_GLOBAL_LIMIT（整个进程的上游调用数）
+0表示不限制。流式请求的名额在流结束（或客户端断开、上游被取消）时释放。
+
+全局名额用满后不再先到先得，而是加权公平排队（FairScheduler）：
+    - 交互式请求（流式的chat/agent）优先于阻塞请求和workflow；
+    - 同一优先级内按商户加权轮转，权重为 merchants.weight，
+      一个商户排队再多，其他商户的请求也能按权重比例拿到名额。
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Deque, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from core.config import settings
+from core.database import async_session_scope
+from core.metrics import Metrics
+from models.merchant import Merchant
+
+logger = logging.getLogger(__name__)
+
+SCOPE_MERCHANT = "merchant"
+SCOPE_AGENT = "agent"
+SCOPE_GLOBAL = "global"
+
+# 全局排队的优先级，数值小的先出队
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+class AdmissionRejected(Exception):
+    """超出并发上限且无法排队"""
+
+    def __init__(self, scope: str, key: Any, retry_after: int):
+        super().__init__(f"Too many concurrent requests for {scope} {key}, retry after {retry_after}s")
+        self.scope = scope
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+    """一个并发上限 + 有界FIFO等待队列"""
+
+    def __init__(self, scope: str, key: Any, limit: int, queue_size: int):
+        self.scope = scope
+        self.key = key
+        self.limit = limit
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # 名额平均占用时长（秒），用于估算Retry-After
+        self.hold_ewma = 1.0
+
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    def _enqueue(self, waiter: asyncio.Future, **ticket):
+        self.waiters.append(waiter)
+
+    def _dequeue(self) -> Optional[asyncio.Future]:
+        """取出下一个仍在等待的请求"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                return waiter
+        return None
+
+    def _discard(self, waiter: asyncio.Future):
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+
+    def retry_after(self) -> int:
+        """按平均占用时长和排队人数估算多久后重试"""
+        estimate = self.hold_ewma * (self.queued() + 1) / max(self.limit, 1)
+        return int(min(max(math.ceil(estimate), 1), 60))
+
+    def _report(self):
+        Metrics.set("admission_in_flight", self.in_flight, scope=self.scope, key=self.key)
+        Metrics.set("admission_queue_depth", self.queued(), scope=self.scope, key=self.key)
+
+    def _reject(self) -> AdmissionRejected:
+        Metrics.incr("admission_rejected_total", scope=self.scope, key=self.key)
+        return AdmissionRejected(self.scope, self.key, self.retry_after())
+
+    async def acquire(self, deadline: float, **ticket):
+        """占用一个名额，deadline为事件循环时间，ticket为子类排队所需的信息"""
+        if self.in_flight < self.limit and not self.queued():
+            self.in_flight += 1
+            self._report()
+            return
+        if self.queued() >= self.queue_size:
+            raise self._reject()
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._enqueue(waiter, **ticket)
+        self._report()
+        started = loop.time()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(deadline - started, 0))
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时刚好被分配了名额，照常使用
+                pass
+            else:
+                waiter.cancel()
+                raise self._reject()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已分配名额但调用方被取消，交还名额
+                self.release(0)
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            self._discard(waiter)
+            self._report()
+            # 平均等待时间 = admission_wait_seconds_total / admission_waits_total
+            Metrics.incr("admission_wait_seconds_total", loop.time() - started, scope=self.scope, key=self.key)
+            Metrics.incr("admission_waits_total", scope=self.scope, key=self.key)
+
+    def release(self, held: float):
+        """释放名额；有人排队时直接转交给队首"""
+        if held > 0:
+            self.hold_ewma += 0.2 * (held - self.hold_ewma)
+        waiter = self._dequeue()
+        if waiter is not None:
+            waiter.set_result(None)
+        else:
+            self.in_flight -= 1
+        self._report()
+
+
+class _FairQueue:
+    """一个优先级内的加权公平队列
+
+    每个请求入队时打上虚拟完成时间 tag = max(当前虚拟时间, 该商户上一个tag) + 1/权重，
+    出队时取tag最小者并把虚拟时间推进到该tag。持续排队的商户按权重比例轮流出队，
+    刚开始排队的商户从当前虚拟时间起步，不会因为之前空闲而攒下额度。
+    """
+
+    __slots__ = ("heap", "last_tag", "vtime", "_seq")
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, asyncio.Future]] = []
+        self.last_tag: Dict[Any, float] = {}
+        self.vtime = 0.0
+        self._seq = itertools.count()
+
+    def push(self, waiter: asyncio.Future, merchant_id: Any, weight: float):
+        tag = max(self.vtime, self.last_tag.get(merchant_id, 0.0)) + 1.0 / weight
+        self.last_tag[merchant_id] = tag
+        heapq.heappush(self.heap, (tag, next(self._seq), waiter))
+
+    def pop(self, pending: Dict[asyncio.Future, int]) -> Optional[asyncio.Future]:
+        """取出tag最小且仍在排队的请求（已超时/取消的在这里惰性清除）"""
+        while self.heap:
+            tag, _, waiter = heapq.heappop(self.heap)
+            if waiter in pending:
+                self.vtime = tag
+                return waiter
+        return None
+
+    def reset(self):
+        self.heap.clear()
+        self.last_tag.clear()
+        self.vtime = 0.0
+
+
+class FairScheduler(Bulkhead):
+    """全局名额：按优先级、再按商户权重公平排队"""
+
+    def __init__(self, limit: int, queue_size: int):
+        super().__init__(SCOPE_GLOBAL, "all", limit, queue_size)
+        self._queues = {PRIORITY_INTERACTIVE: _FairQueue(), PRIORITY_BATCH: _FairQueue()}
+        # 排队中的请求 -> 优先级
+        self._pending: Dict[asyncio.Future, int] = {}
+
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _enqueue(self, waiter: asyncio.Future, merchant_id: Any = None, weight: float = 1.0,
+                 priority: int = PRIORITY_BATCH):
+        self._queues[priority].push(waiter, merchant_id, weight)
+        self._pending[waiter] = priority
+
+    def _dequeue(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._queues):
+            waiter = self._queues[priority].pop(self._pending)
+            if waiter is not None:
+                self._discard(waiter)
+                return waiter
+        return None
+
+    def _discard(self, waiter: asyncio.Future):
+        self._pending.pop(waiter, None)
+        if not self._pending:
+            # 队列已空，丢弃残留的已取消条目，虚拟时间从头开始
+            for queue in self._queues.values():
+                queue.reset()
+
+    def _report(self):
+        super()._report()
+        depths = dict.fromkeys(self._queues, 0)
+        for priority in self._pending.values():
+            depths[priority] += 1
+        for priority, depth in depths.items():
+            Metrics.set("admission_fair_queue_depth", depth, priority=priority)
+
+
+class MerchantWeights:
+    """商户调度权重（merchants.weight）的进程内缓存
+
+    每个商户最多每 MERCHANT_WEIGHT_TTL 秒查询一次数据库，过期时并发的请求共用同一次查询；
+    查询失败时沿用上次的值（没有时为1）。merchants.weight 列由 init_db.py（sync_schema）补齐，启动时 check_schema 检查。
+    """
+
+    _weights: Dict[Any, Tuple[float, float]] = {}
+    _loading: Dict[Any, asyncio.Task] = {}
+
+    @classmethod
+    async def get(cls, merchant_id: Any) -> float:
+        """获取商户权重，未配置或商户不存在时为1"""
+        cached = cls._weights.get(merchant_id)
+        if cached is not None and time.monotonic() - cached[1] < settings.MERCHANT_WEIGHT_TTL:
+            return cached[0]
+
+        task = cls._loading.get(merchant_id)
+        if task is None:
+            task = asyncio.ensure_future(cls._load(merchant_id, cached[0] if cached is not None else 1.0))
+            cls._loading[merchant_id] = task
+            task.add_done_callback(lambda _: cls._loading.pop(merchant_id, None))
+        # 某个等待者被取消时不影响其他等待者
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def _load(cls, merchant_id: Any, fallback: float) -> float:
+        try:
+            async with async_session_scope() as db:
+                value = await db.scalar(select(Merchant.weight).where(Merchant.id == merchant_id))
+            weight = float(value) if value is not None and value > 0 else 1.0
+        except Exception as e:
+            logger.warning(f"Failed to load weight of merchant {merchant_id}: {e}")
+            weight = fallback
+        cls._weights[merchant_id] = (weight, time.monotonic())
+        return weight
+
+    @classmethod
+    def invalidate(cls, merchant_id: Any):
+        cls._weights.pop(merchant_id, None)
+
+
+class AdmissionSlot:
+    """已获得的名额，release可重复调用
+
+    不在析构时释放：名额必须由持有者显式释放（阻塞请求在finally中，流式请求见hold和sse_response），
+    否则名额归还的时机取决于垃圾回收。
+    """
+
+    __slots__ = ("_bulkheads", "_acquired_at", "_released")
+
+    def __init__(self, bulkheads: Tuple[Bulkhead, ...], acquired_at: float):
+        self._bulkheads = bulkheads
+        self._acquired_at = acquired_at
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        held = time.monotonic() - self._acquired_at
+        for bulkhead in reversed(self._bulkheads):
+            bulkhead.release(held)
+
+
+class AdmissionController:
+    """进程级准入控制器"""
+
+    _bulkheads: Dict[Tuple[str, Any], Bulkhead] = {}
+    _scheduler: Optional[FairScheduler] = None
+
+    @classmethod
+    def _bulkhead(cls, scope: str, key: Any, limit: int) -> Optional[Bulkhead]:
+        if limit <= 0:
+            return None
+        bulkhead = cls._bulkheads.get((scope, key))
+        if bulkhead is None:
+            bulkhead = Bulkhead(scope, key, limit, settings.ADMISSION_QUEUE_SIZE)
+            cls._bulkheads[(scope, key)] = bulkhead
+        else:
+            # 配置可能已修改（智能体缓存刷新后）
+            bulkhead.limit = limit
+        return bulkhead
+
+    @classmethod
+    def _global(cls) -> Optional[FairScheduler]:
+        limit = settings.ADMISSION_GLOBAL_LIMIT
+        if limit <= 0:
+            return None
+        if cls._scheduler is None:
+            cls._scheduler = FairScheduler(limit, settings.ADMISSION_GLOBAL_QUEUE_SIZE)
+        cls._scheduler.limit = limit
+        return cls._scheduler
+
+    @classmethod
+    async def acquire(cls, merchant_id: Any, agent_id: Any, agent_config: Dict[str, Any],
+                      interactive: bool = False) -> AdmissionSlot:
+        """按商户、智能体、全局的顺序占用名额，失败时抛出AdmissionRejected
+
+        interactive为True（流式的chat/agent请求）时在全局队列中优先出队
+        """
+        try:
+            agent_limit = int(agent_config.get("max_concurrency") or settings.ADMISSION_MAX_PER_AGENT)
+        except (TypeError, ValueError):
+            agent_limit = settings.ADMISSION_MAX_PER_AGENT
+        bulkheads = [bulkhead for bulkhead in (
+            cls._bulkhead(SCOPE_MERCHANT, merchant_id, settings.ADMISSION_MAX_PER_MERCHANT),
+            cls._bulkhead(SCOPE_AGENT, agent_id, agent_limit),
+            cls._global()
+        ) if bulkhead is not None]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.ADMISSION_QUEUE_TIMEOUT
+        acquired = []
+        try:
+            for bulkhead in bulkheads:
+                if isinstance(bulkhead, FairScheduler):
+                    await bulkhead.acquire(
+                        deadline,
+                        merchant_id=merchant_id,
+                        weight=await MerchantWeights.get(merchant_id),
+                        priority=PRIORITY_INTERACTIVE if interactive else PRIORITY_BATCH
+                    )
+                else:
+                    await bulkhead.acquire(deadline)
+                acquired.append(bulkhead)
+        except BaseException:
+            for bulkhead in reversed(acquired):
+                bulkhead.release(0)
+            raise
+        return AdmissionSlot(tuple(bulkheads), time.monotonic())
+
+    @staticmethod
+    async def release(slot: AdmissionSlot):
+        """异步形式的slot.release，用作响应的background（同步函数会被放到线程池中执行）"""
+        slot.release()
+
+    @staticmethod
+    async def hold(slot: AdmissionSlot, body: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+        """在流式响应结束前一直持有名额
+
+        响应体没有开始迭代（例如客户端在发送第一帧前断开）时不会执行这里的finally，
+        调用方需要在响应结束后再调用一次 slot.release()（重复调用无影响）
+        """
+        try:
+            async for frame in body:
+                yield frame
+        finally:
+            slot.release()
+            aclose = getattr(body, "aclose", None)
+            if aclose is not None:
+                await aclose()
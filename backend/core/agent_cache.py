@@ -0,0 +1,138 @@
+"""
+进程内的智能体配置缓存
+
+按agent_id缓存解析好的适配器类型、适配器配置和流式开关，
+一次聊天请求不再重复查询agents表和解析config。
+条目有TTL和LRU容量上限；agents路由更新/删除时主动失效本进程的条目，
+多进程部署时各进程定期查询agents表的 max(updated_at) 和行数（高水位），
+发现变化后失效对应条目。
+加载新条目后，移除已不被缓存中任何智能体使用的上游端点组（见core/adapter/endpoints.py）。
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+from sqlalchemy import func, select
+from core.adapter.endpoints import EndpointRegistry
+from core.config import settings
+from core.database import async_session_scope
+from models.agent import Agent
+
+logger = logging.getLogger(__name__)
+
+
+def parse_stream_flag(stream_setting: Any) -> bool:
+    """解析config中的stream参数（兼容布尔、字符串和数字）"""
+    if isinstance(stream_setting, bool):
+        return stream_setting
+    if isinstance(stream_setting, str):
+        return stream_setting.lower() == "true"
+    if isinstance(stream_setting, (int, float)):
+        return bool(stream_setting)
+    return False
+
+
+@dataclass(slots=True)
+class AgentEntry:
+    """缓存的智能体配置（adapter_config在多个请求间共享，只读）"""
+    agent_id: int
+    merchant_id: int
+    adapter_type: str
+    adapter_config: Dict[str, Any]
+    stream: bool
+    updated_at: Optional[datetime]
+    loaded_at: float
+
+    @classmethod
+    def from_agent(cls, agent: Agent) -> "AgentEntry":
+        adapter_config = dict(agent.config_dict)
+        # 确保配置中包含必要的参数
+        adapter_config.setdefault("api_key", "")
+        return cls(
+            agent_id=agent.id,
+            merchant_id=agent.merchant_id,
+            # 根据智能体type字段判断是用哪个平台的适配器
+            adapter_type=str(agent.type),
+            adapter_config=adapter_config,
+            stream=parse_stream_flag(adapter_config.get("stream")),
+            updated_at=agent.updated_at,
+            loaded_at=time.monotonic()
+        )
+
+
+class AgentCache:
+    """按agent_id缓存智能体配置（TTL + LRU）"""
+
+    _entries: "OrderedDict[int, AgentEntry]" = OrderedDict()
+    # agents表的高水位：(max(updated_at), 行数)
+    _watermark: Optional[tuple] = None
+    _last_poll = 0.0
+
+    @classmethod
+    async def get(cls, agent_id: int) -> AgentEntry:
+        """获取智能体配置，不存在时抛出ValueError"""
+        await cls._poll_watermark()
+
+        entry = cls._entries.get(agent_id)
+        if entry is not None and time.monotonic() - entry.loaded_at < settings.AGENT_CACHE_TTL:
+            cls._entries.move_to_end(agent_id)
+            return entry
+
+        async with async_session_scope() as db:
+            agent = await db.scalar(select(Agent).where(Agent.id == agent_id))
+            if not agent:
+                cls._entries.pop(agent_id, None)
+                raise ValueError(f"Agent not found: {agent_id}")
+            entry = AgentEntry.from_agent(agent)
+
+        cls._entries[agent_id] = entry
+        cls._entries.move_to_end(agent_id)
+        while len(cls._entries) > settings.AGENT_CACHE_MAX_SIZE:
+            cls._entries.popitem(last=False)
+        # 配置修改前的端点组不再被引用（在重新加载之后再清理，端点没有变化时保留熔断和延迟状态）
+        EndpointRegistry.retain(cached.adapter_config for cached in cls._entries.values())
+        return entry
+
+    @classmethod
+    def invalidate(cls, agent_id: int):
+        """失效单个智能体的缓存（更新或删除智能体后调用）"""
+        cls._entries.pop(agent_id, None)
+
+    @classmethod
+    def clear(cls):
+        cls._entries.clear()
+        cls._watermark = None
+        cls._last_poll = 0.0
+
+    @classmethod
+    async def _poll_watermark(cls):
+        """定期检查其他进程对agents表的修改"""
+        interval = settings.AGENT_CACHE_POLL_INTERVAL
+        now = time.monotonic()
+        if interval <= 0 or now - cls._last_poll < interval:
+            return
+        cls._last_poll = now
+
+        try:
+            async with async_session_scope() as db:
+                row = (await db.execute(select(func.max(Agent.updated_at), func.count(Agent.id)))).one()
+                watermark = (row[0], row[1])
+                previous = cls._watermark
+                if previous is None or watermark == previous:
+                    cls._watermark = watermark
+                    return
+
+                if watermark[1] < previous[1] or previous[0] is None:
+                    # 有智能体被删除（或之前为空表），无法按updated_at定位，全部失效
+                    cls._entries.clear()
+                else:
+                    changed = await db.scalars(select(Agent.id).where(Agent.updated_at > previous[0]))
+                    for agent_id in changed:
+                        cls._entries.pop(agent_id, None)
+                cls._watermark = watermark
+        except Exception as e:
+            # 轮询失败不影响请求，继续使用TTL兜底
+            logger.warning(f"Agent cache watermark poll failed: {e}")
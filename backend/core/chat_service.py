@@ -1,47 +1,102 @@
-from typing import Dict, Any, AsyncGenerator, Optional
-from sqlalchemy.orm import Session
-from core.adapter import AdapterFactory, ChatRequest, ChatResponse
-from models.agent import Agent
-from models.session import Conversation
-from models.message import Message
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncGenerator, AsyncIterator, List, Optional, Set
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.adapter import AdapterFactory, ChatRequest, ChatResponse, StreamChunk
+from core.database import async_session_scope
+from core.stream_accumulator import StreamAccumulator
+from core.agent_cache import AgentCache
+from core.message_persister import MessagePersister, PendingChat, write_chats
+from core.metrics import Metrics
+from core.response_cache import MODE_BLOCKING, MODE_STREAMING, ResponseCache
+from core.similar_query_cache import SimilarQueryCache
+from core.single_flight import SingleFlight, single_flight_key
+from core.upstream_conversations import UpstreamConversations
 import asyncio
+import logging
+from datetime import datetime
 import uuid
 import re
 import inspect
-import json
+from core import json_codec
+
+logger = logging.getLogger(__name__)
 
 class ChatService:
-    """聊天服务类"""
+    """聊天服务类
+    
+    使用异步会话访问数据库，不阻塞事件循环。
+    不传db时，每个数据库阶段（查询agent、保存消息）都使用独立的短生命周期会话，
+    调用上游期间不占用数据库连接。
+    """
+    
+    # 客户端断开后的收尾任务（停止上游、保存回答），保持引用直到完成
+    _interrupt_tasks: Set[asyncio.Task] = set()
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Optional[AsyncSession] = None):
         self.db = db
     
+    @classmethod
+    def run_detached(cls, coro) -> asyncio.Task:
+        """在后台执行客户端断开后的收尾工作，不随请求任务取消"""
+        task = asyncio.ensure_future(coro)
+        cls._interrupt_tasks.add(task)
+        task.add_done_callback(cls._interrupt_tasks.discard)
+        return task
+    
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """获取数据库会话：优先使用外部传入的会话，否则创建短生命周期会话"""
+        if self.db is not None:
+            yield self.db
+        else:
+            async with async_session_scope() as db:
+                yield db
+    
+    async def _load_agent(self, request: ChatRequest):
+        """获取agent的适配器类型和配置（走进程内缓存，未命中时才查询数据库）"""
+        entry = await AgentCache.get(request.agent_id)
+        return entry, entry.adapter_type, entry.adapter_config
+    
     async def chat(self, request: ChatRequest) -> ChatResponse:
         """处理聊天请求"""
         # 获取agent信息
-        agent = self.db.query(Agent).filter(Agent.id == request.agent_id).first()
-        if not agent:
-            raise ValueError(f"Agent not found: {request.agent_id}")
-        
-        # 根据智能体type字段判断是用哪个平台的适配器
-        adapter_type: str = str(agent.type)
-        
-        # 使用智能体的配置（config）创建适配器
-        agent_config_dict = agent.config_dict
-        adapter_config = dict[str, Any]()
-        for key, value in agent_config_dict.items():
-            adapter_config[key] = value
+        agent, adapter_type, adapter_config = await self._load_agent(request)
         
-        # 确保配置中包含必要的参数
-        if "api_key" not in adapter_config:
-            adapter_config["api_key"] = agent.config_dict.get("api_key", "")
+        # 续用上游对话：查出本地对话对应的上游对话ID
+        forwarding = UpstreamConversations.enabled(request, adapter_config)
+        await UpstreamConversations.resolve(request, adapter_config)
         
         # 创建适配器
         adapter = AdapterFactory.create_adapter(adapter_type, adapter_config)
         
+        # 开启响应缓存的workflow智能体先查精确缓存，开启近似问题缓存的智能体再查相似的问题
+        # （续用上游对话时回答依赖上文，不查近似问题缓存）
+        cache_key = ResponseCache.key_for(request, adapter_config, MODE_BLOCKING)
+        similar = self._similar_cache_enabled(request, adapter_config)
+        
+        async def call_upstream() -> ChatResponse:
+            upstream_response = await adapter.chat(request)
+            if cache_key:
+                await ResponseCache.put_response(cache_key, upstream_response, request, adapter_config)
+            if similar:
+                SimilarQueryCache.put_response(request, adapter_config, MODE_BLOCKING, upstream_response)
+            return upstream_response
+        
         try:
-            # 执行普通聊天
-            response = await adapter.chat(request)
+            response = await ResponseCache.get_response(cache_key, request) if cache_key else None
+            if response is None and similar:
+                response = SimilarQueryCache.get_response(request, adapter_config, MODE_BLOCKING)
+            if response is None:
+                # 执行普通聊天；开启single_flight时相同的进行中请求只调用一次上游，对话和消息仍各自保存
+                # （续用上游对话时不合并，否则多个本地对话会共用同一个上游对话）
+                if adapter_config.get("single_flight") and not forwarding:
+                    response = await SingleFlight.do(
+                        single_flight_key(request, adapter_config), call_upstream, request.agent_id
+                    )
+                else:
+                    if adapter_config.get("single_flight"):
+                        Metrics.incr("single_flight_bypassed_total", agent_id=request.agent_id)
+                    response = await call_upstream()
             
             # 计算估算的token数（包括网络传输数据）
             input_query = request.get_query_text() or ""
@@ -51,7 +106,7 @@ class ChatService:
             input_tokens = max(1, len(input_query) // 4)
             output_tokens = max(1, len(output_message) // 4)
             # 计算完整的传输数据长度（包括JSON结构）
-            response_json = json.dumps({
+            response_json = json_codec.dumps({
                 "message": response.message,
                 "conversation_id": response.conversation_id,
                 "message_id": response.message_id,
@@ -69,7 +124,7 @@ class ChatService:
             response.total_tokens_estimated = total_tokens_estimated
             
             # 保存对话和消息到数据库
-            self._save_conversation_and_message(request, response, agent)
+            await self._save_conversation_and_message(request, response)
             
             return response
         finally:
@@ -80,119 +135,81 @@ class ChatService:
             except Exception as e:
                 pass
     
-    async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[ChatResponse, None]:
-        """处理流式聊天请求"""
-        # 获取agent信息
-        agent = self.db.query(Agent).filter(Agent.id == request.agent_id).first()
-        if not agent:
-            raise ValueError(f"Agent not found: {request.agent_id}")
+    async def chat_stream(
+        self, request: ChatRequest, accumulator: Optional[StreamAccumulator] = None, persist: bool = True
+    ) -> AsyncGenerator[StreamChunk, None]:
+        """处理流式聊天请求
         
-        # 根据智能体type字段判断是用哪个平台的适配器
-        adapter_type: str = str(agent.type)
+        每个事件只由累加器分类一次，流结束后一次性保存对话、用户消息和AI消息。
+        调用方可以传入自己的累加器，在转发时记录传输统计并在结束后读取汇总结果。
+        persist=False 时由调用方在转发完成后检查 accumulator.finished 并调用 save_stream_result，
+        上游已读完但客户端在转发完之前断开时，调用方同样需要保存（这里不再按中断处理）。
         
-        # 使用智能体的配置（config）创建适配器
-        agent_config_dict = agent.config_dict
-        adapter_config = dict[str, Any]()
-        for key, value in agent_config_dict.items():
-            adapter_config[key] = value
+        消费方提前关闭（客户端断开）时立即关闭上游流，并在后台通知Dify停止生成、
+        保存已生成的部分回答（标记为interrupted）。
+        """
+        # 获取agent信息
+        agent, adapter_type, adapter_config = await self._load_agent(request)
         
-        # 确保配置中包含必要的参数
-        if "api_key" not in adapter_config:
-            adapter_config["api_key"] = agent.config_dict.get("api_key", "")
+        # 续用上游对话：查出本地对话对应的上游对话ID
+        await UpstreamConversations.resolve(request, adapter_config)
         
         # 创建适配器
         adapter = AdapterFactory.create_adapter(adapter_type, adapter_config)
         
         # 用于收集所有流式响应
-        full_message = ""
-        reasoning_events = []  # 保存所有原始的agent_thought事件数据
-        formatted_thought = {}
-        workflow_events = []
-        other_events = []  # 保存其他事件
-        conversation_id = None
-        message_id = None
+        if accumulator is None:
+            accumulator = StreamAccumulator(request)
         
+        # 开启响应缓存/近似问题缓存的智能体：命中时重放缓存的事件，未命中时记录本次的事件
+        cache_key = ResponseCache.key_for(request, adapter_config, MODE_STREAMING)
+        similar = self._similar_cache_enabled(request, adapter_config)
+        cached = await ResponseCache.get_stream(cache_key, request) if cache_key else None
+        if cached is None and similar:
+            found = SimilarQueryCache.get_stream(request, adapter_config, MODE_STREAMING)
+            if found is not None:
+                cached, accumulator.cache_similarity = found
+        recorded: Optional[List[StreamChunk]] = [] if (cache_key or similar) and cached is None else None
+        if cached is not None:
+            accumulator.cache_hit = True
+            upstream = ResponseCache.replay(cached)
+        else:
+            upstream = adapter.chat_stream(request)  # type: ignore
         try:
             # 执行流式聊天
-            async for response in adapter.chat_stream(request):  # type: ignore
-                # 收集消息内容
-                if response.message:
-                    full_message += response.message
-                
-                # 收集思考内容（agent_thought事件）
-                if response.metadata and response.metadata.get("event") == "agent_thought":
-                    # 将每个agent_thought事件添加到列表中，而不是覆盖
-                    reasoning_events.append(response.metadata)
-                    thought_data = response.metadata
-                    
-                    # 构建格式化的思考内容（用于后续处理）
-                    thought_text = thought_data.get("thought", "")
-                    
-                    # 添加工具调用信息（如果有的话）
-                    if thought_data.get("tool") and thought_data.get("tool_input"):
-                        try:
-                            tool_input = thought_data.get("tool_input")
-                            if isinstance(tool_input, str):
-                                tool_input = json.loads(tool_input)
-                            thought_text += f"\n\n[工具调用: {thought_data['tool']}]\n"
-                            thought_text += f"参数: {json.dumps(tool_input, ensure_ascii=False, indent=2)}\n"
-                        except Exception:
-                            # 如果tool_input不是有效的JSON，直接添加
-                            thought_text += f"\n\n[工具调用: {thought_data['tool']}]\n"
-                            thought_text += f"参数: {thought_data.get('tool_input', '')}\n"
-                    
-                    # 添加文件引用信息（如果有的话）
-                    if thought_data.get("message_files") and isinstance(thought_data["message_files"], list):
-                        thought_text += "\n\n[文件引用]:\n"
-                        for i, file in enumerate(thought_data["message_files"], 1):
-                            thought_text += f"{i}. {file}\n"
-                    
-                    # 添加文件ID信息（如果有的话）
-                    if thought_data.get("file_id"):
-                        thought_text += f"\n\n[文件ID]: {thought_data['file_id']}\n"
-                    
-                    # 构建formatted_thought字典（用于后续处理）
-                    formatted_thought = {
-                        "content": thought_text,
-                        "tool_calls": [],
-                        "file_references": []
-                    }
-                    
-                    # 添加工具调用信息到formatted_thought
-                    if thought_data.get("tool"):
-                        formatted_thought["tool_calls"].append({
-                            "name": thought_data.get("tool"),
-                            "input": thought_data.get("tool_input", "")
-                        })
-                    
-                    # 添加文件引用信息到formatted_thought
-                    if thought_data.get("message_files"):
-                        formatted_thought["file_references"] = thought_data.get("message_files")
-                        
-                # 收集工作流事件和其他事件
-                elif response.metadata and "event" in response.metadata:
-                    event_type = response.metadata.get("event")
-                    # 收集工作流相关事件
-                    if event_type and event_type != "agent_thought" and ("workflow" in event_type or "node" in event_type or event_type in ["message_end", "message_file"]):
-                        workflow_events.append(response.metadata)
-                    # 只收集非回复类的其他事件（避免将agent_message、text_chunk等保存到other_events中）
-                    elif event_type and not event_type.startswith(('message', 'text', 'chunk')) and event_type not in ['agent_message']:
-                        other_events.append(response.metadata)
-                
-                # 保存消息ID（优先保留第一个非None的值）
-                # 会话ID应该始终使用请求中的会话ID，不需要从响应中收集
-                if response.message_id and message_id is None:
-                    message_id = response.message_id
+            async for response in upstream:
+                accumulator.add(response)
+                if recorded is not None:
+                    recorded.append(response)
                 
                 # 实时yield每个响应事件
                 yield response
                 
+            accumulator.finished = True
+            if recorded is not None:
+                if cache_key:
+                    await ResponseCache.put_stream(cache_key, recorded, request, adapter_config)
+                if similar:
+                    SimilarQueryCache.put_stream(request, adapter_config, MODE_STREAMING, recorded)
+            # 记录该智能体完整回答的平均输出token数，用于估算取消节省的token
+            Metrics.ewma("stream_output_tokens_ewma", len(accumulator.full_message) // 4, agent_id=request.agent_id)
             # 流结束后保存对话和消息到数据库
-            self._save_conversation_and_message_stream(request, full_message, reasoning_events, workflow_events, other_events, agent)
+            if persist:
+                await self.save_stream_result(request, accumulator)
+        except (asyncio.CancelledError, GeneratorExit):
+            if not accumulator.finished:
+                accumulator.interrupted = True
+                ChatService.run_detached(self._handle_interrupted(request, accumulator, adapter))
+            raise
         except Exception as e:
             # 记录错误但不中断流式传输
-            print(f"流式聊天处理出错: {e}")
+            logger.error(f"流式聊天处理出错: {e}")
         finally:
+            # 立即关闭上游流，释放连接
+            try:
+                await upstream.aclose()
+            except Exception:
+                pass
             # 关闭适配器连接（如果有的话）
             # BaseAdapter定义了close抽象方法，所以我们可以安全地调用它
             try:
@@ -200,170 +217,139 @@ class ChatService:
             except Exception as e:
                 pass
     
-    def _save_conversation_and_message_stream(self, request: ChatRequest, full_message: str, reasoning_events: list, workflow_events: list, other_events: list, agent):
-        """保存流式对话和消息到数据库"""
-        try:
-            # 生成对话ID（如果有会话ID，强制使用传参的会话ID；如果没有会话ID就可以有解析出来的会话ID；如果都没有的话就新建会话ID）
-            conversation_id = request.conversation_id
-            if not conversation_id:
-                conversation_id = str(uuid.uuid4())
-            
-            # 保存或更新对话
-            conversation = self.db.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
-            
-            if not conversation:
-                conversation = Conversation(
-                    id=conversation_id,
-                    merchant_id=request.merchant_id,
-                    user_id=request.user_id,
-                    agent_id=request.agent_id,
-                    title=request.get_query_text()[:100],  # 使用前100个字符作为标题
-                    status="active"
-                )
-                self.db.add(conversation)
-                self.db.commit()
-                self.db.refresh(conversation)
-            elif request.conversation_id and request.conversation_id != conversation_id:
-                # 更新对话的更新时间
-                # 让数据库自动更新
-                self.db.commit()
+    @staticmethod
+    def _similar_cache_enabled(request: ChatRequest, adapter_config: Dict[str, Any]) -> bool:
+        """是否使用近似问题缓存：续用上游对话时回答依赖上文，不使用（计入 similar_query_cache_bypassed_total）"""
+        if not SimilarQueryCache.enabled(adapter_config):
+            return False
+        if request.upstream_conversation_id:
+            Metrics.incr("similar_query_cache_bypassed_total", agent_id=request.agent_id)
+            return False
+        return True
+    
+    async def _handle_interrupted(self, request: ChatRequest, accumulator: StreamAccumulator, adapter):
+        """客户端断开后：通知上游停止生成，记录节省的token，保存部分回答"""
+        if accumulator.task_id and not accumulator.cache_hit:
+            try:
+                await adapter.stop(accumulator.task_id, request)
+            except Exception as e:
+                logger.warning(f"停止上游生成失败: {e}")
         
-            # 保存用户消息
-            user_query = request.get_query_text() or ""
-            
-            user_message = Message(
-                conversation_id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                role="user",
-                content=user_query
-            )
-            self.db.add(user_message)
-            
-            # 保存AI回复消息（总是保存，即使内容为空）
-            # 提取workflow_events（如果有的话）
-            metadata_for_storage = None  # 不再存储metadata，因为信息已经提取到workflow_events中
-            
-            # 计算token和费用
-            # 基于完整消息内容计算token数（按4字符=1token估算）
-            content_length = len(full_message)
-            content_tokens = max(1, content_length // 4)
-            
-            # 计算workflow_events的token数
-            workflow_tokens = 0
-            if workflow_events:
-                try:
-                    workflow_events_str = json.dumps(workflow_events)
-                    workflow_tokens = max(1, len(workflow_events_str) // 4)
-                except Exception:
-                    workflow_tokens = 1
-            
-            # 总token数
-            total_tokens = content_tokens + workflow_tokens
-            
-            # 计算费用（按照每百万token 12元的价格）
-            cost = 0.0
-            if total_tokens > 0:
-                cost = (total_tokens / 1000000) * 12
-            
-            # 处理reasoning_events，确保保存完整的工具调用响应数据
-            processed_reasoning_events = []
-            if reasoning_events:
-                # 创建一个字典来合并相同工具调用的不同事件
-                tool_calls_dict = {}
-                
-                for event in reasoning_events:
-                    # 检查是否是工具调用事件
-                    if event.get('tool') or event.get('tool_name') or event.get('name') or event.get('toll'):
-                        tool_name = event.get('tool') or event.get('tool_name') or event.get('name') or event.get('toll')
-                        tool_input = event.get('tool_input') or event.get('input') or ''
-                        
-                        # 使用工具名和输入作为唯一键
-                        tool_key = f"{tool_name}_{str(tool_input)}"
-                        
-                        # 如果已经有这个工具调用，合并数据
-                        if tool_key in tool_calls_dict:
-                            # 优先保留observation数据
-                            if event.get('observation') and not tool_calls_dict[tool_key].get('observation'):
-                                tool_calls_dict[tool_key]['observation'] = event['observation']
-                        else:
-                            # 添加新的工具调用
-                            tool_calls_dict[tool_key] = event
-                    else:
-                        # 非工具调用事件直接添加
-                        processed_reasoning_events.append(event)
-                
-                # 将合并后的工具调用添加到处理后的事件列表中
-                processed_reasoning_events.extend(tool_calls_dict.values())
-            
-            ai_message = Message(
-                conversation_id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                role="agent",
-                content=full_message,  # 确保保存完整的流式响应内容
-                reasoning_events=processed_reasoning_events if processed_reasoning_events else None,  # 保存原始的agent_thought事件数据
-                other_events=other_events if other_events else None,  # 保存其他事件
-                message_metadata=metadata_for_storage,
-                workflow_events=workflow_events if workflow_events else None,
-                cost=cost,
-                total_tokens=total_tokens,
-                total_tokens_estimated=total_tokens  # 使用实际计算的token数
-            )
-            self.db.add(ai_message)
-            
-            self.db.commit()
-        except Exception as e:
-            # 记录错误但不中断流式传输
-            print(f"保存消息到数据库时出错: {e}")
-            self.db.rollback()
+        generated = len(accumulator.full_message) // 4
+        expected = Metrics.get("stream_output_tokens_ewma", agent_id=request.agent_id)
+        Metrics.incr("stream_cancelled_total", agent_id=request.agent_id)
+        Metrics.incr("stream_tokens_saved_estimated", max(0, int(expected) - generated), agent_id=request.agent_id)
+        
+        await self.save_stream_result(request, accumulator)
     
-    def _save_conversation_and_message(self, request: ChatRequest, response: ChatResponse, agent):
+    async def _persist(self, chat: PendingChat):
+        """写入一次聊天的对话和消息
+        
+        启用了写回器时交给后台批量写入，否则在一个事务中同步写入，只提交一次
+        """
+        if self.db is None and MessagePersister.enabled():
+            MessagePersister.submit(chat)
+            return
+        
+        async with self._session() as db:
+            try:
+                await write_chats(db, [chat])
+            except Exception as e:
+                # 记录错误但不中断流式传输
+                logger.error(f"保存消息到数据库时出错: {e}")
+                await db.rollback()
+    
+    def _conversation_values(self, request: ChatRequest, conversation_id: str, upstream_conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """对话不存在时用于创建对话的字段
+        
+        upstream_conversation_id 为上游本次返回的对话ID，映射是新的或有变化时一起写入（已存在的对话会被更新）
+        """
+        now = datetime.utcnow()
+        return {
+            "id": conversation_id,
+            "merchant_id": request.merchant_id,
+            "user_id": request.user_id,
+            "agent_id": request.agent_id,
+            "title": request.get_query_text()[:100],  # 使用前100个字符作为标题
+            "status": "active",
+            "upstream_conversation_id": UpstreamConversations.record(request, conversation_id, upstream_conversation_id),
+            "created_at": now,
+            "updated_at": now
+        }
+    
+    def _message_values(self, request: ChatRequest, conversation_id: str, role: str, content: str, **fields) -> Dict[str, Any]:
+        """消息字段（入队时记录创建时间，而不是批量写入的时间）"""
+        values = {
+            "conversation_id": conversation_id,
+            "merchant_id": request.merchant_id,
+            "user_id": request.user_id,
+            "agent_id": request.agent_id,
+            "role": role,
+            "content": content,
+            "reasoning_events": None,
+            "other_events": None,
+            "message_metadata": None,
+            "workflow_events": None,
+            "cost": 0.0,
+            "total_tokens": 0,
+            "total_tokens_estimated": 0,
+            "created_at": datetime.utcnow()
+        }
+        values.update(fields)
+        return values
+    
+    async def save_stream_result(self, request: ChatRequest, accumulator: StreamAccumulator):
+        """保存流式对话和消息到数据库
+        
+        对话（不存在时创建）、用户消息和AI消息一起写入
+        """
+        # 生成对话ID（如果有会话ID，强制使用传参的会话ID；如果没有就新建会话ID）
+        conversation_id = request.conversation_id
+        if not conversation_id:
+            conversation_id = str(uuid.uuid4())
+        
+        # 保存用户消息
+        user_message = self._message_values(request, conversation_id, "user", request.get_query_text() or "")
+        
+        # 保存AI回复消息（总是保存，即使内容为空）
+        # token数与返回给前端的统计保持一致
+        total_tokens = accumulator.total_tokens_estimated
+        reasoning_events = accumulator.reasoning_events
+        ai_message = self._message_values(
+            request, conversation_id, "agent",
+            accumulator.full_message,  # 确保保存完整的流式响应内容
+            reasoning_events=reasoning_events if reasoning_events else None,  # 保存合并后的agent_thought事件数据
+            other_events=accumulator.other_events if accumulator.other_events else None,  # 保存其他事件
+            workflow_events=accumulator.workflow_events if accumulator.workflow_events else None,
+            cost=accumulator.cost,
+            message_metadata=accumulator.message_metadata,
+            total_tokens=total_tokens,
+            total_tokens_estimated=total_tokens
+        )
+        
+        # 缓存重放的事件中的上游对话ID属于其他对话，不记录
+        upstream_conversation_id = None if accumulator.cache_hit else accumulator.upstream_conversation_id
+        await self._persist(PendingChat(
+            conversation=self._conversation_values(request, conversation_id, upstream_conversation_id),
+            messages=[user_message, ai_message]
+        ))
+    
+    async def _save_conversation_and_message(self, request: ChatRequest, response: ChatResponse):
         """保存对话和消息到数据库"""
         try:
+            # 上游本次返回的对话ID；缓存命中的响应中的ID属于其他对话，不记录
+            # （合并请求的等待者拿到的副本没有对话ID）
+            upstream_conversation_id = None if (response.metadata or {}).get("cache_hit") else response.conversation_id
+            
             # 生成对话ID（如果有会话ID，强制使用传参的会话ID；如果没有会话ID就可以有解析出来的会话ID；如果都没有的话就新建会话ID）
             conversation_id = request.conversation_id
             if not conversation_id:
                 conversation_id = response.conversation_id or str(uuid.uuid4())
+                # 新建的对话ID返回给客户端，后续轮次带上它
+                response.conversation_id = conversation_id
             
-            # 保存或更新对话
-            conversation = self.db.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
-            
-            if not conversation:
-                conversation = Conversation(
-                    id=conversation_id,
-                    merchant_id=request.merchant_id,
-                    user_id=request.user_id,
-                    agent_id=request.agent_id,
-                    title=request.get_query_text()[:100],  # 使用前100个字符作为标题
-                    status="active"
-                )
-                self.db.add(conversation)
-                self.db.commit()
-                self.db.refresh(conversation)
-            elif request.conversation_id and request.conversation_id != conversation_id:
-                # 更新对话的更新时间
-                # 让数据库自动更新
-                self.db.commit()
-        
             # 保存用户消息
-            user_query = request.get_query_text() or ""
-            
-            user_message = Message(
-                conversation_id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                role="user",
-                content=user_query
-            )
-            self.db.add(user_message)
+            user_message = self._message_values(request, conversation_id, "user", request.get_query_text() or "")
             
             # 保存AI回复消息（总是保存，即使内容为空）
             # 提取workflow_events（如果有的话）
@@ -415,7 +401,7 @@ class ChatService:
                 workflow_events_length = 0
                 if workflow_events:
                     try:
-                        workflow_events_str = json.dumps(workflow_events)
+                        workflow_events_str = json_codec.dumps(workflow_events)
                         workflow_events_length = len(workflow_events_str)
                     except Exception:
                         workflow_events_length = 0
@@ -439,13 +425,9 @@ class ChatService:
                     # 确保每个agent_thought事件都保存完整的数据，包括observation
                     processed_reasoning_events.append(event)
         
-            ai_message = Message(
-                conversation_id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                role="agent",
-                content=response.message or "",  # 确保content不为None
+            ai_message = self._message_values(
+                request, conversation_id, "agent",
+                response.message or "",  # 确保content不为None
                 reasoning_events=processed_reasoning_events if processed_reasoning_events else None,  # 保存思考内容
                 other_events=other_events if other_events else None,  # 保存其他事件
                 message_metadata=metadata_for_storage,
@@ -454,10 +436,11 @@ class ChatService:
                 total_tokens=total_tokens,
                 total_tokens_estimated=response.total_tokens_estimated or total_tokens  # 确保保存估算的token数
             )
-            self.db.add(ai_message)
-            
-            self.db.commit()
         except Exception as e:
-            # 记录错误但不中断流式传输
-            print(f"保存消息到数据库时出错: {e}")
-            self.db.rollback()
\ No newline at end of file
+            logger.error(f"保存消息到数据库时出错: {e}")
+            return
+        
+        await self._persist(PendingChat(
+            conversation=self._conversation_values(request, conversation_id, upstream_conversation_id),
+            messages=[user_message, ai_message]
+        ))
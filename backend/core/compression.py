@@ -0,0 +1,162 @@
+"""
+HTTP响应压缩
+
+- CompressionMiddleware：按Accept-Encoding协商（br优先，其次gzip），基于Starlette的GZipResponder，
+  小于阈值的响应不压缩；已设置Content-Encoding的响应原样透传；
+  SSE流（text/event-stream）立即发送响应头并原样透传，不等待第一个事件。
+- StreamCompressor / compress_stream：SSE流的压缩，每个事件写入后立即flush，
+  客户端可以立刻解压出完整事件，不会因为压缩器缓冲而增加延迟。
+
+brotli为可选依赖，未安装时只使用gzip。
+"""
+
+import io
+import zlib
+from typing import AsyncGenerator, AsyncIterator, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from core.config import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 取决于运行环境
+    brotli = None
+
+# 服务端偏好顺序
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """根据Accept-Encoding选择压缩算法，不支持时返回None"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StreamCompressor:
+    """流式压缩器，每次写入后flush，输出可被客户端立即解压"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+        else:
+            # wbits=31：带gzip头
+            self._compressor = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+async def compress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncGenerator[bytes, None]:
+    """逐个事件压缩并flush"""
+    compressor = StreamCompressor(encoding)
+    try:
+        async for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def _is_event_stream(message: Message) -> bool:
+    return Headers(raw=message["headers"]).get("content-type", "").startswith("text/event-stream")
+
+
+class _GZipResponder(GZipResponder):
+    """Starlette的gzip压缩，SSE流不等第一个数据块，立即发送响应头并原样透传（由聊天路由自行压缩）"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+        super().__init__(app, minimum_size, compresslevel=settings.GZIP_LEVEL)
+        self.event_stream = False
+
+    async def send_with_gzip(self, message: Message) -> None:
+        if message["type"] == "http.response.start" and _is_event_stream(message):
+            self.event_stream = True
+        if self.event_stream:
+            await self.send(message)
+            return
+        await super().send_with_gzip(message)
+
+
+class _BrotliFile:
+    """提供GZipResponder使用的write/close接口，输出br压缩数据（每次写入后flush）"""
+
+    def __init__(self, buffer: io.BytesIO) -> None:
+        self.buffer = buffer
+        self._compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+
+    def write(self, data: bytes) -> None:
+        self.buffer.write(self._compressor.process(data) + self._compressor.flush())
+
+    def close(self) -> None:
+        self.buffer.write(self._compressor.finish())
+
+
+class _BrotliResponder(_GZipResponder):
+    """复用Starlette gzip响应的处理流程（阈值、Content-Length、Vary），只替换压缩器和Content-Encoding"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+        super().__init__(app, minimum_size)
+        # GzipFile创建时已经向原缓冲区写入了gzip头，换用新的缓冲区
+        self.gzip_buffer = io.BytesIO()
+        self.gzip_file = _BrotliFile(self.gzip_buffer)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async def send_as_br(message: Message) -> None:
+            if message["type"] == "http.response.start" and not self.content_encoding_set:
+                headers = MutableHeaders(raw=message["headers"])
+                if headers.get("content-encoding") == "gzip":
+                    headers["Content-Encoding"] = "br"
+            await send(message)
+
+        await super().__call__(scope, receive, send_as_br)
+
+
+class CompressionMiddleware:
+    """按Accept-Encoding压缩普通响应（会话列表、消息列表等），br优先，其次gzip"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _BrotliResponder if encoding == "br" else _GZipResponder
+        await responder(self.app, self.minimum_size)(scope, receive, send)
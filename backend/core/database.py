@@ -1,24 +1,136 @@
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, List
+import logging
+from sqlalchemy import Column, create_engine, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import CreateColumn
 from core.config import settings
+from core import json_codec
 
 # 数据库连接URL
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
 # 创建引擎
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    echo=True,
+    # JSON列使用统一的编解码器
+    json_serializer=json_codec.dumps_str,
+    json_deserializer=json_codec.loads
+)
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 同步驱动 -> 异步驱动
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url: str) -> str:
+    """把同步数据库URL转换为对应异步驱动的URL（已是异步驱动时原样返回）"""
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername)
+    if drivername is None:
+        return url
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+# 异步引擎：API层（聊天、会话、消息）使用，查询不阻塞事件循环
+# 同步引擎保留给init_db.py和脚本使用
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL),
+    echo=True,
+    json_serializer=json_codec.dumps_str,
+    json_deserializer=json_codec.loads
+)
+
+# 提交后不过期对象，避免在异步会话中访问属性时触发隐式IO
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # 创建基础类
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+def missing_columns(bind=engine) -> List[Column]:
+    """已存在的表中缺少的列（表本身不存在时不算，由create_all创建）"""
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(column for column in table.columns if column.name not in existing)
+    return missing
+
+
+def sync_schema(bind=engine):
+    """创建缺少的表，并给已存在的表补上后来新增的列和索引（可重复执行）
+
+    由 init_db.py 调用（部署或升级时执行一次），应用启动时只用 check_schema 检查，不修改表结构。
+    create_all 只创建不存在的表，不会修改已有的表；
+    补列只处理可空或带 server_default 的列，其他列需要手动迁移。
+    列定义（类型、默认值、NOT NULL）按数据库方言编译，与create_all建表时一致。
+    """
+    Base.metadata.create_all(bind=bind)
+    columns = missing_columns(bind)
+    preparer = bind.dialect.identifier_preparer
+    with bind.begin() as conn:
+        for column in columns:
+            name = f"{column.table.name}.{column.name}"
+            if not column.nullable and column.server_default is None:
+                logger.error(f"Column {name} is missing and cannot be added automatically")
+                continue
+            definition = CreateColumn(column).compile(dialect=bind.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {preparer.format_table(column.table)} ADD COLUMN {definition}")
+            logger.warning(f"Added missing column {name}")
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def check_schema(bind=engine):
+    """启动时检查表结构，缺少列时拒绝启动（提示先运行 python init_db.py）"""
+    Base.metadata.create_all(bind=bind)
+    columns = missing_columns(bind)
+    if columns:
+        names = ", ".join(f"{column.table.name}.{column.name}" for column in columns)
+        raise RuntimeError(f"Database schema is out of date, missing columns: {names}. Run `python init_db.py` first.")
+
 # 数据库依赖项
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 短生命周期会话：只在需要访问数据库的代码段内持有连接，用完立即归还连接池
+# （例如流式聊天中，上游流式传输期间不应占用数据库连接）
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# 异步数据库依赖项
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# 异步短生命周期会话
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
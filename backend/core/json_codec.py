@@ -0,0 +1,108 @@
+"""
+统一的JSON编解码模块
+
+安装了orjson时使用orjson，否则回退到标准库json。
+dumps 统一返回UTF-8编码的bytes（紧凑格式、不转义非ASCII字符），
+可通过环境变量 JSON_CODEC=json 强制使用标准库。
+
+两个后端的输出逐字节相同：JSON不支持的类型（datetime、dataclass、Enum等）都交给同一个 _default 处理，
+datetime统一为isoformat（T分隔），NaN和±Infinity统一输出为null（与orjson相同，标准库默认输出的NaN不是合法JSON）。
+唯一的差别是极大/极小浮点数的指数写法（1e-07 / 1e-7）。
+
+注意：token和费用的估算基于这里的输出长度（见StreamAccumulator），改用本模块后
+非ASCII字符按UTF-8字节计（中文每字3字节，之前的 \\uXXXX 转义为6个字符），分隔符也不再带空格，
+因此中文内容的估算值比之前的版本低。
+"""
+
+import dataclasses
+import json
+import logging
+import math
+from datetime import date, datetime, time
+from enum import Enum
+from typing import Any, Union
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+# 当前使用的后端名称
+BACKEND = "orjson" if orjson is not None and settings.JSON_CODEC != "json" else "json"
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError 是它的子类
+
+
+def _default(obj: Any) -> Any:
+    """JSON不支持的类型，两个后端共用"""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    return str(obj)
+
+
+def _finite(obj: Any) -> Any:
+    """把NaN和±Infinity替换为None（只在标准库遇到它们时才遍历）"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+# 复用同一个编码器实例，避免json.dumps带参数时每次调用都新建JSONEncoder；
+# allow_nan=False时遇到非有限浮点数抛出ValueError，再用替换后的对象重新编码
+_stdlib_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), allow_nan=False, default=_default)
+_stdlib_finite_encoder = json.JSONEncoder(
+    ensure_ascii=False, separators=(",", ":"), allow_nan=False, default=lambda obj: _finite(_default(obj))
+)
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    try:
+        return _stdlib_encoder.encode(obj).encode("utf-8")
+    except ValueError:
+        return _stdlib_finite_encoder.encode(_finite(obj)).encode("utf-8")
+
+
+if BACKEND == "orjson":
+    # datetime和dataclass也交给_default，与标准库的输出保持一致
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(obj: Any) -> bytes:
+        """序列化为bytes"""
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # orjson不支持的类型（如超过64位的整数）回退到标准库
+            return _stdlib_dumps(obj)
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """反序列化bytes或str"""
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> bytes:
+        """序列化为bytes"""
+        return _stdlib_dumps(obj)
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """反序列化bytes或str"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+def dumps_str(obj: Any) -> str:
+    """序列化为str（用于需要文本的场景，如SQLAlchemy的json_serializer）"""
+    return dumps(obj).decode("utf-8")
+
+
+logger.debug(f"JSON codec backend: {BACKEND}")
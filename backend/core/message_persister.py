@@ -0,0 +1,329 @@
+"""
+消息异步写回（write-behind）
+
+聊天结束后不在请求路径上提交数据库，而是把对话和消息交给后台写入任务：
+按刷新间隔或批量大小攒批，用一次事务批量插入（executemany）。
+记录同时追加到本地spool文件：后台任务在每次写库之前把新记录写入spool并fsync（在线程中执行，不阻塞事件循环），
+进程崩溃后重启时会重放未确认的记录；应用关闭时会刷新剩余记录。
+spool不是逐条同步的：崩溃时最近一个刷新周期（MESSAGE_FLUSH_INTERVAL）内还没写入spool的记录会丢失。
+
+投递语义为至少一次，消息按幂等键（messages.dedupe_key，由聊天ID和序号组成）写入：
+如果在数据库提交之后、写入确认标记之前崩溃，重启后重放的消息会被跳过，不会重复。
+
+批次写入失败时：
+    - 数据库不可用（SELECT 1 也失败）时整批保留，下个周期重试；
+    - 否则把批次二分重试，找出写不进去的聊天，其余正常提交；
+    - 同一条聊天失败 MESSAGE_MAX_ATTEMPTS 次后写入死信文件（MESSAGE_DEAD_LETTER_PATH）并确认，
+      不再阻塞后面的记录。失败次数只在进程内计数，重启后重新计算。
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import bindparam, insert, or_, text, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from core import json_codec
+from core.config import settings
+from core.database import async_session_scope
+from core.metrics import Metrics
+from models.message import Message
+from models.session import Conversation
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class PendingChat:
+    """一次聊天需要写入的数据：对话（不存在时创建）和若干条消息"""
+    conversation: Dict[str, Any]
+    messages: List[Dict[str, Any]]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0  # 数据库可用时写入失败的次数（不写入spool）
+    error: Optional[str] = None  # 最近一次写入失败的错误
+
+    def to_record(self) -> Dict[str, Any]:
+        return {"id": self.id, "conversation": self.conversation, "messages": self.messages}
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "PendingChat":
+        conversation = _restore_datetimes(record["conversation"])
+        # 旧版本写入spool的记录没有这个字段
+        conversation.setdefault("upstream_conversation_id", None)
+        return cls(
+            conversation=conversation,
+            messages=[_restore_datetimes(message) for message in record["messages"]],
+            id=record["id"]
+        )
+
+
+def _restore_datetimes(values: Dict[str, Any]) -> Dict[str, Any]:
+    """spool中的时间为ISO格式字符串，还原为datetime"""
+    for key in ("created_at", "updated_at"):
+        if isinstance(values.get(key), str):
+            values[key] = datetime.fromisoformat(values[key])
+    return values
+
+
+# 更新已存在对话的上游对话ID（只更新同一用户、同一智能体的对话，值相同时不写）；
+# 使用Core表而不是ORM实体，多组参数时按executemany执行，而不是ORM的按主键批量更新
+_conversations = Conversation.__table__
+_update_upstream_conversation = update(_conversations).where(
+    _conversations.c.id == bindparam("b_id"),
+    _conversations.c.agent_id == bindparam("b_agent_id"),
+    _conversations.c.user_id == bindparam("b_user_id"),
+    or_(_conversations.c.upstream_conversation_id.is_(None), _conversations.c.upstream_conversation_id != bindparam("b_upstream_id"))
+).values(upstream_conversation_id=bindparam("b_upstream_id"))
+
+
+def _insert_skipping_duplicates(model, key: str, dialect: str):
+    """按唯一键跳过已存在的行（对话按主键，消息按幂等键）
+
+    不使用 INSERT IGNORE：它还会忽略其他错误（例如数据过长、外键不存在），
+    有问题的记录会被静默丢掉，而不是进入死信文件
+    """
+    if dialect == "mysql":
+        statement = mysql.insert(model)
+        return statement.on_duplicate_key_update({key: statement.inserted[key]})
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=[key])
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=[key])
+    return insert(model)
+
+
+async def write_chats(db, chats: List[PendingChat]):
+    """在同一个事务中写入一批聊天：对话按主键忽略已存在的，消息用executemany插入
+
+    带有上游对话ID的对话（映射是新的或有变化）再更新已存在的行，同一对话以批次中最后一条为准。
+    消息的幂等键为 聊天ID:序号，重放同一条聊天时已写入的消息会被跳过。
+    """
+    conversations: Dict[str, Dict[str, Any]] = {}
+    upstream_ids: Dict[str, Dict[str, Any]] = {}
+    for chat in chats:
+        conversation = chat.conversation
+        conversations.setdefault(conversation["id"], conversation)
+        if conversation.get("upstream_conversation_id"):
+            upstream_ids[conversation["id"]] = {
+                "b_id": conversation["id"],
+                "b_agent_id": conversation["agent_id"],
+                "b_user_id": conversation["user_id"],
+                "b_upstream_id": conversation["upstream_conversation_id"]
+            }
+
+    # 已存在的对话（包括其他进程并发创建的）直接跳过，不需要先查询
+    dialect = db.bind.dialect.name
+    await db.execute(_insert_skipping_duplicates(Conversation, "id", dialect), list(conversations.values()))
+    if upstream_ids:
+        await db.execute(_update_upstream_conversation, list(upstream_ids.values()))
+    messages = []
+    for chat in chats:
+        for index, message in enumerate(chat.messages):
+            message.setdefault("dedupe_key", f"{chat.id}:{index}")
+            messages.append(message)
+    await db.execute(_insert_skipping_duplicates(Message, "dedupe_key", dialect), messages)
+    await db.commit()
+
+
+class MessagePersister:
+    """进程级的消息写回器
+
+    submit() 只放入内存队列，由后台任务按 MESSAGE_FLUSH_INTERVAL / MESSAGE_FLUSH_BATCH_SIZE
+    先写入spool再批量提交。
+    """
+
+    _pending: List[PendingChat] = []
+    _unsynced: List[bytes] = []  # 已入队、还没写入spool的记录
+    _wakeup: Optional[asyncio.Event] = None
+    _task: Optional[asyncio.Task] = None
+    _spool = None
+    _stopping = False
+
+    @classmethod
+    def enabled(cls) -> bool:
+        """写回器是否在运行（未启用时调用方应同步写库）"""
+        return cls._task is not None and not cls._task.done()
+
+    @classmethod
+    async def startup(cls):
+        """重放spool中未确认的记录并启动后台写入任务"""
+        if not settings.MESSAGE_WRITE_BEHIND:
+            return
+
+        cls._pending = cls._load_spool()
+        cls._unsynced = []
+        if cls._pending:
+            logger.warning(f"Replaying {len(cls._pending)} unflushed chats from {settings.MESSAGE_SPOOL_PATH}")
+        cls._spool = open(settings.MESSAGE_SPOOL_PATH, "ab")
+        cls._wakeup = asyncio.Event()
+        cls._stopping = False
+        cls._task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def shutdown(cls):
+        """停止后台任务并刷新剩余记录"""
+        if cls._task is None:
+            return
+        # 不直接取消任务，避免打断正在提交的批次；由后台任务写完剩余记录后退出
+        cls._stopping = True
+        cls._wakeup.set()
+        await cls._task
+        cls._task = None
+        # 数据库不可用时未写入的记录留在spool中，下次启动时重放
+        await cls._sync_spool()
+        cls._spool.close()
+        cls._spool = None
+
+    @classmethod
+    def submit(cls, chat: PendingChat):
+        """提交一条待写入的聊天（不在事件循环中写文件，由后台任务写入spool）"""
+        cls._unsynced.append(json_codec.dumps(chat.to_record()) + b"\n")
+        cls._pending.append(chat)
+        if len(cls._pending) >= settings.MESSAGE_FLUSH_BATCH_SIZE:
+            cls._wakeup.set()
+
+    @classmethod
+    async def flush(cls) -> bool:
+        """写入一批记录，返回是否整批处理完（写入或移入死信）"""
+        batch = cls._pending[:settings.MESSAGE_FLUSH_BATCH_SIZE]
+        if not batch:
+            return True
+        try:
+            await cls._write_batch(batch)
+        except Exception as e:
+            if not await cls._database_available():
+                logger.error(f"Failed to flush {len(batch)} chats, will retry: {e}")
+                return False
+            logger.error(f"Failed to flush {len(batch)} chats, retrying in smaller batches: {e}")
+            written, failed = await cls._write_split(batch)
+        else:
+            written, failed = batch, []
+
+        dead = [chat for chat in failed if chat.attempts >= settings.MESSAGE_MAX_ATTEMPTS]
+        cls._dead_letter(dead)
+        done = {chat.id for chat in written + dead}
+        cls._pending[:len(batch)] = [chat for chat in batch if chat.id not in done]
+        cls._acknowledge(written + dead)
+        return len(dead) == len(failed)
+
+    @classmethod
+    async def _write_split(cls, batch: List[PendingChat]):
+        """二分写入批次，返回 (写入成功的, 单独写入也失败的)"""
+        try:
+            await cls._write_batch(batch)
+            return batch, []
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].attempts += 1
+                batch[0].error = str(e)
+                logger.error(f"Failed to write chat {batch[0].id} (attempt {batch[0].attempts}): {e}")
+                return [], batch
+        middle = len(batch) // 2
+        written_left, failed_left = await cls._write_split(batch[:middle])
+        written_right, failed_right = await cls._write_split(batch[middle:])
+        return written_left + written_right, failed_left + failed_right
+
+    @classmethod
+    async def _write_batch(cls, batch: List[PendingChat]):
+        async with async_session_scope() as db:
+            try:
+                await write_chats(db, batch)
+            except Exception:
+                await db.rollback()
+                raise
+
+    @classmethod
+    async def _database_available(cls) -> bool:
+        """区分数据库不可用和个别记录写不进去"""
+        try:
+            async with async_session_scope() as db:
+                await db.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            return False
+
+    @classmethod
+    def _dead_letter(cls, chats: List[PendingChat]):
+        """把多次写入失败的聊天追加到死信文件"""
+        if not chats:
+            return
+        with open(settings.MESSAGE_DEAD_LETTER_PATH, "ab") as f:
+            for chat in chats:
+                record = {**chat.to_record(), "error": chat.error, "attempts": chat.attempts, "dead_at": datetime.utcnow()}
+                f.write(json_codec.dumps(record) + b"\n")
+        logger.error(f"Moved {len(chats)} chats to {settings.MESSAGE_DEAD_LETTER_PATH}")
+        Metrics.incr("message_dead_letter_total", len(chats))
+
+    @classmethod
+    async def _sync_spool(cls):
+        """把新入队的记录追加到spool并fsync"""
+        if not cls._unsynced:
+            return
+        lines, cls._unsynced = cls._unsynced, []
+        try:
+            await asyncio.to_thread(cls._write_spool, lines)
+        except OSError as e:
+            # 写不进spool时不影响写库，下个周期重试
+            logger.error(f"Failed to write {len(lines)} chats to {settings.MESSAGE_SPOOL_PATH}: {e}")
+            cls._unsynced[:0] = lines
+
+    @classmethod
+    def _write_spool(cls, lines: List[bytes]):
+        cls._spool.writelines(lines)
+        cls._spool.flush()
+        os.fsync(cls._spool.fileno())
+
+    @classmethod
+    def _acknowledge(cls, batch: List[PendingChat]):
+        """记录已提交的批次；没有未提交记录时直接截断文件"""
+        if not cls._pending:
+            # 还没写入spool的记录也都已提交，不再需要写入
+            cls._unsynced = []
+            cls._spool.seek(0)
+            cls._spool.truncate()
+        else:
+            cls._spool.write(json_codec.dumps({"committed": [chat.id for chat in batch]}) + b"\n")
+        cls._spool.flush()
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            try:
+                await asyncio.wait_for(cls._wakeup.wait(), timeout=settings.MESSAGE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            cls._wakeup.clear()
+            while cls._pending:
+                await cls._sync_spool()
+                if not await cls.flush():
+                    # 数据库不可用或有记录写入失败时保留，下个周期重试；关闭时留在spool中，下次启动时重放
+                    break
+                if not cls._stopping and len(cls._pending) < settings.MESSAGE_FLUSH_BATCH_SIZE:
+                    break
+            if cls._stopping:
+                return
+
+    @classmethod
+    def _load_spool(cls) -> List[PendingChat]:
+        """读取spool，返回尚未确认提交的记录"""
+        path = settings.MESSAGE_SPOOL_PATH
+        if not os.path.exists(path):
+            return []
+
+        records: Dict[str, Dict[str, Any]] = {}
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json_codec.loads(line)
+                except json_codec.JSONDecodeError:
+                    # 崩溃时可能留下写了一半的最后一行
+                    continue
+                if "committed" in record:
+                    for chat_id in record["committed"]:
+                        records.pop(chat_id, None)
+                else:
+                    records[record["id"]] = record
+        return [PendingChat.from_record(record) for record in records.values()]
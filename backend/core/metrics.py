@@ -0,0 +1,64 @@
+"""
+进程内运行指标
+
+简单的计数器/数值指标，按名称和标签（如agent_id、merchant_id）区分，
+通过 GET /api/v1/metrics 以JSON形式查看。多进程部署时每个进程各自统计。
+"""
+
+from typing import Any, Dict, List, Tuple
+
+_LabelKey = Tuple[Tuple[str, Any], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """进程级指标注册表"""
+
+    _counters: Dict[str, Dict[_LabelKey, float]] = {}
+    _gauges: Dict[str, Dict[_LabelKey, float]] = {}
+
+    @classmethod
+    def incr(cls, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        series = cls._counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    @classmethod
+    def set(cls, name: str, value: float, **labels):
+        """设置数值指标"""
+        cls._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    @classmethod
+    def get(cls, name: str, default: float = 0, **labels) -> float:
+        key = _label_key(labels)
+        for store in (cls._counters, cls._gauges):
+            if key in store.get(name, {}):
+                return store[name][key]
+        return default
+
+    @classmethod
+    def ewma(cls, name: str, value: float, alpha: float = 0.2, **labels) -> float:
+        """更新并返回指数加权移动平均（首个样本直接作为初始值）"""
+        series = cls._gauges.setdefault(name, {})
+        key = _label_key(labels)
+        previous = series.get(key)
+        series[key] = value if previous is None else previous + alpha * (value - previous)
+        return series[key]
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, List[Dict[str, Any]]]:
+        """导出所有指标：{名称: [{"labels": {...}, "value": 数值}]}"""
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for store in (cls._counters, cls._gauges):
+            for name, series in store.items():
+                result[name] = [{"labels": dict(key), "value": value} for key, value in series.items()]
+        return result
+
+    @classmethod
+    def reset(cls):
+        cls._counters.clear()
+        cls._gauges.clear()
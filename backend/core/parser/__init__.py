@@ -1,3 +1,4 @@
-from .dify_parser import DifyParser
+from .sse_decoder import SSEDecoder, SSEEvent, aiter_sse
+from .dify_parser import DifyResponseParser
 
-__all__ = ["DifyParser"]
\ No newline at end of file
+__all__ = ["DifyResponseParser", "SSEDecoder", "SSEEvent", "aiter_sse"]
@@ -1,479 +1,401 @@
+"""
+Dify响应解析
+
+- 阻塞响应：DifyResponseParser.parse_blocking_response 转换为ChatResponse；
+- 流式事件：按事件名查表分发到提取函数，每条事件转换为一个StreamChunk，未知事件忽略。
+  新的事件类型用 DifyResponseParser.register_event_extractor 注册，不需要修改分发逻辑。
+
+SSE的分帧和解码见 core/parser/sse_decoder.py。
+"""
+
 import json
-from typing import Dict, Any, AsyncGenerator, Optional, Union
-from ..adapter.base import ChatResponse
+from typing import Any, Callable, Dict, Optional
+from core.adapter.base import ChatRequest, ChatResponse, StreamChunk
+
+
+# 流式事件提取函数：每个函数把一条Dify事件转换为StreamChunk，返回None表示忽略该事件
+EventExtractor = Callable[[Dict[str, Any], ChatRequest], Optional[StreamChunk]]
+
+
+def _make_answer_extractor(event: str) -> EventExtractor:
+    """chat-messages端点的message/agent_message字符流事件"""
+    def extract(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+        text = data.get("answer", "")
+        task_id = data.get("task_id")
+        metadata = {
+            "event": event,  # 保持原始事件类型
+            "workflow_run_id": None,
+            "task_id": task_id,
+            "from_variable_selector": None,
+            "id": data.get("id"),
+            "created_at": data.get("created_at")
+        }
+        if text:
+            # 直接带上content，转发时无需再复制metadata
+            metadata["content"] = text
+        return StreamChunk(text, request.conversation_id, task_id or data.get("message_id") or "", metadata)
+    return extract
+
 
-class DifyParser:
-    """Dify响应解析器
+def _extract_text_chunk(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """workflow端点的text_chunk字符流事件"""
+    chunk_data = data.get("data") or {}
+    text = chunk_data.get("text", "")
+    task_id = data.get("task_id")
+    metadata = {
+        "event": "text_chunk",
+        "workflow_run_id": data.get("workflow_run_id"),
+        "task_id": task_id,
+        "from_variable_selector": chunk_data.get("from_variable_selector"),
+        # workflow事件没有这些字段
+        "id": None,
+        "created_at": None
+    }
+    if text:
+        metadata["content"] = text
+    return StreamChunk(text, request.conversation_id, task_id or "", metadata)
+
+
+def _extract_agent_thought(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """Agent思考步骤事件"""
+    # 构建思考内容文本
+    thought_text = data.get("thought", "")
+    if not thought_text:
+        thought_text = data.get("observation", "")
     
-    支持以下响应格式：
+    # 添加工具调用信息（如果有的话）
+    tool_info = ""
+    if data.get("tool") and data.get("tool_input"):
+        try:
+            tool_input = data.get("tool_input")
+            if isinstance(tool_input, str):
+                tool_input = json.loads(tool_input)
+            tool_info = f"\n\n[工具调用: {data['tool']}]\n"
+            tool_info += f"参数: {json.dumps(tool_input, ensure_ascii=False, indent=2)}\n"
+        except Exception:
+            # 如果tool_input不是有效的JSON，直接添加
+            tool_info = f"\n\n[工具调用: {data['tool']}]\n"
+            tool_info += f"参数: {data.get('tool_input', '')}\n"
     
-    1. ChatCompletionResponse (blocking mode):
-       - message_id: 消息唯一 ID
-       - mode: App 模式，固定为 chat
-       - answer: 完整回复内容
-       - metadata: 元数据
-       - usage: 模型用量信息
-       - retriever_resources: 引用和归属分段列表
-       - created_at: 消息创建时间戳
+    # 添加文件引用信息（如果有的话）
+    file_info = ""
+    if data.get("message_files") and isinstance(data.get("message_files"), list):
+        file_info = "\n\n[文件引用]:\n"
+        for i, file in enumerate(data["message_files"], 1):
+            file_info += f"{i}. {file}\n"
     
-    2. ChunkChatCompletionResponse (streaming mode):
-       流式块中根据 event 不同，结构也不同：
-       
-       普通聊天事件:
-       - event: message - LLM 返回文本块事件
-       - event: message_end - 消息结束事件
-       - event: tts_message - TTS 音频流事件
-       - event: tts_message_end - TTS 音频流结束事件
-       - event: message_replace - 消息内容替换事件
-       - event: error - 错误事件
-       - event: ping - 心跳事件
-       
-       工作流事件:
-       - event: text_chunk - 工作流文本块事件
-       - event: workflow_started - Workflow开始执行事件
-       - event: workflow_finished - Workflow完成事件
-       - event: node_started - 节点开始执行事件
-       - event: node_finished - 节点执行结束事件
-    """
+    # 添加文件ID信息（如果有的话）
+    file_id_info = ""
+    if data.get("file_id"):
+        file_id_info = f"\n\n[文件ID]: {data['file_id']}\n"
     
-    @staticmethod
-    def parse_blocking_response(data: Dict[str, Any], is_workflow: bool = False) -> ChatResponse:
-        """
-        解析阻塞模式下的响应数据 (ChatCompletionResponse)
-        
-        Args:
-            data (Dict[str, Any]): Dify API返回的blocking模式响应数据
-            is_workflow (bool): 是否为工作流模式
-            
-        Returns:
-            ChatResponse: 解析后的统一响应格式
-            
-        Response format:
-        普通聊天模式:
-        {
-            "message_id": "message_id",
-            "mode": "chat",
-            "answer": "完整回复内容",
-            "metadata": {},
-            "usage": {},
-            "retriever_resources": [],
-            "created_at": 1705395332
+    return StreamChunk(
+        message="",
+        conversation_id=request.conversation_id,
+        message_id=data.get("message_id"),
+        metadata={
+            "event": "agent_thought",
+            "id": data.get("id"),
+            "task_id": data.get("task_id"),
+            "position": data.get("position"),
+            "thought": data.get("thought"),
+            "observation": data.get("observation"),
+            "tool": data.get("tool"),
+            "tool_input": data.get("tool_input"),
+            "created_at": data.get("created_at"),
+            "message_files": data.get("message_files", []),
+            "file_id": data.get("file_id"),
+            "conversation_id": data.get("conversation_id"),
+            "full_thought_content": thought_text + tool_info + file_info + file_id_info  # 完整思考内容
         }
-        
-        工作流模式:
-        {
-            "data": {
-                "id": "workflow_run_id",
-                "workflow_id": "workflow_id",
-                "status": "succeeded",
-                "outputs": {
-                    "output": "回复内容"
-                },
-                "error": "",
-                "elapsed_time": 5.123,
-                "total_tokens": 100,
-                "total_steps": 3,
-                "created_at": 1705395332,
-                "finished_at": 1705395337
-            },
-            "task_id": "task_id",
-            "workflow_run_id": "workflow_run_id"
+    )
+
+
+def _extract_message_file(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """文件事件"""
+    return StreamChunk(
+        message="",
+        conversation_id=request.conversation_id,
+        message_id=data.get("id"),
+        metadata={
+            "event": "message_file",
+            "id": data.get("id"),
+            "type": data.get("type"),
+            "belongs_to": data.get("belongs_to"),
+            "url": data.get("url"),
+            "conversation_id": data.get("conversation_id")
         }
-        """
+    )
+
+
+def _extract_workflow_finished(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """工作流完成事件"""
+    workflow_data = data.get("data", {})
+    outputs = workflow_data.get("outputs", {})
+    message = ""
+    if isinstance(outputs, dict):
+        message = outputs.get("text", "")
+        # 如果没有text字段，尝试其他可能的文本字段
+        if not message:
+            for key, value in outputs.items():
+                if isinstance(value, str):
+                    message = value
+                    break
+    
+    return StreamChunk(
+        message=message,
+        conversation_id=request.conversation_id,
+        message_id=data.get("task_id"),
+        metadata={
+            "event": "workflow_finished",
+            "status": workflow_data.get("status"),
+            "elapsed_time": workflow_data.get("elapsed_time"),
+            "total_tokens": workflow_data.get("total_tokens"),
+            "total_steps": workflow_data.get("total_steps"),
+            "finished_at": workflow_data.get("finished_at"),
+            "error": workflow_data.get("error")
+        }
+    )
+
+
+def _make_workflow_step_extractor(event: str, data_key: str) -> EventExtractor:
+    """workflow_started/node_started/node_finished事件"""
+    def extract(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+        return StreamChunk(
+            message="",
+            conversation_id=request.conversation_id,
+            message_id=data.get("task_id"),
+            metadata={
+                "event": event,
+                "workflow_run_id": data.get("workflow_run_id"),
+                "task_id": data.get("task_id"),
+                data_key: data.get("data")
+            }
+        )
+    return extract
+
+
+def _extract_message_end(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """消息结束事件"""
+    usage = data.get("usage", {})
+    return StreamChunk(
+        message="",
+        conversation_id=request.conversation_id,
+        message_id=data.get("message_id"),
+        metadata={
+            "event": "message_end",
+            "task_id": data.get("task_id"),
+            "message_id": data.get("message_id"),
+            "conversation_id": data.get("conversation_id"),
+            "metadata": data.get("metadata"),
+            "usage": usage,
+            "retriever_resources": data.get("retriever_resources")
+        },
+        total_tokens_estimated=usage.get("total_tokens", 0)  # 将实际token数赋值给估算字段
+    )
+
+
+def _make_tts_extractor(event: str) -> EventExtractor:
+    """tts_message/tts_message_end事件"""
+    def extract(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+        return StreamChunk(
+            message="",
+            conversation_id=request.conversation_id,
+            message_id=data.get("message_id"),
+            metadata={
+                "event": event,
+                "task_id": data.get("task_id"),
+                "message_id": data.get("message_id"),
+                "audio": data.get("audio"),
+                "created_at": data.get("created_at")
+            }
+        )
+    return extract
+
+
+def _extract_message_replace(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """消息内容替换事件"""
+    return StreamChunk(
+        message=data.get("answer", ""),
+        conversation_id=request.conversation_id,
+        message_id=data.get("message_id"),
+        metadata={
+            "event": "message_replace",
+            "task_id": data.get("task_id"),
+            "message_id": data.get("message_id"),
+            "created_at": data.get("created_at")
+        }
+    )
+
+
+def _extract_error(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """错误事件"""
+    return StreamChunk(
+        message="",
+        conversation_id=request.conversation_id,
+        message_id=data.get("message_id"),
+        metadata={
+            "event": "error",
+            "task_id": data.get("task_id"),
+            "message_id": data.get("message_id"),
+            "status": data.get("status"),
+            "code": data.get("code"),
+            "error_message": data.get("message")
+        }
+    )
+
+
+def _extract_ping(data: Dict[str, Any], request: ChatRequest) -> None:
+    """心跳事件，不需要返回内容"""
+    return None
+
+
+def _extract_statistics(data: Dict[str, Any], request: ChatRequest) -> StreamChunk:
+    """workflow相关的statistics事件"""
+    total_tokens = data.get("total_tokens", 0)
+    return StreamChunk(
+        message="",
+        conversation_id=request.conversation_id,
+        message_id=data.get("task_id"),
+        metadata={
+            "event": "statistics",
+            "workflow_run_id": data.get("workflow_run_id"),
+            "task_id": data.get("task_id"),
+            "status": data.get("status"),
+            "elapsed_time": data.get("elapsed_time"),
+            "total_tokens": total_tokens,
+            "total_steps": data.get("total_steps"),
+            "created_at": data.get("created_at"),
+            "finished_at": data.get("finished_at"),
+            "error": data.get("error")
+        },
+        total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
+    )
+
+
+class DifyResponseParser:
+    """Dify响应解析器 - 统一处理流式和非流式响应"""
+    
+    @staticmethod
+    def parse_blocking_response(response_data: Dict[str, Any], is_workflow: bool) -> ChatResponse:
+        """解析非流式响应"""
         if is_workflow:
-            # 工作流模式响应处理
-            workflow_data = data.get("data", {})
-            outputs = workflow_data.get("outputs", {})
+            # 工作流响应处理 - 根据Dify官方API文档结构
+            # 工作流响应结构有两种可能：
+            # 1. 直接包含状态字段: {"workflow_run_id", "task_id", "status", "outputs", "error", "elapsed_time", "total_tokens", "total_steps", "created_at", "finished_at"}
+            # 2. 嵌套在data字段中: {"task_id", "workflow_run_id", "data": {"status", "outputs", "error", "elapsed_time", "total_tokens", "total_steps", "created_at", "finished_at"}}
             
-            # 提取完整的响应结构
+            # 检查是否是嵌套结构
+            if "data" in response_data and isinstance(response_data["data"], dict):
+                # 嵌套结构：从data字段提取实际数据
+                data = response_data["data"]
+                outputs = data.get("outputs", {})
+                workflow_run_id = response_data.get("workflow_run_id")
+                task_id = response_data.get("task_id")
+            else:
+                # 直接结构
+                data = response_data
+                outputs = response_data.get("outputs", {})
+                workflow_run_id = response_data.get("workflow_run_id")
+                task_id = response_data.get("task_id")
             
-            # 提取回复内容
+            # 从outputs字段提取消息内容
             message = ""
             if isinstance(outputs, dict):
-                # 尝试从outputs中提取文本内容
-                message = outputs.get("output", "")
-                # 如果没有output字段，尝试其他可能的文本字段
+                # 优先从outputs.text提取消息
+                message = outputs.get("text", "")
+                # 如果没有text字段，尝试output字段（Dify工作流常用）
+                if not message:
+                    message = outputs.get("output", "")
+                # 如果还没有，尝试其他可能的文本字段
                 if not message:
                     for key, value in outputs.items():
                         if isinstance(value, str) and value.strip():
                             message = value
                             break
+                        elif isinstance(value, dict):
+                            # 检查嵌套字典中的文本字段
+                            nested_text = value.get("text", "")
+                            if nested_text:
+                                message = nested_text
+                                break
             
-            # 提取消息内容和长度
-            
+            total_tokens = data.get("total_tokens", 0)
             return ChatResponse(
                 message=message,
-                conversation_id=data.get("workflow_run_id"),
-                message_id=data.get("task_id"),
+                conversation_id=response_data.get("conversation_id"),
+                message_id=task_id,
                 metadata={
-                    "status": workflow_data.get("status"),
-                    "elapsed_time": workflow_data.get("elapsed_time"),
-                    "total_tokens": workflow_data.get("total_tokens"),
-                    "total_steps": workflow_data.get("total_steps"),
-                    "created_at": workflow_data.get("created_at"),
-                    "finished_at": workflow_data.get("finished_at"),
-                    "error": workflow_data.get("error")
-                }
+                    "workflow_run_id": workflow_run_id,
+                    "task_id": task_id,
+                    "status": data.get("status"),
+                    "elapsed_time": data.get("elapsed_time"),
+                    "total_tokens": total_tokens,
+                    "total_steps": data.get("total_steps"),
+                    "created_at": data.get("created_at"),
+                    "finished_at": data.get("finished_at"),
+                    "error": data.get("error")
+                },
+                total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
             )
         else:
-            # 普通聊天模式响应处理
+            # 聊天接口响应处理
+            usage = response_data.get("usage", {})
+            total_tokens = usage.get("total_tokens", 0)
             return ChatResponse(
-                message=data.get("answer", ""),
-                conversation_id=data.get("conversation_id"),  # 使用API返回的conversation_id
-                message_id=data.get("message_id"),
+                message=response_data.get("answer", ""),
+                conversation_id=response_data.get("conversation_id"),
+                message_id=response_data.get("message_id"),
                 metadata={
-                    "mode": data.get("mode"),
-                    "metadata": data.get("metadata"),
-                    "usage": data.get("usage"),
-                    "retriever_resources": data.get("retriever_resources"),
-                    "created_at": data.get("created_at")
-                }
+                    "task_id": response_data.get("task_id"),
+                    "conversation_id": response_data.get("conversation_id"),
+                    "metadata": response_data.get("metadata"),
+                    "usage": usage,
+                    "retriever_resources": response_data.get("retriever_resources")
+                },
+                total_tokens_estimated=total_tokens  # 将实际token数赋值给估算字段
             )
     
-    @staticmethod
-    def _create_text_chunk_response(data: Dict[str, Any], event: str, message: str, conversation_id_key: str = "conversation_id", metadata: Optional[Dict[str, Any]] = None) -> ChatResponse:
-        """创建文本块响应的辅助方法
-        
-        Args:
-            data (Dict[str, Any]): 原始数据
-            event (str): 事件类型
-            message (str): 消息内容
-            conversation_id_key (str): conversation_id的键名
-            metadata (Dict[str, Any]): 额外的元数据
-        
-        Returns:
-            ChatResponse: 构造的响应对象
-        """
-        base_metadata = {
-            "event": event,
-            "task_id": data.get("task_id")
-        }
-        
-        if metadata:
-            base_metadata.update(metadata)
-        
-        return ChatResponse(
-            message=message,
-            conversation_id=data.get(conversation_id_key),
-            message_id=data.get("message_id") if event == "message" else data.get("task_id"),
-            metadata=base_metadata
-        )
+    # 事件名 -> 提取函数
+    _event_extractors: Dict[str, EventExtractor] = {
+        # 字符流事件（热路径）
+        "message": _make_answer_extractor("message"),
+        "agent_message": _make_answer_extractor("agent_message"),
+        "text_chunk": _extract_text_chunk,
+        # Agent事件
+        "agent_thought": _extract_agent_thought,
+        "message_file": _extract_message_file,
+        # 工作流事件
+        "workflow_started": _make_workflow_step_extractor("workflow_started", "workflow_data"),
+        "node_started": _make_workflow_step_extractor("node_started", "node_data"),
+        "node_finished": _make_workflow_step_extractor("node_finished", "node_data"),
+        "workflow_finished": _extract_workflow_finished,
+        "statistics": _extract_statistics,
+        # 消息相关事件
+        "message_end": _extract_message_end,
+        "tts_message": _make_tts_extractor("tts_message"),
+        "tts_message_end": _make_tts_extractor("tts_message_end"),
+        "message_replace": _extract_message_replace,
+        "error": _extract_error,
+        "ping": _extract_ping
+    }
     
-    @staticmethod
-    async def parse_streaming_response(response_text: str) -> AsyncGenerator[ChatResponse, None]:
-        """解析流式响应数据 (ChunkChatCompletionResponse)
-        
-        Args:
-            response_text (str): Dify API返回的流式响应文本
-            
-        Yields:
-            ChatResponse: 解析后的统一响应格式
-            
-        流式数据格式:
-        data: {"event": "...", ...}
-        
-        支持解析的事件类型:
-        普通聊天事件:
-        1. message: LLM 返回文本块事件
-        2. message_end: 消息结束事件
-        3. tts_message: TTS 音频流事件
-        4. tts_message_end: TTS 音频流结束事件
-        5. message_replace: 消息内容替换事件
-        6. error: 错误事件
-        7. ping: 心跳事件
+    @classmethod
+    def register_event_extractor(cls, event: str, extractor: EventExtractor):
+        """注册（或覆盖）某个流式事件的提取函数"""
+        cls._event_extractors[event] = extractor
+    
+    @classmethod
+    def parse_streaming_event(cls, data: Dict[str, Any], event: str, is_workflow: bool, request: ChatRequest) -> Optional[StreamChunk]:
+        """解析流式事件
         
-        工作流事件:
-        8. text_chunk: 工作流文本块事件
-        9. workflow_started: Workflow开始执行事件
-        10. workflow_finished: Workflow完成事件
-        11. node_started: 节点开始执行事件
-        12. node_finished: 节点执行结束事件
+        注意：workflow和chat-messages端点的事件流结构基本一致，
+        主要区别在于字符流事件名称不同：
+        - workflow端点使用 text_chunk 事件
+        - chat-messages端点使用 message 事件
+        其他事件的处理逻辑一致，按事件名查表分发到对应的提取函数，未知事件返回None。
         """
-        lines = response_text.split('\n\n')
-        
-        for line in lines:
-            if line.startswith("data: "):
-                data_str = line[6:]  # 移除 "data: " 前缀
-                if data_str.strip() == "[DONE]":
-                    break
-                
-                try:
-                    data = json.loads(data_str)
-                    event = data.get("event")
-                    
-                    # 1. 处理 message 事件 - LLM 返回文本块事件
-                    if event == "message":
-                        # 从message事件中提取文本内容
-                        message_content = data.get("answer", "")
-                        workflow_run_id = data.get("conversation_id")
-                        
-                        # 保持message事件不变，不转换为text_chunk
-                        response = DifyParser._create_text_chunk_response(
-                            data,
-                            "message",  # 保持原始事件类型
-                            message_content,
-                            "conversation_id",
-                            {
-                                "workflow_run_id": workflow_run_id,
-                                "text": message_content,
-                                "original_event": "message",
-                                "id": data.get("id"),
-                                "created_at": data.get("created_at")
-                            }
-                        )
-                        
-                        yield response
-                    
-                    # 2. 处理 agent_message 事件 - Agent模式下返回文本块事件
-                    elif event == "agent_message":
-                        # 从agent_message事件中提取文本内容
-                        message_content = data.get("answer", "")
-                        workflow_run_id = data.get("conversation_id")
-                        
-                        response = DifyParser._create_text_chunk_response(
-                            data,
-                            "agent_message",  # 保持原始事件类型
-                            message_content,
-                            "conversation_id",
-                            {
-                                "workflow_run_id": workflow_run_id,
-                                "text": message_content,
-                                "original_event": "agent_message",
-                                "id": data.get("id"),
-                                "created_at": data.get("created_at")
-                            }
-                        )
-                        
-                        yield response
-                    
-                    # 3. 处理 agent_thought 事件 - Agent模式下有关Agent思考步骤的相关内容
-                    elif event == "agent_thought":
-                        # 构造符合agent_thought格式的数据结构
-                        yield ChatResponse(
-                            message="",  # 思考事件消息内容为空，不将思考内容放入message字段
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("message_id"),
-                            metadata={
-                                "event": event,
-                                "id": data.get("id"),
-                                "task_id": data.get("task_id"),
-                                "position": data.get("position"),
-                                "thought": data.get("thought"),
-                                "observation": data.get("observation"),
-                                "tool": data.get("tool"),
-                                "tool_input": data.get("tool_input"),
-                                "created_at": data.get("created_at"),
-                                "message_files": data.get("message_files", []),
-                                "file_id": data.get("file_id"),
-                                "conversation_id": data.get("conversation_id")
-                            }
-                        )
-                    
-                    # 4. 处理 message_file 事件 - 文件事件，表示有新文件需要展示
-                    elif event == "message_file":
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("id"),
-                            metadata={
-                                "event": event,
-                                "id": data.get("id"),
-                                "type": data.get("type"),
-                                "belongs_to": data.get("belongs_to"),
-                                "url": data.get("url"),
-                                "conversation_id": data.get("conversation_id")
-                            }
-                        )
-                    
-                    # 5. 处理 message_end 事件 - 消息结束事件
-                    elif event == "message_end":
-                        # 消息结束事件
-                        yield ChatResponse(
-                            message="",  # 结束事件消息内容为空
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("message_id"),
-                            metadata={
-                                "event": event,
-                                "task_id": data.get("task_id"),
-                                "message_id": data.get("message_id"),
-                                "conversation_id": data.get("conversation_id"),
-                                "metadata": data.get("metadata"),
-                                "usage": data.get("usage"),
-                                "retriever_resources": data.get("retriever_resources")
-                            }
-                        )
-                    
-                    # 6. 处理 tts_message 事件 - TTS 音频流事件
-                    elif event == "tts_message":
-                        # TTS 音频流事件，即语音合成输出
-                        # 内容是Mp3格式的音频块，使用 base64 编码后的字符串
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("message_id"),
-                            metadata={
-                                "event": event,
-                                "task_id": data.get("task_id"),
-                                "message_id": data.get("message_id"),
-                                "audio": data.get("audio"),
-                                "created_at": data.get("created_at")
-                            }
-                        )
-                    
-                    # 7. 处理 tts_message_end 事件 - TTS 音频流结束事件
-                    elif event == "tts_message_end":
-                        # TTS 音频流结束事件，收到这个事件表示音频流返回结束
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("message_id"),
-                            metadata={
-                                "event": event,
-                                "task_id": data.get("task_id"),
-                                "message_id": data.get("message_id"),
-                                "audio": data.get("audio"),  # 结束事件是没有音频的，所以这里是空字符串
-                                "created_at": data.get("created_at")
-                            }
-                        )
-                    
-                    # 8. 处理 message_replace 事件 - 消息内容替换事件
-                    elif event == "message_replace":
-                        # 消息内容替换事件
-                        # 开启内容审查和审查输出内容时，若命中了审查条件，则会通过此事件替换消息内容为预设回复
-                        yield ChatResponse(
-                            message=data.get("answer", ""),
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("message_id"),
-                            metadata={
-                                "event": event,
-                                "task_id": data.get("task_id"),
-                                "message_id": data.get("message_id"),
-                                "created_at": data.get("created_at")
-                            }
-                        )
-                    
-                    # 9. 处理 error 事件 - 错误事件
-                    elif event == "error":
-                        # 流式输出过程中出现的异常会以 stream event 形式输出
-                        # 收到异常事件后即结束
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("conversation_id"),
-                            message_id=data.get("message_id"),
-                            metadata={
-                                "event": event,
-                                "task_id": data.get("task_id"),
-                                "message_id": data.get("message_id"),
-                                "status": data.get("status"),
-                                "code": data.get("code"),
-                                "error_message": data.get("message")
-                            }
-                        )
-                    
-                    # 10. 处理 ping 事件 - 心跳事件
-                    elif event == "ping":
-                        # 每 10s 一次的 ping 事件，保持连接存活
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=None,
-                            message_id=None,
-                            metadata={
-                                "event": event
-                            }
-                        )
-                    
-                    # 11. 处理 text_chunk 事件 - 工作流文本块事件
-                    elif event == "text_chunk":
-                        chunk_data = data.get("data", {})
-                        text = chunk_data.get("text", "")
-                        
-                        response = DifyParser._create_text_chunk_response(
-                            data, 
-                            event, 
-                            text,
-                            "workflow_run_id",
-                            {
-                                "workflow_run_id": data.get("workflow_run_id"),
-                                "text": text,
-                                "from_variable_selector": chunk_data.get("from_variable_selector", [])
-                            }
-                        )
-                        
-                        # 处理text_chunk事件
-                        yield response
-                    
-                    # 12. 处理 workflow_finished 事件 - Workflow完成事件
-                    elif event == "workflow_finished":
-                        # 工作流完成事件
-                        workflow_data = data.get("data", {})
-                        outputs = workflow_data.get("outputs", {})
-                        message = ""
-                        if isinstance(outputs, dict):
-                            message = outputs.get("text", "")
-                            # 如果没有text字段，尝试其他可能的文本字段
-                            if not message:
-                                for key, value in outputs.items():
-                                    if isinstance(value, str):
-                                        message = value
-                                        break
-                        
-                        yield ChatResponse(
-                            message=message,
-                            conversation_id=data.get("workflow_run_id"),
-                            message_id=data.get("task_id"),
-                            metadata={
-                                "event": event,
-                                "status": workflow_data.get("status"),
-                                "elapsed_time": workflow_data.get("elapsed_time"),
-                                "total_tokens": workflow_data.get("total_tokens"),
-                                "total_steps": workflow_data.get("total_steps"),
-                                "finished_at": workflow_data.get("finished_at"),
-                                "error": workflow_data.get("error")
-                            }
-                        )
-                    
-                    # 13. 处理 workflow_started 事件 - Workflow开始执行事件
-                    elif event == "workflow_started":
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("workflow_run_id"),
-                            message_id=data.get("task_id"),
-                            metadata={
-                                "event": event,
-                                "workflow_run_id": data.get("workflow_run_id"),
-                                "task_id": data.get("task_id"),
-                                "workflow_data": data.get("data")
-                            }
-                        )
-                    
-                    # 14. 处理 node_started 事件 - 节点开始执行事件
-                    elif event == "node_started":
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("workflow_run_id"),
-                            message_id=data.get("task_id"),
-                            metadata={
-                                "event": event,
-                                "workflow_run_id": data.get("workflow_run_id"),
-                                "task_id": data.get("task_id"),
-                                "node_data": data.get("data")
-                            }
-                        )
-                    
-                    # 15. 处理 node_finished 事件 - 节点执行结束事件
-                    elif event == "node_finished":
-                        yield ChatResponse(
-                            message="",
-                            conversation_id=data.get("workflow_run_id"),
-                            message_id=data.get("task_id"),
-                            metadata={
-                                "event": event,
-                                "workflow_run_id": data.get("workflow_run_id"),
-                                "task_id": data.get("task_id"),
-                                "node_data": data.get("data")
-                            }
-                        )
-                        
-                except json.JSONDecodeError:
-                    # 忽略无法解析的行
-                    continue
\ No newline at end of file
+        extractor = cls._event_extractors.get(event)
+        if extractor is None:
+            return None
+        return extractor(data, request)
@@ -0,0 +1,189 @@
+from dataclasses import dataclass
+from typing import AsyncGenerator, AsyncIterable, List, Optional
+
+_BOM = b"\xef\xbb\xbf"
+
+
+@dataclass(slots=True)
+class SSEEvent:
+    """一条完整的SSE事件"""
+    data: str
+    event: Optional[str] = None  # 未指定event字段时为None（按规范视为"message"）
+    id: Optional[str] = None
+    retry: Optional[int] = None
+
+
+class SSEDecoder:
+    """增量式SSE字节流解码器
+
+    按照 HTML Living Standard 中 text/event-stream 的分帧规则解析：
+    - 支持 \\r\\n、\\n、\\r 三种换行，且换行可以跨chunk
+    - 以冒号开头的行为注释，直接忽略
+    - 多个 data: 行以 \\n 拼接为一条事件
+    - 空行分发事件；id 字段在事件之间保持（Last-Event-ID语义）
+
+    内部只维护一个可复用的bytearray缓冲区，按事件而不是按行切分，
+    字段值在分发事件时才解码为字符串，不会为每一行分配新的str。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data = bytearray()
+        self._has_data = False
+        self._event: Optional[str] = None
+        self._last_event_id: Optional[str] = None
+        self._retry: Optional[int] = None
+        self._pending_cr = False
+        self._started = False
+        self._head = b""  # 流开头可能被切开的BOM
+
+    @property
+    def last_event_id(self) -> Optional[str]:
+        """最近一次收到的事件ID"""
+        return self._last_event_id
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一段字节，返回该段中完成分帧的事件列表"""
+        if not chunk:
+            return []
+
+        if self._pending_cr or not self._started or b"\r" in chunk:
+            chunk = self._normalize(chunk)
+
+        buf = self._buffer
+        if not buf and chunk.endswith(b"\n\n"):
+            # 缓冲区为空且chunk恰好以空行结束（上游逐事件flush时的常态），无需拷贝进缓冲区
+            block = chunk[:-2]
+        else:
+            buf += chunk
+            # 以最后一个空行为界切出所有完整事件，未完成的部分留在缓冲区继续复用
+            last = buf.rfind(b"\n\n")
+            if last == -1:
+                return []
+            block = buf[:last]
+            del buf[:last + 2]
+
+        if self._event is None and self._retry is None and block.startswith(b"data: "):
+            if b"\n" not in block:
+                # 快速路径：只有一条单行data事件
+                return [SSEEvent(block[6:].decode("utf-8", "replace"), None, self._last_event_id, None)]
+            if block.count(b"\n") == 2 * block.count(b"\n\ndata: "):
+                # 快速路径：块内全部是单行 "data: ..." 事件（上游最常见的形态），
+                # 整块解码一次后直接按分隔符切分，不再逐事件、逐行处理
+                last_event_id = self._last_event_id
+                return [
+                    SSEEvent(data, None, last_event_id, None)
+                    for data in block[6:].decode("utf-8", "replace").split("\n\ndata: ")
+                ]
+
+        events: List[SSEEvent] = []
+        for raw in block.split(b"\n\n"):
+            if raw[:5] == b"data:" and b"\n" not in raw:
+                # 单行data事件，不再逐行处理
+                value = raw[6:] if raw[5:6] == b" " else raw[5:]
+                events.append(SSEEvent(
+                    data=value.decode("utf-8", "replace"),
+                    event=self._event or None,
+                    id=self._last_event_id,
+                    retry=self._retry
+                ))
+                self._event = None
+                self._retry = None
+            else:
+                for line in raw.split(b"\n"):
+                    self._process_line(line, events)
+                self._dispatch(events)
+        return events
+
+    def _normalize(self, chunk: bytes) -> bytes:
+        """去掉BOM并将 \r\n、\r 统一为 \n（处理跨chunk的 \r\n）"""
+        if not self._started:
+            # 去掉流开头的UTF-8 BOM；BOM可能被切到多个chunk中，凑够3个字节再判断
+            head = self._head + chunk
+            if len(head) < len(_BOM) and _BOM.startswith(head):
+                self._head = head
+                return b""
+            self._started = True
+            self._head = b""
+            chunk = head[len(_BOM):] if head.startswith(_BOM) else head
+
+        if self._pending_cr:
+            # 上一个chunk以\r结尾，本chunk开头的\n属于同一个换行
+            self._pending_cr = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+
+        if b"\r" in chunk:
+            self._pending_cr = chunk.endswith(b"\r")
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        return chunk
+
+    def close(self) -> List[SSEEvent]:
+        """流结束时调用
+
+        规范要求丢弃未以空行结束的事件，但部分上游不会发送最后的空行，
+        这里对残留数据做宽松处理，仍然分发出去。
+        """
+        events: List[SSEEvent] = []
+        if self._buffer:
+            for line in self._buffer.split(b"\n"):
+                self._process_line(line, events)
+            self._buffer.clear()
+        self._dispatch(events)
+        return events
+
+    def _process_line(self, line: bytes, events: List[SSEEvent]):
+        """处理一行（不含换行符）"""
+        if not line:
+            self._dispatch(events)
+            return
+
+        if line[:1] == b":":  # 注释行
+            return
+
+        colon = line.find(b":")
+        if colon == -1:
+            field = line
+            value = b""
+        else:
+            field = line[:colon]
+            value = line[colon + 2:] if line[colon + 1:colon + 2] == b" " else line[colon + 1:]
+
+        if field == b"data":
+            if self._has_data:
+                self._data += b"\n"
+            self._data += value
+            self._has_data = True
+        elif field == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif field == b"id":
+            if b"\x00" not in value:
+                self._last_event_id = value.decode("utf-8", "replace")
+        elif field == b"retry":
+            if value.isdigit():
+                self._retry = int(value)
+        # 其他字段按规范忽略
+
+    def _dispatch(self, events: List[SSEEvent]):
+        """空行：分发当前累积的事件并重置状态"""
+        if self._has_data:
+            events.append(SSEEvent(
+                data=self._data.decode("utf-8", "replace"),
+                event=self._event or None,
+                id=self._last_event_id,
+                retry=self._retry
+            ))
+        self._data.clear()
+        self._has_data = False
+        self._event = None
+        self._retry = None
+
+
+async def aiter_sse(byte_stream: AsyncIterable[bytes]) -> AsyncGenerator[SSEEvent, None]:
+    """将异步字节流（如 httpx 的 response.aiter_bytes()）解码为SSE事件"""
+    decoder = SSEDecoder()
+    async for chunk in byte_stream:
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.close():
+        yield event
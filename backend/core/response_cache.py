@@ -0,0 +1,357 @@
+"""
+确定性workflow智能体的响应缓存
+
+很多 type=workflow 的智能体是纯查询：相同的 workflow_inputs 和 query 总是得到相同的输出。
+在 Agent.config 中开启后，先查缓存，命中时不调用 /workflows/run：
+    response_cache      true 开启（只对workflow智能体生效）
+    response_cache_ttl  缓存秒数，默认 RESPONSE_CACHE_TTL
+
+缓存键 = 响应模式 + agent_id + 智能体配置摘要（配置修改后自动失效）+ 规范化的query + workflow_inputs。
+只缓存成功（status为succeeded）的结果：
+    阻塞模式缓存ChatResponse；
+    流式模式缓存流中的事件（连续文本块合并后保存），命中时按原顺序重放为合成的SSE事件。
+命中时消息的 message_metadata 中记录 cache_hit=true，计费可据此区别处理。
+缓存的结果属于最初的请求：命中时对话ID换成本次请求的（没有时保存时新建对话），
+事件和元数据中原来的上游对话ID会被去掉，不会返回给其他用户，也不会被当作本次的上游对话保存。
+
+后端可插拔（RESPONSE_CACHE_BACKEND）：
+    memory  进程内LRU，按字节数（RESPONSE_CACHE_MAX_BYTES）和条目数淘汰
+    sqlite  本地SQLite文件（RESPONSE_CACHE_PATH），同一台机器上的多个进程共享，可作为共享存储的替身
+可通过 ResponseCache.register_backend 注册其他后端（如Redis）。
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+from core import json_codec
+from core.adapter import ChatRequest, ChatResponse, StreamChunk
+from core.config import settings
+from core.metrics import Metrics
+from core.single_flight import single_flight_key
+from core.stream_coalescer import text_event_type
+
+logger = logging.getLogger(__name__)
+
+MODE_BLOCKING = "blocking"
+MODE_STREAMING = "streaming"
+
+# 重放时每个合成文本事件的最大字符数
+REPLAY_TEXT_CHARS = 256
+
+
+class CacheBackend(ABC):
+    """缓存后端接口，值为bytes"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float):
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    async def clear(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """进程内LRU + TTL，按字节数和条目数淘汰"""
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.size_bytes = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._remove(key)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self.size_bytes += len(value)
+        while self._entries and (self.size_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            self._remove(next(iter(self._entries)))
+        Metrics.set("response_cache_bytes", self.size_bytes, backend="memory")
+
+    async def delete(self, key: str):
+        self._remove(key)
+
+    async def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[0])
+
+
+class SqliteCacheBackend(CacheBackend):
+    """本地SQLite文件，多个进程共享；按最近访问时间淘汰到 max_bytes 以内
+
+    sqlite3是同步API，所有操作放到线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_accessed ON response_cache (accessed_at)")
+
+    def _get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now)
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # 按最近访问时间从旧到新删除，直到总大小不超过上限
+                rows = self._conn.execute("SELECT key, size FROM response_cache ORDER BY accessed_at").fetchall()
+                evict = []
+                for old_key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((old_key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM response_cache WHERE key = ?", evict)
+        Metrics.set("response_cache_bytes", total, backend="sqlite")
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._execute, "DELETE FROM response_cache WHERE key = ?", (key,))
+
+    async def clear(self):
+        await asyncio.to_thread(self._execute, "DELETE FROM response_cache")
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def response_succeeded(response: ChatResponse, config: Dict[str, Any]) -> bool:
+    """阻塞响应是否可以缓存：workflow的status为succeeded，其他智能体有回答内容"""
+    if config.get("type", "chat") == "workflow":
+        return (response.metadata or {}).get("status") == "succeeded"
+    return bool(response.message)
+
+
+def stream_succeeded(chunks: List[StreamChunk]) -> bool:
+    """流是否可以缓存：没有error事件、workflow没有失败，并且以message_end或成功的workflow_finished结束"""
+    finished = False
+    for chunk in chunks:
+        metadata = chunk.metadata or {}
+        event = metadata.get("event")
+        if event == "error":
+            return False
+        if event == "workflow_finished":
+            if metadata.get("status") != "succeeded":
+                return False
+            finished = True
+        elif event == "message_end":
+            finished = True
+    return finished
+
+
+def compact_chunks(chunks: List[StreamChunk]) -> List[Dict[str, Any]]:
+    """把流式块转换为可序列化的记录，连续的同类文本块合并为一条"""
+    records: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        event = text_event_type(chunk)
+        last = records[-1] if records else None
+        if event is not None and last is not None and last["text_event"] == event:
+            last["message"] += chunk.message
+            continue
+        records.append({
+            "message": chunk.message,
+            "message_id": chunk.message_id,
+            "metadata": chunk.metadata,
+            "text_event": event
+        })
+    return records
+
+
+def _detach_conversation(metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """去掉缓存内容中原请求的上游对话ID"""
+    if not metadata or "conversation_id" not in metadata:
+        return metadata
+    return {key: value for key, value in metadata.items() if key != "conversation_id"}
+
+
+def cached_response(cached: Dict[str, Any], request: ChatRequest, **marks) -> ChatResponse:
+    """把缓存的阻塞响应还原为本次请求的响应，元数据中加上 cache_hit 和 marks"""
+    response = ChatResponse(**cached)
+    response.conversation_id = request.conversation_id
+    response.metadata = {**(_detach_conversation(response.metadata) or {}), "cache_hit": True, **marks}
+    return response
+
+
+def replay_chunks(records: List[Dict[str, Any]], request: ChatRequest) -> List[StreamChunk]:
+    """把缓存的记录还原为流式块，长文本拆分为多个事件"""
+    chunks = []
+    for record in records:
+        message = record["message"]
+        metadata = _detach_conversation(record["metadata"])
+        if record["text_event"] is None or len(message) <= REPLAY_TEXT_CHARS:
+            pieces = [message]
+        else:
+            pieces = [message[i:i + REPLAY_TEXT_CHARS] for i in range(0, len(message), REPLAY_TEXT_CHARS)]
+        for piece in pieces:
+            chunk_metadata = metadata
+            if record["text_event"] is not None and metadata is not None:
+                chunk_metadata = {**metadata, "content": piece}
+            chunks.append(StreamChunk(piece, request.conversation_id, record["message_id"], chunk_metadata))
+    return chunks
+
+
+class ResponseCache:
+    """进程级响应缓存入口"""
+
+    _backend: Optional[CacheBackend] = None
+    _backends: Dict[str, Callable[[], CacheBackend]] = {
+        "memory": lambda: MemoryCacheBackend(settings.RESPONSE_CACHE_MAX_BYTES, settings.RESPONSE_CACHE_MAX_ENTRIES),
+        "sqlite": lambda: SqliteCacheBackend(settings.RESPONSE_CACHE_PATH, settings.RESPONSE_CACHE_MAX_BYTES),
+    }
+
+    @classmethod
+    def register_backend(cls, name: str, factory: Callable[[], CacheBackend]):
+        """注册新的缓存后端"""
+        cls._backends[name] = factory
+
+    @classmethod
+    def backend(cls) -> CacheBackend:
+        if cls._backend is None:
+            factory = cls._backends.get(settings.RESPONSE_CACHE_BACKEND)
+            if factory is None:
+                raise ValueError(f"Unsupported response cache backend: {settings.RESPONSE_CACHE_BACKEND}")
+            cls._backend = factory()
+        return cls._backend
+
+    @staticmethod
+    def enabled(config: Dict[str, Any]) -> bool:
+        return bool(config.get("response_cache")) and config.get("type", "chat") == "workflow"
+
+    @classmethod
+    def key_for(cls, request: ChatRequest, config: Dict[str, Any], mode: str) -> Optional[str]:
+        """缓存键，智能体未开启缓存时返回None"""
+        if not cls.enabled(config):
+            return None
+        return f"{mode}:{single_flight_key(request, config)}"
+
+    @staticmethod
+    def _ttl(config: Dict[str, Any]) -> float:
+        try:
+            return float(config.get("response_cache_ttl") or settings.RESPONSE_CACHE_TTL)
+        except (TypeError, ValueError):
+            return float(settings.RESPONSE_CACHE_TTL)
+
+    @classmethod
+    async def _get(cls, key: str, agent_id: int) -> Optional[Any]:
+        try:
+            value = await cls.backend().get(key)
+        except Exception as e:
+            # 缓存不可用时照常调用上游
+            logger.warning(f"Response cache get failed: {e}")
+            value = None
+        Metrics.incr("response_cache_hits_total" if value is not None else "response_cache_misses_total", agent_id=agent_id)
+        return None if value is None else json_codec.loads(value)
+
+    @classmethod
+    async def _set(cls, key: str, value: Any, config: Dict[str, Any], agent_id: int):
+        try:
+            await cls.backend().set(key, json_codec.dumps(value), cls._ttl(config))
+            Metrics.incr("response_cache_stores_total", agent_id=agent_id)
+        except Exception as e:
+            logger.warning(f"Response cache set failed: {e}")
+
+    @classmethod
+    async def get_response(cls, key: str, request: ChatRequest) -> Optional[ChatResponse]:
+        """阻塞模式：命中时返回带 cache_hit 标记的响应"""
+        cached = await cls._get(key, request.agent_id)
+        return None if cached is None else cached_response(cached, request)
+
+    @classmethod
+    async def put_response(cls, key: str, response: ChatResponse, request: ChatRequest, config: Dict[str, Any]):
+        """阻塞模式：只缓存成功的workflow结果"""
+        if not response_succeeded(response, config):
+            return
+        await cls._set(key, response.dict(exclude={"conversation_id", "estimated_cost"}), config, request.agent_id)
+
+    @classmethod
+    async def get_stream(cls, key: str, request: ChatRequest) -> Optional[List[StreamChunk]]:
+        """流式模式：命中时返回重放用的流式块"""
+        cached = await cls._get(key, request.agent_id)
+        return None if cached is None else replay_chunks(cached, request)
+
+    @classmethod
+    async def put_stream(cls, key: str, chunks: List[StreamChunk], request: ChatRequest, config: Dict[str, Any]):
+        """流式模式：只缓存成功完成的流"""
+        if not stream_succeeded(chunks):
+            return
+        await cls._set(key, compact_chunks(chunks), config, request.agent_id)
+
+    @staticmethod
+    async def replay(chunks: List[StreamChunk]) -> AsyncGenerator[StreamChunk, None]:
+        """按顺序输出缓存的流式块（替代上游流）"""
+        for chunk in chunks:
+            yield chunk
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._backend is not None:
+            await cls._backend.close()
+            cls._backend = None
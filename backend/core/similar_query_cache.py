@@ -0,0 +1,280 @@
+"""
+近似问题缓存（按智能体）
+
+商户的很多问题只是换了标点、空格或语气词（"怎么退货？" / "怎么退货呢"），精确缓存无法命中。
+在 Agent.config 中开启后，用MinHash估计新问题与最近已回答问题的相似度，超过阈值时直接返回之前的回答：
+    similar_query_cache      true 开启（chat和workflow智能体都可用）
+    similar_query_threshold  相似度阈值（0~1），默认 SIMILAR_QUERY_THRESHOLD
+    similar_query_ttl        回答的缓存秒数，默认 SIMILAR_QUERY_TTL
+
+指纹：规范化query（NFKC、小写、去掉空白、标点和语气词）后取字符n-gram（SIMILAR_QUERY_NGRAM），
+用 NUM_PERMUTATIONS 个哈希函数计算MinHash签名（uint32数组）。两个签名相同位置相等的比例即Jaccard相似度的估计。
+每个智能体的签名存放在一个NumPy矩阵中，查找时一次向量化比较所有条目，不依赖向量模型或外部服务。
+问题中的数字（订单号、金额等）必须完全一致才算命中，避免"订单123"命中"订单124"的回答。
+
+只在相同的响应模式、智能体配置和workflow_inputs下匹配，只缓存成功的回答（同core/response_cache.py）；
+命中时消息的 message_metadata 中记录 cache_hit=true 和 similarity；
+缓存的回答与原来的对话解绑（去掉原请求的上游对话ID），保存到本次请求自己的对话中。
+每个智能体最多保留 SIMILAR_QUERY_MAX_ENTRIES 条、回答合计不超过 SIMILAR_QUERY_MAX_BYTES 字节，超出时淘汰最久未使用的条目。
+
+NumPy为可选依赖，未安装时不启用本缓存。
+"""
+
+import logging
+import re
+import time
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from core import json_codec
+from core.adapter import ChatRequest, ChatResponse, StreamChunk
+from core.config import settings
+from core.metrics import Metrics
+from core.response_cache import cached_response, compact_chunks, replay_chunks, response_succeeded, stream_succeeded
+from core.single_flight import config_fingerprint, normalize_query
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 取决于运行环境
+    np = None
+
+# MinHash签名长度，估计误差约为 1/sqrt(NUM_PERMUTATIONS)
+NUM_PERMUTATIONS = 64
+# 哈希函数 (a * x + b) mod p 的模数（梅森素数2^31-1，a * x 不会超出uint64）
+_PRIME = (1 << 31) - 1
+# 规范化时去掉的语气词
+_PARTICLES = frozenset("吗呢吧啊呀哦嘛啦哈呗")
+_NUMBERS = re.compile(r"\d+")
+
+if np is not None:
+    _rng = np.random.RandomState(20240601)
+    _PERM_A = _rng.randint(1, _PRIME, size=(NUM_PERMUTATIONS, 1)).astype(np.uint64)
+    _PERM_B = _rng.randint(0, _PRIME, size=(NUM_PERMUTATIONS, 1)).astype(np.uint64)
+
+
+def fingerprint_text(query: str) -> str:
+    """用于指纹的文本：在normalize_query基础上转小写，去掉空白、标点、符号和语气词"""
+    return "".join(
+        char for char in normalize_query(query).casefold()
+        if not char.isspace() and unicodedata.category(char)[0] not in "PSZ" and char not in _PARTICLES
+    )
+
+
+def minhash(text: str, ngram: int) -> "np.ndarray":
+    """字符n-gram的MinHash签名（长度NUM_PERMUTATIONS的uint32数组），文本比n短时整体作为一个n-gram"""
+    shingles = {text[i:i + ngram] for i in range(max(len(text) - ngram + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((_PERM_A * hashes + _PERM_B) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def fingerprint(query: str) -> Optional[Tuple["np.ndarray", Tuple[str, ...]]]:
+    """问题的 (MinHash签名, 其中的数字)，去掉标点和语气词后为空时返回None"""
+    text = fingerprint_text(query)
+    if not text:
+        return None
+    return minhash(text, max(settings.SIMILAR_QUERY_NGRAM, 1)), tuple(_NUMBERS.findall(text))
+
+
+class SimilarIndex:
+    """一个智能体的近似问题索引
+
+    签名、作用域、过期时间和最近使用时间存放在按槽位对齐的NumPy数组中（容量按需倍增到max_entries），
+    回答（序列化后的bytes）存放在同一槽位的列表中。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max(max_entries, 1)
+        self.max_bytes = max_bytes
+        capacity = min(16, self.max_entries)
+        self.signatures = np.zeros((capacity, NUM_PERMUTATIONS), dtype=np.uint32)
+        self.scopes = np.full(capacity, -1, dtype=np.int32)  # -1表示空槽位
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.numbers: List[Optional[Tuple[str, ...]]] = [None] * capacity
+        self.payloads: List[Optional[bytes]] = [None] * capacity
+        # 作用域（响应模式 + 配置摘要 + workflow_inputs）映射为小整数，便于向量化过滤
+        self._scope_ids: Dict[str, int] = {}
+        self.entries = 0
+        self.size_bytes = 0
+
+    def _scope_id(self, scope: str) -> int:
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            scope_id = self._scope_ids[scope] = len(self._scope_ids)
+        return scope_id
+
+    def lookup(self, scope: str, signature: "np.ndarray", numbers: Tuple[str, ...],
+               threshold: float) -> Optional[Tuple[bytes, float]]:
+        """返回 (回答, 相似度)，没有超过阈值的条目时返回None"""
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None or not self.entries:
+            return None
+        now = time.monotonic()
+        matches = (self.signatures == signature).sum(axis=1, dtype=np.int32)
+        matches[(self.scopes != scope_id) | (self.expires <= now)] = -1
+        # 按相似度从高到低检查，跳过数字不一致的条目
+        candidates = np.flatnonzero(matches >= threshold * NUM_PERMUTATIONS)
+        for slot in candidates[np.argsort(-matches[candidates], kind="stable")]:
+            if self.numbers[slot] == numbers:
+                self.last_used[slot] = now
+                return self.payloads[slot], int(matches[slot]) / NUM_PERMUTATIONS
+        return None
+
+    def add(self, scope: str, signature: "np.ndarray", numbers: Tuple[str, ...], payload: bytes, ttl: float) -> int:
+        """加入一条回答，返回因超出上限被淘汰的条目数"""
+        if len(payload) > self.max_bytes:
+            return 0
+        now = time.monotonic()
+        evicted = 0
+        # 先清理过期条目，再按最久未使用淘汰到条目数和字节数都有余量
+        for slot in np.flatnonzero((self.scopes >= 0) & (self.expires <= now)):
+            self._remove(slot)
+        while self.entries and (self.entries >= self.max_entries or self.size_bytes + len(payload) > self.max_bytes):
+            occupied = np.flatnonzero(self.scopes >= 0)
+            self._remove(occupied[np.argmin(self.last_used[occupied])])
+            evicted += 1
+
+        free = np.flatnonzero(self.scopes < 0)
+        if not len(free):
+            self._grow()
+            free = np.flatnonzero(self.scopes < 0)
+        slot = free[0]
+        self.signatures[slot] = signature
+        self.scopes[slot] = self._scope_id(scope)
+        self.expires[slot] = now + ttl
+        self.last_used[slot] = now
+        self.numbers[slot] = numbers
+        self.payloads[slot] = payload
+        self.entries += 1
+        self.size_bytes += len(payload)
+        return evicted
+
+    def _remove(self, slot: int):
+        self.scopes[slot] = -1
+        self.size_bytes -= len(self.payloads[slot] or b"")
+        self.numbers[slot] = None
+        self.payloads[slot] = None
+        self.entries -= 1
+
+    def _grow(self):
+        capacity = len(self.scopes)
+        extra = min(capacity, self.max_entries - capacity)
+        self.signatures = np.concatenate([self.signatures, np.zeros((extra, NUM_PERMUTATIONS), dtype=np.uint32)])
+        self.scopes = np.concatenate([self.scopes, np.full(extra, -1, dtype=np.int32)])
+        self.expires = np.concatenate([self.expires, np.zeros(extra, dtype=np.float64)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(extra, dtype=np.float64)])
+        self.numbers.extend([None] * extra)
+        self.payloads.extend([None] * extra)
+
+    def memory_bytes(self) -> int:
+        """签名矩阵和回答占用的大致字节数"""
+        return self.signatures.nbytes + self.scopes.nbytes + self.expires.nbytes + self.last_used.nbytes + self.size_bytes
+
+
+class SimilarQueryCache:
+    """进程内近似问题缓存，按智能体分别建立索引"""
+
+    _indexes: Dict[int, SimilarIndex] = {}
+    _warned = False
+
+    @classmethod
+    def enabled(cls, config: Dict[str, Any]) -> bool:
+        if not config.get("similar_query_cache"):
+            return False
+        if np is None:
+            if not cls._warned:
+                logger.warning("similar_query_cache is enabled but numpy is not installed, cache disabled")
+                cls._warned = True
+            return False
+        return True
+
+    @staticmethod
+    def _scope(config: Dict[str, Any], mode: str) -> str:
+        # 配置摘要已包含workflow_inputs
+        return f"{mode}:{config_fingerprint(config)}"
+
+    @staticmethod
+    def _threshold(config: Dict[str, Any]) -> float:
+        try:
+            return float(config.get("similar_query_threshold") or settings.SIMILAR_QUERY_THRESHOLD)
+        except (TypeError, ValueError):
+            return settings.SIMILAR_QUERY_THRESHOLD
+
+    @staticmethod
+    def _ttl(config: Dict[str, Any]) -> float:
+        try:
+            return float(config.get("similar_query_ttl") or settings.SIMILAR_QUERY_TTL)
+        except (TypeError, ValueError):
+            return float(settings.SIMILAR_QUERY_TTL)
+
+    @classmethod
+    def _index(cls, agent_id: int) -> SimilarIndex:
+        index = cls._indexes.get(agent_id)
+        if index is None:
+            index = cls._indexes[agent_id] = SimilarIndex(settings.SIMILAR_QUERY_MAX_ENTRIES, settings.SIMILAR_QUERY_MAX_BYTES)
+        return index
+
+    @classmethod
+    def _lookup(cls, request: ChatRequest, config: Dict[str, Any], mode: str) -> Optional[Tuple[Any, float]]:
+        query = fingerprint(request.get_query_text() or "")
+        index = cls._indexes.get(request.agent_id)
+        found = None
+        if query is not None and index is not None:
+            found = index.lookup(cls._scope(config, mode), *query, cls._threshold(config))
+        hit = found is not None
+        Metrics.incr("similar_query_cache_hits_total" if hit else "similar_query_cache_misses_total", agent_id=request.agent_id)
+        Metrics.ewma("similar_query_cache_hit_rate", 1.0 if hit else 0.0, alpha=0.05, agent_id=request.agent_id)
+        if not hit:
+            return None
+        payload, similarity = found
+        return json_codec.loads(payload), round(similarity, 4)
+
+    @classmethod
+    def _store(cls, request: ChatRequest, config: Dict[str, Any], mode: str, value: Any):
+        query = fingerprint(request.get_query_text() or "")
+        if query is None:
+            return
+        index = cls._index(request.agent_id)
+        evicted = index.add(cls._scope(config, mode), *query, json_codec.dumps(value), cls._ttl(config))
+        Metrics.incr("similar_query_cache_stores_total", agent_id=request.agent_id)
+        if evicted:
+            Metrics.incr("similar_query_cache_evictions_total", evicted, agent_id=request.agent_id)
+        Metrics.set("similar_query_cache_entries", index.entries, agent_id=request.agent_id)
+        Metrics.set("similar_query_cache_bytes", index.memory_bytes(), agent_id=request.agent_id)
+
+    @classmethod
+    def get_response(cls, request: ChatRequest, config: Dict[str, Any], mode: str) -> Optional[ChatResponse]:
+        """阻塞模式：命中时返回带 cache_hit 和 similarity 标记的响应"""
+        found = cls._lookup(request, config, mode)
+        if found is None:
+            return None
+        cached, similarity = found
+        return cached_response(cached, request, similarity=similarity)
+
+    @classmethod
+    def put_response(cls, request: ChatRequest, config: Dict[str, Any], mode: str, response: ChatResponse):
+        if response_succeeded(response, config):
+            cls._store(request, config, mode, response.dict(exclude={"conversation_id", "estimated_cost"}))
+
+    @classmethod
+    def get_stream(cls, request: ChatRequest, config: Dict[str, Any], mode: str) -> Optional[Tuple[List[StreamChunk], float]]:
+        """流式模式：命中时返回 (重放用的流式块, 相似度)"""
+        found = cls._lookup(request, config, mode)
+        if found is None:
+            return None
+        cached, similarity = found
+        return replay_chunks(cached, request), similarity
+
+    @classmethod
+    def put_stream(cls, request: ChatRequest, config: Dict[str, Any], mode: str, chunks: List[StreamChunk]):
+        if stream_succeeded(chunks):
+            cls._store(request, config, mode, compact_chunks(chunks))
+
+    @classmethod
+    def clear(cls, agent_id: Optional[int] = None):
+        if agent_id is None:
+            cls._indexes.clear()
+        else:
+            cls._indexes.pop(agent_id, None)
@@ -0,0 +1,88 @@
+"""
+相同阻塞请求的合并（single-flight）
+
+同一时刻多个完全相同的阻塞请求（同一智能体、同一配置、规范化后相同的query和workflow_inputs）
+只调用一次上游，所有等待者共享结果；每个等待者拿到结果的副本，仍各自保存对话和消息记录。
+上游对话只属于发起调用的请求：其他等待者的副本去掉conversation_id，各自使用自己的（或新建的）对话，
+不会写入同一个对话。
+按智能体在 Agent.config 中设置 single_flight=true 开启，只合并进行中的请求，不缓存已完成的结果。
+
+上游调用在独立任务中执行：某个等待者（包括第一个发起者）断开时不会取消其他人共享的调用。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Optional
+from core.adapter import ChatRequest, ChatResponse
+from core.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """规范化query：统一全角/半角（NFKC），合并连续空白并去掉首尾空白"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+
+
+def _digest(obj: Any) -> str:
+    """键排序后序列化再取摘要，字典顺序不同的相同内容得到同一结果"""
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """智能体配置的摘要，配置变化后不会与旧请求合并"""
+    return _digest(config)
+
+
+def single_flight_key(request: ChatRequest, config: Dict[str, Any]) -> str:
+    """合并键：agent_id + 配置摘要 + 规范化query + workflow_inputs"""
+    parts = {
+        "agent_id": request.agent_id,
+        "config": config_fingerprint(config),
+        "query": normalize_query(request.get_query_text() or ""),
+        "workflow_inputs": config.get("workflow_inputs") or {}
+    }
+    return _digest(parts)
+
+
+class SingleFlight:
+    """进程内进行中的阻塞调用，按合并键索引"""
+
+    _calls: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    async def do(cls, key: str, call: Callable[[], Awaitable[ChatResponse]],
+                 agent_id: Optional[int] = None) -> ChatResponse:
+        """执行call，已有相同键的调用在进行中时等待它的结果（返回副本）"""
+        task = cls._calls.get(key)
+        leader = task is None or task.done()
+        if leader:
+            task = asyncio.ensure_future(call())
+            cls._calls[key] = task
+            task.add_done_callback(lambda done: cls._finished(key, done))
+        else:
+            Metrics.incr("single_flight_coalesced_total", agent_id=agent_id)
+        # shield：当前等待者被取消时不取消共享的调用
+        response = await asyncio.shield(task)
+        response = response.copy(deep=True)
+        if not leader:
+            response.conversation_id = None
+        return response
+
+    @classmethod
+    def _finished(cls, key: str, task: asyncio.Task):
+        if cls._calls.get(key) is task:
+            del cls._calls[key]
+        # 所有等待者都已断开时，取走异常避免"exception was never retrieved"警告
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Single-flight call {key[:12]} failed: {task.exception()}")
+
+    @classmethod
+    def in_flight(cls) -> int:
+        return len(cls._calls)
@@ -0,0 +1,199 @@
+from typing import Any, Dict, List, Optional
+from core import json_codec
+from core.adapter import ChatRequest
+
+# 字符流事件类型
+TEXT_EVENT_TYPES = frozenset({'text_chunk', 'message', 'agent_message'})
+
+# 每百万token的价格（元）
+PRICE_PER_MILLION_TOKENS = 12
+
+
+def is_workflow_event(event_type: str) -> bool:
+    """工作流相关事件（不包括agent_thought）"""
+    return "workflow" in event_type or "node" in event_type or event_type in ("message_end", "message_file")
+
+
+class StreamAccumulator:
+    """流式聊天结果累加器
+
+    每个事件只分类一次，增量累积消息内容、思考事件（按工具调用合并）、工作流事件、
+    其他事件以及转发统计，流结束后据此一次性保存并生成统计事件。
+    """
+
+    def __init__(self, request: ChatRequest):
+        self.request = request
+        self.full_message = ""
+        self.workflow_events: List[Dict[str, Any]] = []
+        self.other_events: List[Dict[str, Any]] = []
+        # 思考事件：非工具调用的按顺序保存，工具调用按 工具名+输入 合并
+        self._plain_reasoning_events: List[Dict[str, Any]] = []
+        self._tool_calls: Dict[str, Dict[str, Any]] = {}
+        self.message_id: Optional[str] = None
+        # 上游流是否正常读完（只有读完的流才落库）
+        self.finished = False
+        # 客户端断开导致提前结束（保存部分回答并标记）
+        self.interrupted = False
+        # 上游任务ID，用于通知Dify停止生成
+        self.task_id: Optional[str] = None
+        # 上游（Dify）对话ID，取自message_end等事件，用于后续轮次续用上游对话
+        self.upstream_conversation_id: Optional[str] = None
+        # 由响应缓存重放（未调用上游）
+        self.cache_hit = False
+        # 由近似问题缓存重放时的相似度
+        self.cache_similarity: Optional[float] = None
+
+        # 转发统计
+        self.event_count = 0
+        self.event_types: Dict[str, int] = {}
+        self.total_message_length = 0
+        self.total_data_length = 0
+        self.total_sse_length = 0
+        self.dify_tokens = 0
+        self._dify_tokens_found = False
+
+    def add(self, chunk) -> Optional[str]:
+        """累积一个流式块，返回其事件类型（没有事件类型时返回None）"""
+        self.event_count += 1
+
+        # 收集消息内容
+        if chunk.message:
+            self.full_message += chunk.message
+
+        # 保存消息ID（优先保留第一个非None的值）
+        if chunk.message_id and self.message_id is None:
+            self.message_id = chunk.message_id
+
+        metadata = chunk.metadata
+        if self.task_id is None and metadata and metadata.get("task_id"):
+            self.task_id = metadata["task_id"]
+        event_type = metadata.get("event") if metadata else None
+        if not event_type:
+            if chunk.message:
+                # 非Dify原生事件的普通消息，按message事件统计
+                self.total_message_length += len(chunk.message)
+            return None
+
+        self.event_types[event_type] = self.event_types.get(event_type, 0) + 1
+        if event_type not in TEXT_EVENT_TYPES and metadata.get("conversation_id"):
+            self.upstream_conversation_id = metadata["conversation_id"]
+
+        if event_type in TEXT_EVENT_TYPES:
+            if chunk.message:
+                self.total_message_length += len(chunk.message)
+        elif event_type == "agent_thought":
+            self._add_reasoning_event(metadata)
+        elif is_workflow_event(event_type):
+            self.workflow_events.append(metadata)
+            if not self._dify_tokens_found:
+                self._collect_dify_tokens(event_type, metadata)
+        # 只收集非回复类的其他事件（避免将agent_message、text_chunk等保存到other_events中）
+        elif not event_type.startswith(('message', 'text', 'chunk')):
+            self.other_events.append(metadata)
+
+        return event_type
+
+    def _add_reasoning_event(self, event: Dict[str, Any]):
+        """保存agent_thought事件，相同工具调用的多个事件合并为一个"""
+        tool_name = event.get('tool') or event.get('tool_name') or event.get('name') or event.get('toll')
+        if not tool_name:
+            # 非工具调用事件直接添加
+            self._plain_reasoning_events.append(event)
+            return
+
+        tool_input = event.get('tool_input') or event.get('input') or ''
+        # 使用工具名和输入作为唯一键
+        tool_key = f"{tool_name}_{str(tool_input)}"
+        existing = self._tool_calls.get(tool_key)
+        if existing is None:
+            self._tool_calls[tool_key] = event
+        elif event.get('observation') and not existing.get('observation'):
+            # 优先保留observation数据
+            existing['observation'] = event['observation']
+
+    def _collect_dify_tokens(self, event_type: str, metadata: Dict[str, Any]):
+        """取第一个带用量信息的message_end/workflow_finished事件中的token数"""
+        if event_type == "message_end" and metadata.get("usage"):
+            self.dify_tokens = metadata["usage"].get("total_tokens", 0)
+            self._dify_tokens_found = True
+        elif event_type == "workflow_finished" and metadata.get("total_tokens"):
+            self.dify_tokens = metadata.get("total_tokens", 0)
+            self._dify_tokens_found = True
+
+    def record_frame(self, data_length: int, sse_length: int):
+        """记录一次转发给客户端的数据长度"""
+        self.total_data_length += data_length
+        self.total_sse_length += sse_length
+
+    @property
+    def message_metadata(self) -> Optional[Dict[str, Any]]:
+        """保存到AI消息message_metadata的标记（中断、缓存命中），没有时为None"""
+        metadata: Dict[str, Any] = {}
+        if self.interrupted:
+            metadata.update(interrupted=True, task_id=self.task_id)
+        if self.cache_hit:
+            metadata["cache_hit"] = True
+        if self.cache_similarity is not None:
+            metadata["similarity"] = self.cache_similarity
+        return metadata or None
+
+    @property
+    def reasoning_events(self) -> List[Dict[str, Any]]:
+        """合并后的思考事件：普通思考在前，工具调用在后"""
+        return self._plain_reasoning_events + list(self._tool_calls.values())
+
+    @property
+    def total_transfer_data(self) -> int:
+        """总传输数据量 = 完整SSE数据总长度 + 消息内容长度"""
+        return self.total_sse_length + self.total_message_length
+
+    @property
+    def total_tokens_estimated(self) -> int:
+        """估算的总token数（按4个字符=1个token）
+
+        有转发统计时基于网络传输数据量计算（与返回给前端的统计一致），
+        否则基于消息内容和工作流事件计算。
+        """
+        if self.total_sse_length:
+            return max(1, self.total_transfer_data // 4)
+
+        content_tokens = max(1, len(self.full_message) // 4)
+        workflow_tokens = 0
+        if self.workflow_events:
+            try:
+                workflow_tokens = max(1, len(json_codec.dumps(self.workflow_events)) // 4)
+            except Exception:
+                workflow_tokens = 1
+        return content_tokens + workflow_tokens
+
+    @property
+    def cost(self) -> float:
+        """费用：按每百万token 12元"""
+        total_tokens = self.total_tokens_estimated
+        return (total_tokens / 1000000) * PRICE_PER_MILLION_TOKENS if total_tokens > 0 else 0.0
+
+    def statistics(self) -> Dict[str, Any]:
+        """生成发送给客户端的statistics事件"""
+        # 计算聊天接口的token：输入query长度 + 输出消息长度（按4字符=1token估算）
+        input_query = self.request.get_query_text() or ""
+        input_tokens = max(1, len(input_query) // 4)
+        output_tokens = max(1, self.total_message_length // 4)
+        total_tokens_estimated = self.total_tokens_estimated
+        cost = self.cost
+        return {
+            "event": "statistics",
+            "event_count": self.event_count,
+            "event_types": self.event_types,
+            "total_message_length": self.total_message_length,
+            "total_data_length": self.total_data_length,
+            "total_sse_length": self.total_sse_length,
+            "total_transfer_data": self.total_transfer_data,
+            "dify_tokens": self.dify_tokens,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            # 总token数 = Dify API token + 聊天接口token
+            "total_tokens": self.dify_tokens + input_tokens + output_tokens,
+            "total_tokens_estimated": total_tokens_estimated,
+            "total_cost": cost,
+            "estimated_cost": cost
+        }
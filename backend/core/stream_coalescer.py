@@ -0,0 +1,130 @@
+"""
+流式文本块合并
+
+上游通常每个token（或几个token）发送一个事件，逐个转发会产生大量SSE帧。
+启用后，把同一类型的连续文本事件（message/agent_message/text_chunk）在一个时间窗口内
+或达到字节预算前合并为一帧；遇到非文本事件时先把已合并的文本发出，再原样转发该事件。
+
+按智能体在 Agent.config 中配置：
+    stream_coalesce_ms     合并窗口（毫秒），大于0时启用，建议15~50
+    stream_coalesce_bytes  单帧文本的字节预算，默认4096
+"""
+
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+from core.adapter.base import StreamChunk
+from core.stream_accumulator import TEXT_EVENT_TYPES
+
+DEFAULT_MAX_BYTES = 4096
+
+
+def text_event_type(chunk: StreamChunk) -> Optional[str]:
+    """可合并的文本事件返回事件类型，否则返回None"""
+    if not chunk.message or not chunk.metadata:
+        return None
+    event = chunk.metadata.get("event")
+    return event if event in TEXT_EVENT_TYPES else None
+
+
+def merge_text_chunks(chunks: List[StreamChunk]) -> StreamChunk:
+    """合并为一个块，元数据沿用第一个块"""
+    first = chunks[0]
+    if len(chunks) == 1:
+        return first
+    text = "".join(chunk.message for chunk in chunks)
+    return StreamChunk(
+        message=text,
+        conversation_id=first.conversation_id,
+        message_id=first.message_id,
+        metadata={**first.metadata, "content": text}
+    )
+
+
+class TextChunkCoalescer:
+    """按时间窗口/字节预算合并连续的文本块"""
+
+    def __init__(self, window: float, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.window = window
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_agent_config(cls, config: Dict[str, Any]) -> Optional["TextChunkCoalescer"]:
+        """根据智能体配置创建，未启用时返回None"""
+        try:
+            window_ms = float(config.get("stream_coalesce_ms") or 0)
+            max_bytes = int(config.get("stream_coalesce_bytes") or DEFAULT_MAX_BYTES)
+        except (TypeError, ValueError):
+            return None
+        if window_ms <= 0:
+            return None
+        return cls(window_ms / 1000, max_bytes)
+
+    async def coalesce(self, chunks: AsyncIterator[StreamChunk]) -> AsyncGenerator[StreamChunk, None]:
+        """合并流式块
+
+        等待上游时不能用wait_for直接超时（会取消并破坏上游生成器），
+        所以把“取下一个块”放在单独的任务中，窗口到期时先发出已合并的文本，再继续等待同一个任务。
+        """
+        loop = asyncio.get_running_loop()
+        iterator = chunks.__aiter__()
+        buffer: List[StreamChunk] = []
+        buffer_event: Optional[str] = None
+        buffer_bytes = 0
+        deadline = 0.0
+        next_task: Optional[asyncio.Future] = None
+
+        try:
+            while True:
+                if next_task is None:
+                    next_task = asyncio.ensure_future(iterator.__anext__())
+                if buffer:
+                    timeout = deadline - loop.time()
+                    if timeout > 0:
+                        await asyncio.wait((next_task,), timeout=timeout)
+                    if not next_task.done():
+                        # 窗口到期，先发出已合并的文本
+                        yield merge_text_chunks(buffer)
+                        buffer, buffer_event, buffer_bytes = [], None, 0
+                        continue
+                else:
+                    await asyncio.wait((next_task,))
+
+                try:
+                    chunk = next_task.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_task = None
+
+                event = text_event_type(chunk)
+                if buffer and event != buffer_event:
+                    # 事件类型变化或遇到非文本事件，立即发出已合并的文本
+                    yield merge_text_chunks(buffer)
+                    buffer, buffer_event, buffer_bytes = [], None, 0
+
+                if event is None:
+                    yield chunk
+                    continue
+
+                if not buffer:
+                    buffer_event = event
+                    deadline = loop.time() + self.window
+                buffer.append(chunk)
+                buffer_bytes += len(chunk.message.encode("utf-8"))
+                if buffer_bytes >= self.max_bytes:
+                    yield merge_text_chunks(buffer)
+                    buffer, buffer_event, buffer_bytes = [], None, 0
+
+            if buffer:
+                yield merge_text_chunks(buffer)
+        finally:
+            if next_task is not None and not next_task.done():
+                next_task.cancel()
+                try:
+                    await next_task
+                except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                    pass
+            # 下游提前结束时同时关闭上游生成器
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
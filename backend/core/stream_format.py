@@ -0,0 +1,103 @@
+"""
+流式响应的传输格式
+
+verbose（默认）：每个事件都发送完整的Dify元数据，与Dify原生格式兼容。
+compact：文本事件（message/agent_message/text_chunk）只发送增量文本。
+    元数据（task_id、message_id、created_at等）首次出现时通过header事件发送一次并分配短key，
+    之后的文本帧只引用key：
+        data: {"event":"stream_header","k":1,"meta":{"event":"message","task_id":"...",...}}
+        data: {"k":1,"d":"你好"}
+    非文本事件、统计事件和结束标记与verbose格式相同。
+
+通过请求头 X-Stream-Format 或查询参数 stream_format 选择，查询参数优先。
+
+两种格式都通过 SseFrameEncoder 输出：每个事件只序列化一次，直接得到bytes，
+统计的数据长度和SSE长度都是实际发送的字节数。
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from core import json_codec
+
+STREAM_FORMAT_VERBOSE = "verbose"
+STREAM_FORMAT_COMPACT = "compact"
+STREAM_FORMATS = (STREAM_FORMAT_VERBOSE, STREAM_FORMAT_COMPACT)
+
+
+def negotiate_stream_format(header_value: Optional[str], query_value: Optional[str]) -> str:
+    """协商传输格式，未指定或无法识别时使用verbose"""
+    value = (query_value or header_value or "").strip().lower()
+    return value if value in STREAM_FORMATS else STREAM_FORMAT_VERBOSE
+
+
+SSE_PREFIX = b"data: "
+SSE_SUFFIX = b"\n\n"
+SSE_DONE = SSE_PREFIX + b"[DONE]" + SSE_SUFFIX
+
+
+def sse_frame(payload: bytes) -> bytes:
+    """把已序列化的负载包装为SSE帧"""
+    return SSE_PREFIX + payload + SSE_SUFFIX
+
+
+class SseFrameEncoder:
+    """SSE帧编码器（每个流一个实例），边编码边按字节统计
+
+    data_length：文本内容字节数 + 事件负载字节数
+    sse_length：完整SSE帧字节数（含 data: 前缀和换行）
+    """
+
+    def __init__(self, accumulator=None):
+        self.accumulator = accumulator
+
+    def encode_payload(self, payload: bytes, content: str = "") -> bytes:
+        frame = sse_frame(payload)
+        if self.accumulator is not None:
+            content_length = len(content.encode("utf-8")) if content else 0
+            self.accumulator.record_frame(content_length + len(payload), len(frame))
+        return frame
+
+    def encode(self, event: Dict[str, Any], content: str = "") -> bytes:
+        return self.encode_payload(json_codec.dumps(event), content)
+
+
+class CompactTextEncoder:
+    """compact格式的文本事件编码器（每个流一个实例）
+
+    已发送的header按LRU保留最近 MAX_HEADERS 个；被淘汰的元数据再次出现时分配新key并重新发送header，
+    key只增不减，不会复用，客户端已记录的key不会指向别的元数据。
+    """
+
+    MAX_HEADERS = 64
+
+    def __init__(self):
+        # 序列化后的元数据 -> key
+        self._headers: "OrderedDict[bytes, int]" = OrderedDict()
+        self._next_key = 1
+        self._last_meta: Optional[Dict[str, Any]] = None
+        self._last_key = 0
+
+    def _key_for(self, meta: Dict[str, Any]) -> Tuple[int, Optional[bytes]]:
+        """返回 (key, 需要发送的header或None)"""
+        serialized = json_codec.dumps(meta)
+        key = self._headers.get(serialized)
+        if key is not None:
+            self._headers.move_to_end(serialized)
+            return key, None
+        key = self._next_key
+        self._next_key += 1
+        self._headers[serialized] = key
+        if len(self._headers) > self.MAX_HEADERS:
+            self._headers.popitem(last=False)
+        return key, json_codec.dumps({"event": "stream_header", "k": key, "meta": meta})
+
+    def encode(self, metadata: Optional[Dict[str, Any]], text: str) -> Tuple[Optional[bytes], bytes]:
+        """编码一个文本事件，返回 (header负载或None, 文本负载)"""
+        meta = {key: value for key, value in (metadata or {}).items() if key != "content"}
+        # 连续的文本事件通常元数据相同，先比较最近一个，不需要序列化
+        if meta == self._last_meta:
+            header, key = None, self._last_key
+        else:
+            key, header = self._key_for(meta)
+            self._last_meta, self._last_key = meta, key
+        return header, json_codec.dumps({"k": key, "d": text})
@@ -0,0 +1,182 @@
+"""
+上游读取与客户端写出解耦
+
+上游流由独立的生产者任务读取，放入按字节限制的缓冲区，SSE响应从缓冲区取出后再发送给客户端。
+客户端较慢、缓冲区超过字节预算时按策略处理：
+    block     生产者等待缓冲区腾出空间（上游随客户端速度读取，但有预算内的余量）
+    coalesce  不再阻塞上游，把新的文本块合并进缓冲区末尾的同类文本块，上游按模型速度读完即释放连接
+    drop      放弃这个客户端（返回错误事件后结束响应），生产者继续读完上游，回答照常统计和落库
+
+全局默认值见 STREAM_BUFFER_BYTES / STREAM_SLOW_CLIENT_POLICY，可在 Agent.config 中按智能体覆盖：
+    stream_buffer_bytes         缓冲区字节预算，0表示不解耦（与之前一样在同一个生成器中读写）
+    stream_slow_client_policy   block / coalesce / drop
+默认不解耦（STREAM_BUFFER_BYTES=0）；启用续传（STREAM_RESUME_TTL>0）时也不使用，续传的生成任务已经与客户端解耦。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from core.adapter.base import StreamChunk
+from core.config import settings
+from core.stream_coalescer import merge_text_chunks, text_event_type
+
+logger = logging.getLogger(__name__)
+
+POLICY_BLOCK = "block"
+POLICY_COALESCE = "coalesce"
+POLICY_DROP = "drop"
+SLOW_CLIENT_POLICIES = (POLICY_BLOCK, POLICY_COALESCE, POLICY_DROP)
+
+# 估算每个块的元数据开销，避免仅为计数再序列化一次
+CHUNK_OVERHEAD = 256
+
+
+class SlowClientError(Exception):
+    """drop策略下客户端跟不上上游速度"""
+
+
+def _chunk_size(chunk: StreamChunk) -> int:
+    return len(chunk.message.encode("utf-8")) + CHUNK_OVERHEAD if chunk.message else CHUNK_OVERHEAD
+
+
+class _ChunkBuffer:
+    """按字节限制的块缓冲区，元素是待合并的块列表（coalesce策略下可以继续追加文本）"""
+
+    def __init__(self, max_bytes: int, policy: str):
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.items: Deque[List[StreamChunk]] = deque()
+        self.tail_event: Optional[str] = None
+        self.size = 0
+        self.finished = False
+        self.dropped = False
+        self.error: Optional[BaseException] = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    async def put(self, chunk: StreamChunk):
+        if self.dropped:
+            return
+        size = _chunk_size(chunk)
+        event = text_event_type(chunk)
+        if self.items and self.size + size > self.max_bytes:
+            if self.policy == POLICY_DROP:
+                logger.warning(f"客户端读取过慢，缓冲区超过 {self.max_bytes} 字节，断开客户端并继续读取上游")
+                self.dropped = True
+                self.items.clear()
+                self.size = 0
+                self._readable.set()
+                return
+            if self.policy == POLICY_COALESCE:
+                if event is not None and event == self.tail_event:
+                    # 合并后只增加文本字节，不再计入元数据开销
+                    self.items[-1].append(chunk)
+                    self.size += size - CHUNK_OVERHEAD
+                    return
+            else:
+                while self.items and self.size + size > self.max_bytes:
+                    self._writable.clear()
+                    await self._writable.wait()
+        self.items.append([chunk])
+        self.tail_event = event
+        self.size += size
+        self._readable.set()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.finished = True
+        self.error = error
+        self._readable.set()
+
+    async def get(self) -> Optional[StreamChunk]:
+        """取出下一个块，上游结束时返回None"""
+        while not self.items and not self.finished and not self.dropped:
+            self._readable.clear()
+            await self._readable.wait()
+        if self.dropped:
+            raise SlowClientError("客户端读取过慢，已断开")
+        if self.items:
+            chunks = self.items.popleft()
+            if not self.items:
+                self.tail_event = None
+            self.size -= sum(_chunk_size(chunk) for chunk in chunks) - CHUNK_OVERHEAD * (len(chunks) - 1)
+            self._writable.set()
+            return merge_text_chunks(chunks)
+        if self.error is not None:
+            raise self.error
+        return None
+
+
+class StreamPump:
+    """用生产者任务读取上游流，客户端从有界缓冲区读取"""
+
+    # 被drop的客户端对应的收尾任务（保持引用直到读完上游并执行完收尾）
+    _detached: Set[asyncio.Task] = set()
+
+    def __init__(self, max_bytes: int, policy: str = POLICY_BLOCK):
+        self.max_bytes = max_bytes
+        self.policy = policy if policy in SLOW_CLIENT_POLICIES else POLICY_BLOCK
+
+    @classmethod
+    def from_agent_config(cls, config: Dict[str, Any]) -> Optional["StreamPump"]:
+        """根据智能体配置（未配置时使用全局默认值）创建，预算为0时返回None"""
+        try:
+            max_bytes = int(config.get("stream_buffer_bytes", settings.STREAM_BUFFER_BYTES))
+        except (TypeError, ValueError):
+            max_bytes = settings.STREAM_BUFFER_BYTES
+        if max_bytes <= 0:
+            return None
+        policy = config.get("stream_slow_client_policy") or settings.STREAM_SLOW_CLIENT_POLICY
+        return cls(max_bytes, str(policy).lower())
+
+    @staticmethod
+    async def _produce(chunks: AsyncIterator[StreamChunk], buffer: _ChunkBuffer):
+        error = None
+        try:
+            async for chunk in chunks:
+                await buffer.put(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            buffer.finish(error)
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    @staticmethod
+    async def _drain(producer: asyncio.Task, on_dropped: Optional[Callable[[], Awaitable[None]]]):
+        await producer
+        if on_dropped is not None:
+            try:
+                await on_dropped()
+            except Exception as e:
+                logger.error(f"客户端断开后的收尾处理失败: {e}")
+
+    async def pump(
+        self, chunks: AsyncIterator[StreamChunk], on_dropped: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> AsyncGenerator[StreamChunk, None]:
+        """在后台读取上游，逐个产出块
+
+        on_dropped：drop策略放弃客户端后，在上游读完时调用（例如保存回答）
+        """
+        buffer = _ChunkBuffer(self.max_bytes, self.policy)
+        producer = asyncio.create_task(self._produce(chunks, buffer))
+        try:
+            while True:
+                chunk = await buffer.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            if buffer.dropped:
+                # 客户端已放弃，生产者继续读完上游，随后执行收尾
+                task = asyncio.create_task(self._drain(producer, on_dropped))
+                StreamPump._detached.add(task)
+                task.add_done_callback(StreamPump._detached.discard)
+            elif not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
@@ -0,0 +1,208 @@
+"""
+可续传的流式响应
+
+每个进行中的流分配一个stream_id（响应头 X-Stream-Id），由后台任务生成SSE帧并按顺序编号（从1开始），
+帧保存在有界的重放缓冲区中。客户端断线重连时通过续传接口带上 Last-Event-ID，
+先重放该编号之后的帧，再继续接收实时帧；同一个流可以有多个订阅者。
+默认关闭，STREAM_RESUME_TTL 大于0时启用，流结束后在该秒数内仍可续传。
+所有流的缓冲区合计不超过 STREAM_REPLAY_TOTAL_MAX_BYTES：超出时先移除最早结束的流，
+仍超出时丢弃正在追加的流中最早的帧（落后的订阅者无法再续传这些帧）。
+生成过程中所有订阅者都断开且 STREAM_ABANDON_GRACE 秒内没有续传时，取消生成任务（同时停止上游）。
+
+帧编号就是帧的序号，不解析SSE id字段的客户端也可以用已收到的帧数作为 Last-Event-ID。
+原始请求只有在 resumable=true 时才在每帧前输出 id 行，续传接口总是输出。
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import deque
+from typing import AsyncGenerator, AsyncIterator, Deque, Dict, Optional
+from core import json_codec
+from core.config import settings
+from core.metrics import Metrics
+from core.stream_format import sse_frame
+
+logger = logging.getLogger(__name__)
+
+
+class ResumableStream:
+    """一个进行中（或刚结束）的流及其重放缓冲区"""
+
+    def __init__(self, stream_id: str, merchant_id: Optional[int], user_id: Optional[int], stream_format: str,
+                 max_events: int, max_bytes: int):
+        self.id = stream_id
+        self.merchant_id = merchant_id
+        self.user_id = user_id
+        self.stream_format = stream_format
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.frames: Deque[bytes] = deque()
+        self.first_seq = 1  # frames[0]的编号
+        self.buffered_bytes = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.producer: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + len(self.frames) - 1
+
+    def append(self, frame: bytes):
+        self.frames.append(frame)
+        self.buffered_bytes += len(frame)
+        self.trim(self.max_bytes)
+        self._notify()
+
+    def trim(self, max_bytes: int) -> int:
+        """超出限制时丢弃最早的帧（至少保留最新一帧），返回释放的字节数"""
+        freed = 0
+        while len(self.frames) > 1 and (len(self.frames) > self.max_events or self.buffered_bytes > max_bytes):
+            size = len(self.frames.popleft())
+            self.buffered_bytes -= size
+            freed += size
+            self.first_seq += 1
+        return freed
+
+    def finish(self):
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, after: int) -> bool:
+        return after >= self.first_seq - 1
+
+    async def subscribe(self, after: int = 0, with_ids: bool = False) -> AsyncGenerator[bytes, None]:
+        """从编号after之后开始输出帧，追上后等待实时帧，流结束时返回"""
+        self.subscribers += 1
+        position = after
+        try:
+            while True:
+                if not self.can_resume(position):
+                    # 订阅者落后太多，需要的帧已被丢弃
+                    yield sse_frame(json_codec.dumps({"error": "stream replay buffer overflow", "stream_id": self.id}))
+                    return
+                changed = self._changed
+                # 先取出快照再输出，输出期间生成任务可能继续追加或丢弃帧
+                pending = list(itertools.islice(self.frames, position - self.first_seq + 1, None))
+                for seq, frame in enumerate(pending, position + 1):
+                    yield b"id: %d\n" % seq + frame if with_ids else frame
+                position += len(pending)
+                if position >= self.last_seq:
+                    if self.finished:
+                        return
+                    await changed.wait()
+        finally:
+            self._release()
+
+    def _release(self):
+        self.subscribers -= 1
+        if self.subscribers > 0 or self.finished or self.producer is None:
+            return
+        grace = settings.STREAM_ABANDON_GRACE
+        if grace > 0:
+            asyncio.get_running_loop().call_later(grace, self._cancel_if_abandoned)
+        else:
+            self._cancel_if_abandoned()
+
+    def _cancel_if_abandoned(self):
+        """没有订阅者续传时取消生成任务"""
+        if self.subscribers == 0 and not self.finished and not self.producer.done():
+            logger.info(f"流 {self.id} 的客户端已全部断开，取消上游生成")
+            self.producer.cancel()
+
+
+class StreamRegistry:
+    """进程内的可续传流注册表"""
+
+    _streams: Dict[str, ResumableStream] = {}
+    _total_bytes = 0  # 所有流的缓冲区字节数合计
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return settings.STREAM_RESUME_TTL > 0
+
+    @classmethod
+    def start(cls, frames: AsyncIterator[bytes], merchant_id: Optional[int], user_id: Optional[int],
+              stream_format: str) -> ResumableStream:
+        """注册一个流并在后台任务中生成帧，只有发起请求的用户可以续传"""
+        cls._expire()
+        stream = ResumableStream(
+            uuid.uuid4().hex, merchant_id, user_id, stream_format,
+            settings.STREAM_REPLAY_MAX_EVENTS, settings.STREAM_REPLAY_MAX_BYTES
+        )
+        stream.producer = asyncio.create_task(cls._produce(stream, frames))
+        cls._streams[stream.id] = stream
+        return stream
+
+    @classmethod
+    async def _produce(cls, stream: ResumableStream, frames: AsyncIterator[bytes]):
+        try:
+            async for frame in frames:
+                buffered = stream.buffered_bytes
+                stream.append(frame)
+                cls._total_bytes += stream.buffered_bytes - buffered
+                if cls._total_bytes > settings.STREAM_REPLAY_TOTAL_MAX_BYTES:
+                    cls._evict(stream)
+        except Exception as e:
+            logger.error(f"流 {stream.id} 生成失败: {e}")
+        finally:
+            stream.finish()
+
+    @classmethod
+    def get(cls, stream_id: str) -> Optional[ResumableStream]:
+        cls._expire()
+        return cls._streams.get(stream_id)
+
+    @classmethod
+    def _expire(cls):
+        """移除结束超过TTL的流"""
+        deadline = time.monotonic() - settings.STREAM_RESUME_TTL
+        expired = [
+            stream_id for stream_id, stream in cls._streams.items()
+            if stream.finished and stream.finished_at < deadline
+        ]
+        for stream_id in expired:
+            cls._remove(stream_id)
+
+    @classmethod
+    def _remove(cls, stream_id: str):
+        stream = cls._streams.pop(stream_id)
+        cls._total_bytes -= stream.buffered_bytes
+
+    @classmethod
+    def _evict(cls, current: ResumableStream):
+        """缓冲区合计超出上限：先移除最早结束的流，仍超出时缩减当前流的缓冲区"""
+        finished = sorted(
+            (stream for stream in cls._streams.values() if stream.finished),
+            key=lambda stream: stream.finished_at
+        )
+        for stream in finished:
+            if cls._total_bytes <= settings.STREAM_REPLAY_TOTAL_MAX_BYTES:
+                return
+            cls._remove(stream.id)
+            Metrics.incr("stream_replay_evicted_total")
+        excess = cls._total_bytes - settings.STREAM_REPLAY_TOTAL_MAX_BYTES
+        if excess > 0:
+            cls._total_bytes -= current.trim(current.buffered_bytes - excess)
+            Metrics.incr("stream_replay_trimmed_total")
+
+    @classmethod
+    async def shutdown(cls):
+        """应用关闭时取消仍在生成的流"""
+        producers = [stream.producer for stream in cls._streams.values()
+                     if stream.producer is not None and not stream.producer.done()]
+        for producer in producers:
+            producer.cancel()
+        if producers:
+            await asyncio.gather(*producers, return_exceptions=True)
+        cls._streams.clear()
+        cls._total_bytes = 0
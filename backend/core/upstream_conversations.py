@@ -0,0 +1,122 @@
+"""
+本地对话到上游（Dify）对话的映射
+
+之前每轮都不带conversation_id调用chat-messages，Dify每次新建对话，模型看不到之前的轮次。
+现在把Dify返回的conversation_id保存到 conversations.upstream_conversation_id，
+后续轮次带上它续用上游对话，上下文由Dify维护，客户端不需要重发历史，每轮的prompt也不会随轮数膨胀。
+
+    - 映射在进程内按LRU缓存（UPSTREAM_CONVERSATION_CACHE_SIZE），未命中时查询conversations表；
+    - 新的或变化的映射随对话和消息一起写入（见 core/message_persister.py 的 write_chats）；
+    - 上游对话过期或已删除（Dify返回404）时，DifyAdapter去掉conversation_id重发一次，
+      开始新的上游对话并保存新的映射；
+    - 只对chat类智能体生效（workflow没有对话），需要在 Agent.config 中设置 forward_conversation=true 开启
+      （或把 FORWARD_UPSTREAM_CONVERSATION 设为true对所有智能体开启）。
+
+开启的代价：带本地对话ID的请求不再合并（single_flight），续用上游对话的轮次也不查近似问题缓存，
+因为回答依赖各自对话的上文。跳过的次数记录在 single_flight_bypassed_total 和
+similar_query_cache_bypassed_total，可与 single_flight_coalesced_total、similar_query_cache_hits_total 对比后再决定是否开启。
+conversations.upstream_conversation_id 列由 init_db.py（sync_schema）补齐，启动时 check_schema 检查。
+
+映射按 (本地对话ID, agent_id, user_id) 区分，只有同一用户、同一智能体的对话才会续用，
+避免客户端传入他人的对话ID读到别人的上下文。
+多端点（endpoints）的智能体要求各端点是同一个Dify应用的副本（共用数据库），
+否则对话只存在于创建它的端点，换到其他端点时按过期处理重新开始。
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import select
+from core.adapter import ChatRequest
+from core.config import settings
+from core.database import async_session_scope
+from core.metrics import Metrics
+from models.session import Conversation
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamConversations:
+    """进程内的上游对话ID缓存（LRU）"""
+
+    _ids: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+
+    @staticmethod
+    def opted_in(config: Dict[str, Any]) -> bool:
+        """智能体是否开启了续用上游对话：chat类智能体、开启了forward_conversation"""
+        if config.get("type", "chat") == "workflow":
+            return False
+        return bool(config.get("forward_conversation", settings.FORWARD_UPSTREAM_CONVERSATION))
+
+    @classmethod
+    def enabled(cls, request: ChatRequest, config: Dict[str, Any]) -> bool:
+        """请求是否续用上游对话：智能体已开启，且请求带有本地对话ID"""
+        return bool(request.conversation_id) and cls.opted_in(config)
+
+    @staticmethod
+    def _key(request: ChatRequest, conversation_id: str) -> Tuple[str, int, int]:
+        return conversation_id, request.agent_id, request.user_id
+
+    @classmethod
+    async def resolve(cls, request: ChatRequest, config: Dict[str, Any]) -> Optional[str]:
+        """查出本地对话对应的上游对话ID并设置到 request.upstream_conversation_id，没有时返回None
+
+        同时按智能体配置设置 request.forward_conversation（首轮没有本地对话ID时也需要记录上游返回的ID）
+        """
+        request.forward_conversation = cls.opted_in(config)
+        if not cls.enabled(request, config):
+            return None
+        key = cls._key(request, request.conversation_id)
+        upstream_id = cls._ids.get(key)
+        if upstream_id is not None:
+            cls._ids.move_to_end(key)
+        else:
+            try:
+                async with async_session_scope() as db:
+                    upstream_id = await db.scalar(
+                        select(Conversation.upstream_conversation_id).where(
+                            Conversation.id == request.conversation_id,
+                            Conversation.merchant_id == request.merchant_id,
+                            Conversation.agent_id == request.agent_id,
+                            Conversation.user_id == request.user_id
+                        )
+                    )
+            except Exception as e:
+                # 查询失败时开始新的上游对话，不影响本次聊天
+                logger.warning(f"Failed to load upstream conversation for {request.conversation_id}: {e}")
+                upstream_id = None
+            if upstream_id:
+                cls._remember(key, upstream_id)
+        request.upstream_conversation_id = upstream_id
+        if upstream_id:
+            Metrics.incr("upstream_conversation_forwarded_total", agent_id=request.agent_id)
+        return upstream_id
+
+    @classmethod
+    def record(cls, request: ChatRequest, conversation_id: str, upstream_id: Optional[str]) -> Optional[str]:
+        """记录上游返回的对话ID，返回需要写入conversations表的值（映射没有变化或智能体未开启时为None）"""
+        if not upstream_id or not request.forward_conversation:
+            return None
+        key = cls._key(request, conversation_id)
+        if cls._ids.get(key) == upstream_id:
+            cls._ids.move_to_end(key)
+            return None
+        cls._remember(key, upstream_id)
+        return upstream_id
+
+    @classmethod
+    def _remember(cls, key: Tuple[str, int, int], upstream_id: str):
+        cls._ids[key] = upstream_id
+        cls._ids.move_to_end(key)
+        while len(cls._ids) > settings.UPSTREAM_CONVERSATION_CACHE_SIZE:
+            cls._ids.popitem(last=False)
+
+    @classmethod
+    def forget(cls, conversation_id: str):
+        """删除本地对话后调用"""
+        for key in [key for key in cls._ids if key[0] == conversation_id]:
+            del cls._ids[key]
+
+    @classmethod
+    def clear(cls):
+        cls._ids.clear()
@@ -8,6 +8,7 @@ CREATE TABLE IF NOT EXISTS merchants (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     name VARCHAR(100) NOT NULL,
     api_key VARCHAR(100) UNIQUE,
+    weight INTEGER NOT NULL DEFAULT 1,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -41,6 +42,7 @@ CREATE TABLE IF NOT EXISTS sessions (
     user_id UUID REFERENCES users(id),
     agent_id UUID REFERENCES agents(id),
     merchant_id UUID REFERENCES merchants(id),
+    upstream_conversation_id VARCHAR(64),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -56,6 +58,7 @@ CREATE TABLE IF NOT EXISTS messages (
     role VARCHAR(20) NOT NULL,
     metadata JSONB,
     total_tokens_estimated INTEGER DEFAULT 0,
+    dedupe_key VARCHAR(40) UNIQUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
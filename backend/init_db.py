@@ -6,7 +6,7 @@
 
 import sys
 from sqlalchemy.orm import Session
-from core.database import engine, Base, get_db
+from core.database import engine, get_db, sync_schema
 from models.user import User
 from models.merchant import Merchant
 from core.security import get_password_hash
@@ -15,8 +15,8 @@ from datetime import datetime
 def init_database():
     """初始化数据库，创建默认用户"""
     
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    # 创建所有表，并补上已有表中缺少的新列和索引
+    sync_schema()
     
     # 获取数据库会话
     db = Session(bind=engine)
@@ -1,17 +1,41 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from core.config import settings
-from core.database import engine, Base
+from core.database import async_engine, check_schema
+from core.deps import get_current_user_or_raise
+from core.adapter import EndpointRegistry, HttpClientRegistry
+from core.compression import CompressionMiddleware
+from core.message_persister import MessagePersister
+from core.metrics import Metrics
+from core.response_cache import ResponseCache
+from core.stream_registry import StreamRegistry
+from models.user import User
 from routers import agents, merchants, users, sessions, messages, auth, chat
 import argparse
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时检查表结构、准备上游连接池和消息写回器，关闭时刷新未写入的消息并释放所有长连接"""
+    # 创建缺少的表；已有表缺少新列时拒绝启动，需要先运行 init_db.py 补齐（启动时不执行ALTER TABLE）
+    await asyncio.to_thread(check_schema)
+    await HttpClientRegistry.startup()
+    await MessagePersister.startup()
+    try:
+        yield
+    finally:
+        await StreamRegistry.shutdown()
+        await MessagePersister.shutdown()
+        await HttpClientRegistry.shutdown()
+        await ResponseCache.shutdown()
+        await async_engine.dispose()
 
 app = FastAPI(
     title="问客AI平台API",
     description="问客AI平台提供了一套完整的API接口，用于管理商户、用户、智能体以及进行AI对话交互。",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -25,6 +49,9 @@ app.add_middleware(
     allow_origin_regex="https?://.*"
 )
 
+# 响应压缩：列表等普通响应按阈值压缩，SSE流由聊天路由自行处理
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE)
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用问客AI平台API"}
@@ -35,7 +62,22 @@ async def health_check():
 
 @app.get("/api/v1/health")
 async def api_health_check():
-    return {"status": "healthy"}
+    """健康检查，只返回状态（各上游端点的详情见需要登录的 /api/v1/health/upstreams）
+
+    有端点熔断时status为degraded，但仍返回200（本服务可用，不应因上游故障被重启）
+    """
+    degraded = any(upstream["breaker"]["state"] != "closed" for upstream in EndpointRegistry.snapshot())
+    return {"status": "degraded" if degraded else "healthy"}
+
+@app.get("/api/v1/health/upstreams")
+async def upstream_health(current_user: User = Depends(get_current_user_or_raise)):
+    """各上游端点的熔断器状态、延迟和进行中请求数（包含上游地址，需要登录）"""
+    return {"upstreams": EndpointRegistry.snapshot()}
+
+@app.get("/api/v1/metrics")
+async def metrics(current_user: User = Depends(get_current_user_or_raise)):
+    """进程内运行指标（取消的流、节省的token等），标签中包含上游地址，需要登录"""
+    return Metrics.snapshot()
 
 # FastAPI的CORS中间件已经足够处理CORS请求，不需要额外的处理
 
@@ -11,5 +11,7 @@ class Merchant(Base):
     api_key = Column(String(100), unique=True, nullable=False)
     balance = Column(DECIMAL(18, 2), default=0.00, nullable=False)
     status = Column(Enum("active", "inactive", "suspended"), nullable=False, default="active")
+    # 全局上游名额紧张时的调度权重，权重为2的商户获得的名额约为权重1的两倍
+    weight = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
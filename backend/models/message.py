@@ -25,6 +25,7 @@ class Message(Base):
     total_tokens = Column(Integer, default=0, comment="总token数")
     total_tokens_estimated = Column(Integer, default=0, comment="估算的总token数")
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    dedupe_key = Column(String(40), nullable=True, unique=True, index=True, comment="写入幂等键，重放时跳过已写入的消息")
     workflow_events: Union[Column[Optional[List[Dict[str, Any]]]], Optional[List[Dict[str, Any]]]] = Column(JSON)
     
     def get_workflow_events(self) -> Optional[List[Dict[str, Any]]]:
@@ -11,6 +11,8 @@ class Conversation(Base):
     agent_id = Column(Integer, ForeignKey("agents.id"), nullable=False, index=True)
     title = Column(String(200), nullable=False)
     status = Column(Enum("active", "ended"), nullable=False)
+    # 对应的上游（Dify）对话ID，后续轮次续用上游对话而不是重新开始
+    upstream_conversation_id = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     ended_at = Column(DateTime)
\ No newline at end of file
@@ -4,6 +4,7 @@ from typing import List
 from core.database import get_db
 from core.deps import get_current_user_or_raise
 from core.security import get_current_merchant_id
+from core.agent_cache import AgentCache
 from models.agent import Agent
 from schemas.agent import AgentCreate, AgentUpdate, Agent as AgentSchema
 import json
@@ -113,6 +114,8 @@ def update_agent(
     
     db.commit()
     db.refresh(db_agent)
+    # 配置已修改，失效本进程的缓存（其他进程通过高水位轮询感知）
+    AgentCache.invalidate(agent_id)
     return db_agent
 
 @router.delete("/{agent_id}", status_code=204)
@@ -139,4 +142,5 @@ def delete_agent(
         
     db.delete(db_agent)
     db.commit()
+    AgentCache.invalidate(agent_id)
     return
\ No newline at end of file
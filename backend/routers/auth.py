@@ -18,8 +18,8 @@ class LoginRequest(BaseModel):
     password: str
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from core.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.database import get_async_db
 from core.security import authenticate_user, create_access_token, get_current_user, get_token_payload, ACCESS_TOKEN_EXPIRE_MINUTES
 from core.config import settings
 from schemas.user import User as UserSchema
@@ -31,12 +31,12 @@ router = APIRouter(tags=["authentication"])
 @router.post("/login", response_model=LoginResponse)
 async def login_for_access_token(
     login_request: LoginRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     用户登录并获取访问令牌
     """
-    user = authenticate_user(db, login_request.username, login_request.password)
+    user = await authenticate_user(db, login_request.username, login_request.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
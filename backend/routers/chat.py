@@ -1,314 +1,147 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from fastapi.responses import StreamingResponse
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
-from typing import AsyncGenerator
-import json
+from starlette.background import BackgroundTask
+from typing import AsyncGenerator, Optional
 import logging
 from datetime import datetime
-from core.database import get_db
+from core import json_codec
+from core.admission import AdmissionController, AdmissionRejected
+from core.agent_cache import AgentCache
+from core.compression import compress_stream, negotiate_encoding
+from core.config import settings
 from core.deps import get_current_user_or_raise
 from core.chat_service import ChatService
+from core.stream_accumulator import StreamAccumulator, TEXT_EVENT_TYPES
+from core.stream_coalescer import TextChunkCoalescer
+from core.stream_pump import StreamPump
+from core.stream_registry import StreamRegistry
+from core.stream_format import (
+    SSE_DONE, STREAM_FORMAT_COMPACT, STREAM_FORMAT_VERBOSE, CompactTextEncoder, SseFrameEncoder,
+    negotiate_stream_format, sse_frame
+)
 from core.adapter import ChatRequest, ChatResponse
+from core.adapter.circuit_breaker import UpstreamUnavailable
+from core.adapter.timeouts import UpstreamTimeout
 from models.user import User
-from models.agent import Agent
-from models.message import Message
-from models.session import Conversation
-import uuid
 
 router = APIRouter(tags=["chat"])
 
 
-async def stream_chat_response(request: ChatRequest, db: Session, current_user: User) -> AsyncGenerator[str, None]:
-    """生成流式聊天响应"""
-    chat_service = ChatService(db)
+async def stream_chat_response(request: ChatRequest, current_user: User, stream_format: str = STREAM_FORMAT_VERBOSE) -> AsyncGenerator[bytes, None]:
+    """生成流式聊天响应
     
-    # 统计变量
-    event_count = 0
-    event_types = {}
-    total_message_length = 0
-    total_data_length = 0  # 统计所有数据内容长度
-    total_sse_length = 0   # 新增：统计完整的SSE数据长度（包括data:前缀）
-    total_tokens = 0
-    workflow_events = []
-    reasoning_events = []  # 收集思考类事件
-    other_events = []      # 收集其他事件
-    full_message_content = ""  # 收集完整的消息内容
-    message_events_received = set()  # 用于跟踪已接收的消息事件ID，避免重复
+    流式传输期间不持有数据库会话，只在查询agent和保存结果时短暂占用连接。
+    事件分类、统计和落库都由同一个StreamAccumulator完成，这里只负责编码和转发。
+    compact格式下文本事件只发送增量（见core/stream_format.py）。
+    每个事件只序列化一次，统计的是实际发送的字节数。
+    """
+    chat_service = ChatService()
+    accumulator = StreamAccumulator(request)
+    compact_encoder = CompactTextEncoder() if stream_format == STREAM_FORMAT_COMPACT else None
+    frame_encoder = SseFrameEncoder(accumulator)
+    chunks = None
+    saved = False
     
     try:
-        # 实时转发所有流式响应事件
-        async for response in chat_service.chat_stream(request):
-            # 统计信息
-            event_count += 1
-            
-            if response.metadata and 'event' in response.metadata:
+        # 转发完成后再落库，保存的token数与发送给客户端的统计一致
+        chunks = chat_service.chat_stream(request, accumulator, persist=False)
+        
+        async def save_result():
+            nonlocal saved
+            if accumulator.finished and not saved:
+                saved = True
+                await chat_service.save_stream_result(request, accumulator)
+        
+        agent = await AgentCache.get(request.agent_id)
+        # 由后台任务读取上游放入有界缓冲区，客户端较慢时不拖慢上游（策略见core/stream_pump.py）；
+        # 启用续传时流已经由续传的生成任务读取，不再叠加一层缓冲区和任务
+        pump = None if StreamRegistry.enabled() else StreamPump.from_agent_config(agent.adapter_config)
+        if pump is not None:
+            chunks = pump.pump(chunks, on_dropped=save_result)
+        # 按智能体配置合并连续的文本块（累加器仍然逐块统计，落库内容不受影响）
+        coalescer = TextChunkCoalescer.from_agent_config(agent.adapter_config)
+        if coalescer is not None:
+            chunks = coalescer.coalesce(chunks)
+        
+        # 实时转发所有流式响应事件（每个事件只序列化一次）
+        async for response in chunks:
+            if compact_encoder is not None and response.message and (
+                not response.metadata or response.metadata.get('event') in TEXT_EVENT_TYPES
+            ):
+                # compact格式：元数据变化时先发送header事件，文本帧只带增量
+                metadata = response.metadata or {
+                    "event": "message",
+                    "task_id": response.message_id or "",
+                    "id": response.message_id or ""
+                }
+                header, payload = compact_encoder.encode(metadata, response.message)
+                if header is not None:
+                    yield frame_encoder.encode_payload(header)
+                yield frame_encoder.encode_payload(payload, response.message)
+            elif response.metadata and 'event' in response.metadata:
                 # 如果是Dify原生事件，直接发送metadata
-                event_type = response.metadata.get('event')
-                event_types[event_type] = event_types.get(event_type, 0) + 1
-                
-                # 为消息事件生成唯一标识符
-                message_event_id = None
-                if event_type in ['text_chunk', 'message', 'agent_message'] and response.message_id:
-                    message_event_id = f"{event_type}:{response.message_id}"
-                
-                # 收集工作流事件用于token统计和保存（不包括agent_thought事件）
-                if event_type and event_type != "agent_thought" and ("workflow" in event_type or "node" in event_type or event_type in ["message_end", "message_file"]):
-                    workflow_events.append(response.metadata)
-                
-                # 收集思考类事件（仅针对agent_thought事件）
-                elif event_type == "agent_thought":
-                    reasoning_events.append(response.metadata)
-                
-                # 收集其他事件
-                elif event_type:
-                    other_events.append(response.metadata)
-                
-                event_data = response.metadata.copy()
+                event_data = response.metadata
+                content = ""
                 # 对于text_chunk/message/agent_message事件，确保包含content字段
-                if event_data.get('event') in ['text_chunk', 'message', 'agent_message'] and response.message:
-                    event_data['content'] = response.message
-                    # 统计所有消息内容长度
-                    total_message_length += len(response.message)
-                    total_data_length += len(response.message)  # 统计数据内容
-                    # 收集消息内容（避免重复）
-                    message_event_key = f"{event_data.get('event')}_{response.message_id or ''}"
-                    if message_event_key not in message_events_received:
-                        message_events_received.add(message_event_key)
-                        full_message_content += response.message
-                
-                # 统计所有事件类型的metadata数据长度
-                metadata_json = json.dumps(response.metadata)
-                total_data_length += len(metadata_json)
-                
-                # 生成SSE格式数据并统计完整长度
-                sse_data = f"data: {json.dumps(event_data)}\n\n"
-                total_sse_length += len(sse_data)  # 统计完整的SSE数据长度
-                
-                yield sse_data
+                # （Dify适配器生成的块已自带content，无需再复制metadata）
+                if event_data.get('event') in TEXT_EVENT_TYPES and response.message:
+                    if 'content' not in event_data:
+                        event_data = {**event_data, 'content': response.message}
+                    content = response.message
+                yield frame_encoder.encode(event_data, content)
             elif response.message:
                 # 对于普通消息，转换为Dify的message事件格式
-                message_content = response.message or ""
-                # 统计所有消息内容长度
-                total_message_length += len(message_content)
-                total_data_length += len(message_content)  # 统计数据内容
-                # 收集消息内容
-                full_message_content += message_content
-                
                 dify_event = {
                     "event": "message",
-                    "answer": message_content,
+                    "answer": response.message,
                     "task_id": response.message_id or "",
                     "id": response.message_id or "",
                     "created_at": int(datetime.now().timestamp())
                 }
-                
-                # 统计message事件的metadata数据长度
-                metadata_json = json.dumps(dify_event)
-                total_data_length += len(metadata_json)
-                
-                # 生成SSE格式数据并统计完整长度
-                sse_data = f"data: {json.dumps(dify_event)}\n\n"
-                total_sse_length += len(sse_data)  # 统计完整的SSE数据长度
-                
-                yield sse_data
-        
-        # 计算总token数：Dify API返回的token + 聊天接口输入输出的token
-        dify_tokens = 0
-        for event in workflow_events:
-            if event.get("event") == "message_end" and event.get("usage"):
-                usage_info = event.get("usage")
-                dify_tokens = usage_info.get("total_tokens", 0)
-                break
-            elif event.get("event") == "workflow_finished" and event.get("total_tokens"):
-                dify_tokens = event.get("total_tokens", 0)
-                break
-        
-        # 计算聊天接口的token：输入query长度 + 输出消息长度（按4字符=1token估算）
-        input_query = request.get_query_text() or ""
-        input_tokens = max(1, len(input_query) // 4)  # 至少1个token
-        output_tokens = max(1, total_message_length // 4)  # 至少1个token
-        chat_interface_tokens = input_tokens + output_tokens
+                yield frame_encoder.encode(dify_event, response.message)
         
-        # 总token数 = Dify API token + 聊天接口token
-        total_tokens = dify_tokens + chat_interface_tokens
-        
-        # 计算费用 - 基于网络传输的实际数据量
-        # 总传输数据量 = 完整SSE数据总长度 + 消息内容长度
-        total_transfer_data = total_sse_length + total_message_length
-        # 按4个字符=1个token估算，计算总token数
-        total_tokens_estimated = max(1, total_transfer_data // 4)
-        # 费用计算：按每百万token 12元
-        cost = (total_tokens_estimated / 1000000) * 12 if total_tokens_estimated > 0 else 0.0
+        await save_result()
         
         # 发送统计信息事件
-        stats_event = {
-            "event": "statistics",
-            "event_count": event_count,
-            "event_types": event_types,
-            "total_message_length": total_message_length,
-            "total_data_length": total_data_length,
-            "total_sse_length": total_sse_length,
-            "total_transfer_data": total_transfer_data,
-            "dify_tokens": dify_tokens,
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens,
-            "total_tokens": total_tokens,
-            "total_tokens_estimated": total_tokens_estimated,
-            "total_cost": cost,
-            "estimated_cost": cost
-        }
-        yield f"data: {json.dumps(stats_event)}\n\n"
+        stats_event = accumulator.statistics()
+        yield sse_frame(json_codec.dumps(stats_event))
         
         # 发送结束标记
-        yield "data: [DONE]\n\n"
-        
-        # 保存统计信息到数据库，确保前端显示和数据库保存的数据一致
-        # 注意：这里我们使用的是前端显示的total_tokens_estimated和cost
-        try:
-            # 保存统计信息到数据库
-            save_chat_statistics(db, request, total_tokens_estimated, cost, workflow_events, reasoning_events, other_events, full_message_content)
-        except Exception as e:
-            logging.error(f"Error saving chat statistics to database: {e}")
+        yield SSE_DONE
         
         # 输出详细统计信息到日志
-        logging.info(f"📊 聊天接口统计: 总共处理了 {event_count} 个事件")
-        logging.info(f"📊 事件类型分布: {event_types}")
-        logging.info(f"📊 总消息长度: {total_message_length} 字符")
-        logging.info(f"📊 所有数据内容总长度: {total_data_length} 字符 (包括metadata和消息内容)")
-        logging.info(f"📊 完整SSE数据总长度: {total_sse_length} 字符 (包括data:前缀和换行符)")
-        logging.info(f"📊 总传输数据量: {total_transfer_data} 字符 (SSE数据 + 消息内容)")
-        logging.info(f"📊 Dify API返回token数: {dify_tokens} tokens")
-        logging.info(f"📊 聊天接口输入token数: {input_tokens} tokens (query: '{input_query[:30]}{'...' if len(input_query) > 30 else ''}')")
-        logging.info(f"📊 聊天接口输出token数: {output_tokens} tokens")
-        logging.info(f"📊 总token数: {total_tokens} tokens (Dify API + 聊天接口)")
-        logging.info(f"📊 估算总token数: {total_tokens_estimated} tokens (基于传输数据量)")
-        if total_tokens_estimated > 0:
-            logging.info(f"📊 预估费用: ¥{cost:.6f} (按每百万token 12元计算)")
-        
-    except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-
-def save_chat_statistics(db: Session, request: ChatRequest, total_tokens_estimated: int, cost: float, workflow_events: list, reasoning_events: list, other_events: list, full_message_content: str = ""):
-    """保存聊天统计数据到数据库"""
-    try:
-        # 生成对话ID（如果有会话ID，强制使用传参的会话ID；如果没有会话ID就可以有解析出来的会话ID；如果都没有的话就新建会话ID）
-        conversation_id = request.conversation_id
-        if not conversation_id:
-            conversation_id = str(uuid.uuid4())
-        
-        # 保存或更新对话
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id
-        ).first()
-        
-        if not conversation:
-            conversation = Conversation(
-                id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                title=request.get_query_text()[:100],  # 使用前100个字符作为标题
-                status="active"
-            )
-            db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
-        elif request.conversation_id and request.conversation_id != conversation_id:
-            # 更新对话的更新时间
-            # 不需要手动设置 updated_at = None，SQLAlchemy 会自动处理
-            db.commit()
-        
-        # 检查是否已经存在相同对话ID的用户消息，避免重复保存
-        existing_user_message = db.query(Message).filter(
-            Message.conversation_id == conversation_id,
-            Message.role == "user",
-            Message.content == (request.get_query_text() or "")
-        ).first()
-        
-        # 只有当不存在相同用户消息时才保存用户消息
-        if not existing_user_message:
-            # 保存用户消息
-            user_query = request.get_query_text() or ""
-            
-            user_message = Message(
-                conversation_id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                role="user",
-                content=user_query
-            )
-            db.add(user_message)
-        
-        # 检查是否已经存在相同对话ID的AI消息，避免重复保存
-        existing_ai_message = db.query(Message).filter(
-            Message.conversation_id == conversation_id,
-            Message.role == "agent"
-        ).order_by(Message.id.desc()).first()
-        
-        # 只有当不存在相同AI消息时才保存AI回复消息
-        if not existing_ai_message:
-            # 处理reasoning_events，合并相同工具调用的不同事件
-            processed_reasoning_events = []
-            if reasoning_events:
-                # 创建一个字典来合并相同工具调用的不同事件
-                tool_calls_dict = {}
-                
-                for event in reasoning_events:
-                    # 检查是否是工具调用事件
-                    if event.get('tool') or event.get('tool_name') or event.get('name') or event.get('toll'):
-                        tool_name = event.get('tool') or event.get('tool_name') or event.get('name') or event.get('toll')
-                        tool_input = event.get('tool_input') or event.get('input') or ''
-                        
-                        # 使用工具名和输入作为唯一键
-                        tool_key = f"{tool_name}_{str(tool_input)}"
-                        
-                        # 如果已经有这个工具调用，合并数据
-                        if tool_key in tool_calls_dict:
-                            # 优先保留observation数据
-                            if event.get('observation') and not tool_calls_dict[tool_key].get('observation'):
-                                tool_calls_dict[tool_key]['observation'] = event['observation']
-                        else:
-                            # 添加新的工具调用
-                            tool_calls_dict[tool_key] = event
-                    else:
-                        # 非工具调用事件直接添加
-                        processed_reasoning_events.append(event)
-                
-                # 将合并后的工具调用添加到处理后的事件列表中
-                processed_reasoning_events.extend(tool_calls_dict.values())
-            
-            # 保存AI回复消息
-            ai_message = Message(
-                conversation_id=conversation_id,
-                merchant_id=request.merchant_id,
-                user_id=request.user_id,
-                agent_id=request.agent_id,
-                role="agent",
-                content=full_message_content,  # 保存完整的消息内容
-                # 正确处理JSON格式的thought_content
-                reasoning_events=processed_reasoning_events if processed_reasoning_events else None,
-                other_events=other_events if other_events else None,
-                workflow_events=workflow_events if workflow_events else None,
-                cost=cost,
-                total_tokens=total_tokens_estimated,  # 使用前端显示的估算值
-                total_tokens_estimated=total_tokens_estimated
-            )
-            db.add(ai_message)
+        input_query = request.get_query_text() or ""
+        logging.info(f"📊 聊天接口统计: 总共处理了 {stats_event['event_count']} 个事件")
+        logging.info(f"📊 事件类型分布: {stats_event['event_types']}")
+        logging.info(f"📊 总消息长度: {stats_event['total_message_length']} 字符")
+        logging.info(f"📊 所有数据内容总长度: {stats_event['total_data_length']} 字节 (包括metadata和消息内容)")
+        logging.info(f"📊 完整SSE数据总长度: {stats_event['total_sse_length']} 字节 (包括data:前缀和换行符)")
+        logging.info(f"📊 总传输数据量: {stats_event['total_transfer_data']} 字节 (SSE数据 + 消息内容)")
+        logging.info(f"📊 Dify API返回token数: {stats_event['dify_tokens']} tokens")
+        logging.info(f"📊 聊天接口输入token数: {stats_event['input_tokens']} tokens (query: '{input_query[:30]}{'...' if len(input_query) > 30 else ''}')")
+        logging.info(f"📊 聊天接口输出token数: {stats_event['output_tokens']} tokens")
+        logging.info(f"📊 总token数: {stats_event['total_tokens']} tokens (Dify API + 聊天接口)")
+        logging.info(f"📊 估算总token数: {stats_event['total_tokens_estimated']} tokens (基于传输数据量)")
+        if stats_event['total_tokens_estimated'] > 0:
+            logging.info(f"📊 预估费用: ¥{stats_event['total_cost']:.6f} (按每百万token 12元计算)")
         
-        db.commit()
     except Exception as e:
-        # 记录错误但不中断流式传输
-        logging.error(f"保存消息到数据库时出错: {e}")
-        db.rollback()
+        yield sse_frame(json_codec.dumps({'error': str(e)}))
+    finally:
+        # 客户端断开时立即关闭上游链路（不等垃圾回收），ChatService随即停止上游生成
+        if chunks is not None:
+            await chunks.aclose()
+        # 上游已读完、客户端在剩余的块转发完之前断开（例如还在缓冲区或合并器中）：
+        # 回答是完整的，ChatService不会按中断保存，这里在后台保存
+        if accumulator.finished and not saved:
+            ChatService.run_detached(save_result())
 
 
-async def generate_chat_response(request: ChatRequest, db: Session, current_user: User) -> ChatResponse:
+async def generate_chat_response(request: ChatRequest, current_user: User) -> ChatResponse:
     """生成非流式聊天响应"""
-    # 使用ChatService处理非流式响应
-    chat_service = ChatService(db)
+    # 使用ChatService处理非流式响应（调用上游期间不占用数据库连接）
+    chat_service = ChatService()
     response = await chat_service.chat(request)
     
     # 确保响应中包含费用和token估算信息
@@ -322,45 +155,128 @@ async def generate_chat_response(request: ChatRequest, db: Session, current_user
     return response
 
 
+def sse_response(body: AsyncGenerator[bytes, None], headers: dict, accept_encoding: Optional[str],
+                 background: Optional[BackgroundTask] = None) -> StreamingResponse:
+    """SSE响应，开启 SSE_COMPRESSION 后按 Accept-Encoding 压缩（每个事件后flush，不增加事件延迟）
+
+    background在响应结束或客户端断开后执行
+    """
+    encoding = negotiate_encoding(accept_encoding) if settings.SSE_COMPRESSION else None
+    if encoding:
+        body = compress_stream(body, encoding)
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(body, media_type="text/event-stream", headers=headers, background=background)
+
+
 @router.post("/completions")
 async def chat_completion(
     request: ChatRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_or_raise)  # 启用认证
+    current_user: User = Depends(get_current_user_or_raise),  # 启用认证
+    stream_format: Optional[str] = Query(None, description="流式传输格式：verbose（默认）或 compact"),
+    resumable: bool = Query(False, description="每帧前输出SSE id行，用于断线后通过 /streams/{stream_id} 续传"),
+    x_stream_format: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None)
 ):
     """
     处理聊天完成请求（根据智能体配置决定流式或非流式）
+    
+    流式响应的传输格式可通过请求头 X-Stream-Format 或查询参数 stream_format 选择；
+    启用续传时响应头 X-Stream-Id 返回流ID，断线后可带 Last-Event-ID 续传而不重新调用上游；
+    商户或智能体的并发名额已满且排队失败时返回429（带Retry-After）；
+    上游端点熔断中时阻塞请求返回503，流式请求返回code为upstream_unavailable的error事件
     """
     try:
-        # 获取agent信息以确定流式设置
-        agent = db.query(Agent).filter(Agent.id == request.agent_id).first()
-        if not agent:
-            raise ValueError(f"Agent not found: {request.agent_id}")
+        # 获取agent信息以确定流式设置（进程内缓存，ChatService随后直接命中同一条目）
+        agent = await AgentCache.get(request.agent_id)
+        should_stream = agent.stream
         
-        # 根据智能体配置中的stream参数决定返回类型
-        # 注意：需要确保config_dict中的stream参数是布尔类型
-        stream_setting = agent.config_dict.get("stream")
-        should_stream = False
-        if isinstance(stream_setting, bool):
-            should_stream = stream_setting
-        elif isinstance(stream_setting, str):
-            should_stream = stream_setting.lower() == "true"
-        elif isinstance(stream_setting, (int, float)):
-            should_stream = bool(stream_setting)
+        # 占用并发名额（必要时排队），流式请求在流结束时释放；
+        # 全局名额用满时流式对话优先于阻塞请求和workflow，商户之间按权重公平排队
+        interactive = should_stream and agent.adapter_config.get("type", "chat") != "workflow"
+        slot = await AdmissionController.acquire(
+            request.merchant_id, request.agent_id, agent.adapter_config, interactive=interactive
+        )
         
         if should_stream:
-            return StreamingResponse(
-                stream_chat_response(request, db, current_user),
-                media_type="text/event-stream"
-            )
+            try:
+                negotiated_format = negotiate_stream_format(x_stream_format, stream_format)
+                body = AdmissionController.hold(slot, stream_chat_response(request, current_user, negotiated_format))
+                headers = {"X-Stream-Format": negotiated_format}
+                if StreamRegistry.enabled():
+                    # 由后台任务生成并编号，当前连接只是第一个订阅者；名额由生成任务持有到流结束
+                    stream = StreamRegistry.start(
+                        body,
+                        current_user.merchant_id if current_user else None,
+                        current_user.id if current_user else None,
+                        negotiated_format
+                    )
+                    body = stream.subscribe(0, with_ids=resumable)
+                    headers["X-Stream-Id"] = stream.id
+                    return sse_response(body, headers, accept_encoding)
+                # 客户端在第一帧之前断开时hold不会开始迭代，响应结束后再释放一次
+                return sse_response(body, headers, accept_encoding, background=BackgroundTask(AdmissionController.release, slot))
+            except BaseException:
+                slot.release()
+                raise
         else:
             # 非流式响应
-            response = await generate_chat_response(request, db, current_user)
-            return response
+            try:
+                return await generate_chat_response(request, current_user)
+            finally:
+                slot.release()
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except UpstreamTimeout as e:
+        logging.getLogger(__name__).warning(f"Chat completion timed out: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    except UpstreamUnavailable as e:
+        # 上游熔断中，快速失败
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger = logging.getLogger(__name__)
         logger.error(f"Error in chat completion: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/streams/{stream_id}")
+async def resume_stream(
+    stream_id: str,
+    current_user: User = Depends(get_current_user_or_raise),
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[int] = Query(None, description="已收到的最后一帧编号，优先于 Last-Event-ID 请求头"),
+    accept_encoding: Optional[str] = Header(None)
+):
+    """续传进行中（或刚结束）的流：重放 Last-Event-ID 之后的帧，再继续接收实时帧"""
+    stream = StreamRegistry.get(stream_id)
+    # 只有发起请求的用户可以续传（同一商户的其他用户也不行）
+    merchant_id = current_user.merchant_id if current_user else None
+    user_id = current_user.id if current_user else None
+    if stream is None or stream.merchant_id != merchant_id or stream.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found or expired")
+    
+    if after is None:
+        try:
+            after = int(last_event_id) if last_event_id else 0
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Last-Event-ID")
+    after = max(after, 0)
+    if not stream.can_resume(after):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=f"Events up to {stream.first_seq - 1} are no longer buffered"
+        )
+    
+    headers = {"X-Stream-Format": stream.stream_format, "X-Stream-Id": stream.id}
+    return sse_response(stream.subscribe(after, with_ids=True), headers, accept_encoding)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
+from core.admission import MerchantWeights
 from core.database import get_db
 from core.deps import get_current_user_or_raise
 from models.merchant import Merchant
@@ -57,6 +58,8 @@ def update_merchant(
         
     db.commit()
     db.refresh(db_merchant)
+    # 调度权重可能已修改，失效本进程的缓存（其他进程按TTL刷新）
+    MerchantWeights.invalidate(merchant_id)
     return db_merchant
 
 @router.delete("/{merchant_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 from typing import List
-from core.database import get_db
+from core.database import get_async_db
 from core.deps import get_current_user_or_raise
 from core.security import get_current_merchant_id
+from core.upstream_conversations import UpstreamConversations
 from models.session import Conversation
 from models.message import Message
 from schemas.session import ConversationCreate, ConversationUpdate, Conversation as ConversationSchema
@@ -14,9 +15,9 @@ router = APIRouter()
 import uuid
 
 @router.post("/", response_model=ConversationSchema, status_code=status.HTTP_201_CREATED)
-def create_conversation(
+async def create_conversation(
     conversation: ConversationCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user_or_raise),
     merchant_id: int = Depends(get_current_merchant_id)
 ):
@@ -30,71 +31,79 @@ def create_conversation(
     
     db_conversation = Conversation(**conversation_data)
     db.add(db_conversation)
-    db.commit()
-    db.refresh(db_conversation)
+    await db.commit()
+    await db.refresh(db_conversation)
     return db_conversation
 
 @router.get("/{conversation_id}", response_model=ConversationSchema)
-def read_conversation(
+async def read_conversation(
     conversation_id: str, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user_or_raise),
     merchant_id: int = Depends(get_current_merchant_id)
 ):
-    db_conversation = db.query(Conversation).filter(Conversation.id == conversation_id)
+    query = select(Conversation).where(Conversation.id == conversation_id)
     
     # 添加商户过滤
     if merchant_id:
-        db_conversation = db_conversation.filter(Conversation.merchant_id == merchant_id)
+        query = query.where(Conversation.merchant_id == merchant_id)
         
-    db_conversation = db_conversation.first()
+    db_conversation = await db.scalar(query)
     
     if db_conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return db_conversation
 
 @router.get("/", response_model=List[ConversationSchema])
-def read_conversations(
+async def read_conversations(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user_or_raise),
     merchant_id: int = Depends(get_current_merchant_id)
 ):
-    query = db.query(Conversation)
+    query = select(Conversation)
     
     # 添加商户过滤
     if merchant_id:
-        query = query.filter(Conversation.merchant_id == merchant_id)
+        query = query.where(Conversation.merchant_id == merchant_id)
         
     # 按更新时间降序排序
-    conversations = query.order_by(Conversation.updated_at.desc()).offset(skip).limit(limit).all()
+    conversations = (await db.scalars(
+        query.order_by(Conversation.updated_at.desc()).offset(skip).limit(limit)
+    )).all()
+    
+    # 一次查询所有会话的消息条数
+    message_counts = {}
+    if conversations:
+        rows = await db.execute(
+            select(Message.conversation_id, func.count(Message.id))
+            .where(Message.conversation_id.in_([conversation.id for conversation in conversations]))
+            .group_by(Message.conversation_id)
+        )
+        message_counts = dict(rows.all())
     
-    # 为每个会话查询消息条数
     for conversation in conversations:
-        message_count = db.query(func.count(Message.id)).filter(
-            Message.conversation_id == conversation.id
-        ).scalar()
         # 将消息条数添加到会话对象中
-        conversation.message_count = message_count
+        conversation.message_count = message_counts.get(conversation.id, 0)
     
     return conversations
 
 @router.put("/{conversation_id}", response_model=ConversationSchema)
-def update_conversation(
+async def update_conversation(
     conversation_id: str, 
     conversation: ConversationUpdate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user_or_raise),
     merchant_id: int = Depends(get_current_merchant_id)
 ):
-    db_conversation = db.query(Conversation).filter(Conversation.id == conversation_id)
+    query = select(Conversation).where(Conversation.id == conversation_id)
     
     # 添加商户过滤
     if merchant_id:
-        db_conversation = db_conversation.filter(Conversation.merchant_id == merchant_id)
+        query = query.where(Conversation.merchant_id == merchant_id)
         
-    db_conversation = db_conversation.first()
+    db_conversation = await db.scalar(query)
     
     if db_conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -106,24 +115,24 @@ def update_conversation(
     for key, value in conversation.dict(exclude_unset=True).items():
         setattr(db_conversation, key, value)
         
-    db.commit()
-    db.refresh(db_conversation)
+    await db.commit()
+    await db.refresh(db_conversation)
     return db_conversation
 
 @router.delete("/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_conversation(
+async def delete_conversation(
     conversation_id: str, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user_or_raise),
     merchant_id: int = Depends(get_current_merchant_id)
 ):
-    db_conversation = db.query(Conversation).filter(Conversation.id == conversation_id)
+    query = select(Conversation).where(Conversation.id == conversation_id)
     
     # 添加商户过滤
     if merchant_id:
-        db_conversation = db_conversation.filter(Conversation.merchant_id == merchant_id)
+        query = query.where(Conversation.merchant_id == merchant_id)
         
-    db_conversation = db_conversation.first()
+    db_conversation = await db.scalar(query)
     
     if db_conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -132,6 +141,7 @@ def delete_conversation(
     if merchant_id and db_conversation.merchant_id != merchant_id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    db.delete(db_conversation)
-    db.commit()
-    return None
\ No newline at end of file
+    await db.delete(db_conversation)
+    await db.commit()
+    UpstreamConversations.forget(conversation_id)
+    return None
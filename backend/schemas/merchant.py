@@ -8,6 +8,7 @@ class MerchantBase(BaseModel):
     api_key: str
     balance: Optional[float] = 0.00
     status: Optional[str] = "active"
+    weight: Optional[int] = 1
 
 class MerchantCreate(MerchantBase):
     pass
@@ -17,6 +18,7 @@ class MerchantUpdate(MerchantBase):
     api_key: Optional[str] = None
     balance: Optional[float] = None
     status: Optional[str] = None
+    weight: Optional[int] = None
 
 class MerchantInDBBase(MerchantBase):
     id: int
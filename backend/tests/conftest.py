@@ -0,0 +1,102 @@
+"""
+测试公共配置：使用临时SQLite数据库，不依赖MySQL
+
+用法: cd backend && python -m pytest -q tests
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 必须在导入core.database之前设置
+_db_dir = tempfile.mkdtemp(prefix="ruoyi-ai-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'test.db')}")
+os.environ.setdefault("MESSAGE_SPOOL_PATH", os.path.join(_db_dir, "message_spool.jsonl"))
+os.environ.setdefault("MESSAGE_DEAD_LETTER_PATH", os.path.join(_db_dir, "message_dead_letter.jsonl"))
+
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+import models  # noqa: F401  注册所有表
+from core.adapter import EndpointRegistry, HttpClientRegistry
+from core.agent_cache import AgentCache
+from core.database import SessionLocal, async_engine, sync_schema
+from core.metrics import Metrics
+from core.similar_query_cache import SimilarQueryCache
+from core.upstream_conversations import UpstreamConversations
+from models import Agent, Merchant, User
+
+from fakes import DIFY_KEY, DIFY_URL, FakeDify
+
+sync_schema()
+
+
+@pytest.fixture
+def run():
+    """在新的事件循环中运行协程，结束前释放异步连接池（连接绑定在创建它的事件循环上）"""
+    def runner(coro):
+        async def wrapper():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(wrapper())
+    return runner
+
+
+@pytest.fixture
+def install_dify():
+    """把Dify替身注册为智能体使用的上游客户端"""
+    def install(fake: FakeDify) -> FakeDify:
+        HttpClientRegistry._clients[(DIFY_URL, DIFY_KEY)] = httpx.AsyncClient(
+            base_url=DIFY_URL, transport=httpx.MockTransport(fake.handler)
+        )
+        return fake
+    yield install
+    HttpClientRegistry._clients.clear()
+
+
+@pytest.fixture
+def dify(install_dify):
+    return install_dify(FakeDify())
+
+
+@pytest.fixture
+def seed():
+    """创建商户、若干用户和一个智能体，返回 (merchant_id, [user_id...], agent_id)"""
+    def create(config=None, users=1, stream=True):
+        db = SessionLocal()
+        try:
+            name = uuid.uuid4().hex[:8]
+            merchant = Merchant(name=name, api_key=name, balance=0)
+            db.add(merchant)
+            db.commit()
+            user_ids = []
+            for index in range(users):
+                user = User(merchant_id=merchant.id, username=f"{name}-{index}", email=f"{name}-{index}@test", password_hash="x")
+                db.add(user)
+                db.commit()
+                user_ids.append(user.id)
+            agent_config = {"base_url": DIFY_URL, "api_key": DIFY_KEY, "stream": stream, "type": "chat", **(config or {})}
+            agent = Agent(merchant_id=merchant.id, name=name, type="dify", config=agent_config, created_by=user_ids[0])
+            db.add(agent)
+            db.commit()
+            return merchant.id, user_ids, agent.id
+        finally:
+            db.close()
+    return create
+
+
+@pytest.fixture(autouse=True)
+def reset_process_state():
+    yield
+    AgentCache.clear()
+    EndpointRegistry.clear()
+    Metrics.reset()
+    SimilarQueryCache.clear()
+    UpstreamConversations.clear()
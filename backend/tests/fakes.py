@@ -0,0 +1,43 @@
+"""测试用的上游替身（由conftest.py的夹具注册）"""
+
+import json
+import uuid
+
+import httpx
+
+DIFY_URL = "http://dify.local/v1"
+DIFY_KEY = "test-key"
+
+
+class FakeDify:
+    """Dify替身：记录收到的请求，每次调用新建一个上游对话（conversation_id为最近一次的），
+    流式请求返回 stream_events，阻塞请求返回 answer
+
+    需要其他行为的测试模块继承它并覆盖 respond，再在模块中覆盖 dify 夹具（见conftest.py的install_dify）
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.answer = "回答"
+        self.conversation_id = None
+        self.stream_events = [
+            {"event": "message", "task_id": "t1", "id": "m1", "message_id": "m1", "answer": "你好"},
+            {"event": "message", "task_id": "t1", "id": "m1", "message_id": "m1", "answer": "，世界"},
+            {"event": "message_end", "task_id": "t1", "id": "m1", "message_id": "m1", "metadata": {"usage": {"total_tokens": 10}}},
+        ]
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else {}
+        self.calls.append((request.url.path, body))
+        return await self.respond(body)
+
+    async def respond(self, body: dict) -> httpx.Response:
+        self.conversation_id = body.get("conversation_id") or f"dify-{uuid.uuid4()}"
+        if body.get("response_mode") == "streaming":
+            events = [{**event, "conversation_id": self.conversation_id} for event in self.stream_events]
+            payload = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events)
+            return httpx.Response(200, content=payload.encode("utf-8"), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "answer": self.answer, "conversation_id": self.conversation_id, "message_id": "m2", "task_id": "t2",
+            "metadata": {"usage": {"total_tokens": 7}}
+        })
@@ -0,0 +1,47 @@
+import asyncio
+
+from core.admission import SCOPE_AGENT, AdmissionController
+from routers.chat import sse_response
+from starlette.background import BackgroundTask
+
+
+def in_flight(agent_id):
+    return AdmissionController._bulkheads[(SCOPE_AGENT, agent_id)].in_flight
+
+
+async def frames():
+    yield b"data: 1\n\n"
+    yield b"data: 2\n\n"
+
+
+def test_hold_releases_when_client_stops_reading(run):
+    async def scenario():
+        slot = await AdmissionController.acquire("m-hold", "a-hold", {"max_concurrency": 1})
+        body = AdmissionController.hold(slot, frames())
+        await body.__anext__()
+        assert in_flight("a-hold") == 1
+        await body.aclose()
+        return in_flight("a-hold")
+
+    assert run(scenario()) == 0
+
+
+def test_unstarted_stream_releases_after_disconnect(run):
+    async def scenario():
+        slot = await AdmissionController.acquire("m-unstarted", "a-unstarted", {"max_concurrency": 1})
+        body = AdmissionController.hold(slot, frames())
+        response = sse_response(body, {}, None, background=BackgroundTask(AdmissionController.release, slot))
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # 客户端在响应头发出之前就断开，响应体不会开始迭代
+            await asyncio.Event().wait()
+
+        await response({"type": "http", "method": "POST", "headers": []}, receive, send)
+        released = in_flight("a-unstarted")
+        await body.aclose()
+        return released
+
+    assert run(scenario()) == 0
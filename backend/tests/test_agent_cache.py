@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.agent_cache import AgentCache
+from core.config import settings
+from core.database import SessionLocal
+from models import Agent
+
+
+@pytest.fixture(autouse=True)
+def poll_every_call(monkeypatch):
+    # 模拟其他进程修改agents表：每次get都检查高水位，TTL足够长，只能靠高水位失效
+    monkeypatch.setattr(settings, "AGENT_CACHE_POLL_INTERVAL", 1e-9)
+    monkeypatch.setattr(settings, "AGENT_CACHE_TTL", 3600.0)
+
+
+def update_agent(agent_id, **values):
+    db = SessionLocal()
+    try:
+        agent = db.get(Agent, agent_id)
+        for key, value in values.items():
+            setattr(agent, key, value)
+        agent.updated_at = datetime.utcnow() + timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+
+
+def delete_agent(agent_id):
+    db = SessionLocal()
+    try:
+        db.delete(db.get(Agent, agent_id))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_updated_agent_is_reloaded_and_others_are_kept(run, seed):
+    _, _, agent_id = seed()
+    _, _, other_id = seed()
+
+    async def scenario():
+        other = await AgentCache.get(other_id)
+        assert (await AgentCache.get(agent_id)).stream is True
+        update_agent(agent_id, config={**(await AgentCache.get(agent_id)).adapter_config, "stream": False})
+        return (await AgentCache.get(agent_id)).stream, await AgentCache.get(other_id) is other
+
+    assert run(scenario()) == (False, True)
+
+
+def test_deleted_agent_clears_all_entries(run, seed):
+    _, _, agent_id = seed()
+    _, _, deleted_id = seed()
+
+    async def scenario():
+        entry = await AgentCache.get(agent_id)
+        await AgentCache.get(deleted_id)
+        delete_agent(deleted_id)
+        reloaded = await AgentCache.get(agent_id) is not entry
+        with pytest.raises(ValueError):
+            await AgentCache.get(deleted_id)
+        return reloaded
+
+    assert run(scenario()) is True
@@ -0,0 +1,50 @@
+import asyncio
+import uuid
+
+from sqlalchemy import select
+
+from core.adapter import ChatRequest
+from core.chat_service import ChatService
+from core.config import settings
+from core.database import async_session_scope
+from core.stream_pump import StreamPump
+from models.message import Message
+from routers.chat import stream_chat_response
+
+
+async def saved_messages(conversation_id):
+    async with async_session_scope() as db:
+        rows = await db.execute(select(Message.role, Message.content).where(Message.conversation_id == conversation_id).order_by(Message.id))
+        return [tuple(row) for row in rows]
+
+
+def test_finished_stream_is_saved_when_client_disconnects_before_draining(run, dify, seed):
+    merchant_id, (user_id,), agent_id = seed({"stream_buffer_bytes": 65536})
+    conversation_id = str(uuid.uuid4())
+    request = ChatRequest(query="你好", user_id=user_id, merchant_id=merchant_id, agent_id=agent_id, conversation_id=conversation_id)
+
+    async def scenario():
+        body = stream_chat_response(request, None)
+        await body.__anext__()
+        # 后台任务读完上游，剩余的块还在缓冲区中时客户端断开
+        await asyncio.sleep(0.1)
+        await body.aclose()
+        await asyncio.gather(*ChatService._interrupt_tasks)
+        return await saved_messages(conversation_id)
+
+    assert run(scenario()) == [("user", "你好"), ("agent", "你好，世界")]
+
+
+def test_pump_is_skipped_when_resumable_streams_decouple_the_upstream(run, dify, seed, monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_RESUME_TTL", 60.0)
+    def pump(*args, **kwargs):
+        raise AssertionError("启用续传时不应再使用StreamPump")
+
+    monkeypatch.setattr(StreamPump, "pump", pump)
+    merchant_id, (user_id,), agent_id = seed({"stream_buffer_bytes": 65536})
+    request = ChatRequest(query="你好", user_id=user_id, merchant_id=merchant_id, agent_id=agent_id)
+
+    async def scenario():
+        return b"".join([frame async for frame in stream_chat_response(request, None)])
+
+    assert run(scenario()).endswith(b"data: [DONE]\n\n")
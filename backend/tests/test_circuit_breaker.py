@@ -0,0 +1,86 @@
+import httpx
+import pytest
+
+from core.adapter.circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, UpstreamUnavailable
+from core.config import settings
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(settings, "ENDPOINT_BREAKER_CONSECUTIVE_FAILURES", 3)
+    monkeypatch.setattr(settings, "ENDPOINT_BREAKER_HALF_OPEN_CALLS", 2)
+    return CircuitBreaker("test")
+
+
+def trip(breaker):
+    for _ in range(settings.ENDPOINT_BREAKER_CONSECUTIVE_FAILURES):
+        breaker.record(True, probe=breaker.acquire())
+    assert breaker.state == STATE_OPEN
+
+
+def expire(breaker):
+    breaker.opened_at -= settings.ENDPOINT_BREAKER_OPEN_SECONDS
+
+
+def test_consecutive_failures_open_the_breaker(breaker):
+    trip(breaker)
+    with pytest.raises(UpstreamUnavailable):
+        breaker.acquire()
+
+
+def test_probes_close_the_breaker_and_stale_results_are_ignored(breaker):
+    before_open = breaker.acquire()
+    trip(breaker)
+    expire(breaker)
+
+    first, second = breaker.acquire(), breaker.acquire()
+    assert breaker.state == STATE_HALF_OPEN and first == second != 0
+    with pytest.raises(UpstreamUnavailable):
+        breaker.acquire()
+
+    # 熔断前发出的请求在探测期间返回：不计入探测结果，也不占用探测名额
+    breaker.record(True, probe=before_open)
+    breaker.release(before_open)
+    assert breaker.state == STATE_HALF_OPEN and breaker.probes == 2
+
+    breaker.record(False, probe=first)
+    assert breaker.state == STATE_HALF_OPEN
+    breaker.record(False, probe=second)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_failed_probe_reopens_and_old_round_is_ignored(breaker):
+    trip(breaker)
+    expire(breaker)
+    old_round = breaker.acquire()
+    breaker.record(True, probe=old_round)
+    assert breaker.state == STATE_OPEN
+
+    expire(breaker)
+    probe = breaker.acquire()
+    assert probe != old_round
+    breaker.record(False, probe=old_round)
+    breaker.release(old_round)
+    assert breaker.probes == 1 and breaker.probe_successes == 0
+    breaker.record(False, probe=probe)
+    breaker.record(False, probe=breaker.acquire())
+    assert breaker.state == STATE_CLOSED
+
+
+def test_public_health_hides_upstream_details(run, monkeypatch):
+    import main
+    from core.adapter import EndpointRegistry
+
+    EndpointRegistry.pool_for({"base_url": "http://secret.local/v1", "api_key": "app-secret-key"}, "")
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            public = await client.get("/api/v1/health")
+            monkeypatch.setattr(settings, "ENABLE_AUTH", True)
+            detail = await client.get("/api/v1/health/upstreams")
+            metrics = await client.get("/api/v1/metrics")
+            return public, detail, metrics
+
+    public, detail, metrics = run(scenario())
+    assert public.status_code == 200 and public.json() == {"status": "healthy"}
+    assert detail.status_code == 401 and metrics.status_code == 401
@@ -0,0 +1,70 @@
+import gzip
+
+import pytest
+
+from core.compression import CompressionMiddleware, brotli
+
+BODY = b"x" * 4096
+
+
+def response_app(content_type, chunks):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+    return app
+
+
+def call(run, app, accept_encoding, sent=None):
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding)]}
+    sent = [] if sent is None else sent
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    run(CompressionMiddleware(app, minimum_size=1024)(scope, receive, send))
+    return sent
+
+
+def headers(message):
+    return {key.decode(): value.decode() for key, value in message["headers"]}
+
+
+def test_large_response_is_gzipped(run):
+    start, body = call(run, response_app(b"application/json", [BODY]), b"gzip")
+    assert headers(start)["content-encoding"] == "gzip"
+    assert headers(start)["content-length"] == str(len(body["body"]))
+    assert gzip.decompress(body["body"]) == BODY
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli未安装")
+def test_brotli_is_preferred_when_accepted(run):
+    start, *chunks = call(run, response_app(b"application/json", [BODY[:2048], BODY[2048:]]), b"gzip, br")
+    assert headers(start)["content-encoding"] == "br"
+    assert "content-length" not in headers(start)
+    assert brotli.decompress(b"".join(chunk["body"] for chunk in chunks)) == BODY
+
+
+def test_small_response_is_not_compressed(run):
+    start, body = call(run, response_app(b"application/json", [b"{}"]), b"gzip")
+    assert "content-encoding" not in headers(start)
+    assert body["body"] == b"{}"
+
+
+def test_event_stream_headers_are_sent_before_the_first_event(run):
+    sent = []
+    sent_before_first_event = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        # 上游的第一个token还没到时，客户端应该已经收到响应头
+        sent_before_first_event.extend(message["type"] for message in sent)
+        await send({"type": "http.response.body", "body": b"data: 1\n\n", "more_body": False})
+
+    call(run, app, b"gzip", sent)
+    assert sent_before_first_event == ["http.response.start"]
+    assert "content-encoding" not in headers(sent[0])
+    assert sent[1]["body"] == b"data: 1\n\n"
@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from core.database import Base, check_schema, sync_schema
+import models  # noqa: F401  注册所有表
+
+
+def old_database(tmp_path):
+    """当前表结构去掉后来新增的列，模拟升级前的数据库"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_messages_dedupe_key"))
+        for table, column in (("merchants", "weight"), ("conversations", "upstream_conversation_id"), ("messages", "dedupe_key")):
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+        conn.execute(text("INSERT INTO merchants (id, name, api_key, balance, status, created_at) VALUES (1, '默认商户', 'k', 0, 'active', CURRENT_TIMESTAMP)"))
+    return engine
+
+
+def test_startup_check_rejects_missing_columns_without_altering(tmp_path):
+    engine = old_database(tmp_path)
+    with pytest.raises(RuntimeError, match="merchants.weight"):
+        check_schema(engine)
+    assert "weight" not in {column["name"] for column in inspect(engine).get_columns("merchants")}
+
+
+def test_sync_schema_adds_missing_columns_and_is_idempotent(tmp_path):
+    engine = old_database(tmp_path)
+    sync_schema(engine)
+    sync_schema(engine)
+
+    inspector = inspect(engine)
+    assert "weight" in {column["name"] for column in inspector.get_columns("merchants")}
+    assert "upstream_conversation_id" in {column["name"] for column in inspector.get_columns("conversations")}
+    assert any(index["unique"] and index["column_names"] == ["dedupe_key"] for index in inspector.get_indexes("messages"))
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT weight FROM merchants WHERE id = 1")).scalar() == 1
+    check_schema(engine)
@@ -0,0 +1,43 @@
+import pytest
+
+from core.adapter import ChatRequest
+from core.adapter.base import StreamChunk
+from core.parser import DifyResponseParser
+
+REQUEST = ChatRequest(query="你好", user_id=1, merchant_id=1, agent_id=1, conversation_id="c1")
+
+
+@pytest.fixture
+def extractors(monkeypatch):
+    monkeypatch.setattr(DifyResponseParser, "_event_extractors", dict(DifyResponseParser._event_extractors))
+    return DifyResponseParser._event_extractors
+
+
+def test_answer_and_text_chunk_events():
+    chunk = DifyResponseParser.parse_streaming_event({"answer": "你", "task_id": "t1"}, "message", False, REQUEST)
+    assert (chunk.message, chunk.conversation_id, chunk.message_id) == ("你", "c1", "t1")
+    assert chunk.metadata["event"] == "message" and chunk.metadata["content"] == "你"
+
+    data = {"task_id": "t2", "workflow_run_id": "w1", "data": {"text": "好", "from_variable_selector": ["llm", "text"]}}
+    chunk = DifyResponseParser.parse_streaming_event(data, "text_chunk", True, REQUEST)
+    assert chunk.message == "好"
+    assert chunk.metadata["workflow_run_id"] == "w1"
+    assert chunk.metadata["from_variable_selector"] == ["llm", "text"]
+
+
+def test_unknown_and_ping_events_are_ignored():
+    assert DifyResponseParser.parse_streaming_event({}, "not_a_dify_event", False, REQUEST) is None
+    assert DifyResponseParser.parse_streaming_event({}, "ping", False, REQUEST) is None
+
+
+def test_registered_extractor_is_dispatched(extractors):
+    def extract(data, request):
+        return StreamChunk(data["value"], request.conversation_id, None, {"event": "custom"})
+
+    DifyResponseParser.register_event_extractor("custom", extract)
+    chunk = DifyResponseParser.parse_streaming_event({"value": "x"}, "custom", False, REQUEST)
+    assert (chunk.message, chunk.conversation_id, chunk.metadata) == ("x", "c1", {"event": "custom"})
+
+    # 注册同名事件会覆盖内置的提取函数
+    DifyResponseParser.register_event_extractor("ping", extract)
+    assert DifyResponseParser.parse_streaming_event({"value": "y"}, "ping", False, REQUEST).message == "y"
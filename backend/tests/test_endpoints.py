@@ -0,0 +1,146 @@
+import asyncio
+
+import httpx
+import pytest
+
+from core.adapter import ChatRequest, DifyAdapter, EndpointRegistry, HttpClientRegistry
+from core.adapter.endpoints import LATENCY_ALPHA, Endpoint, EndpointPool
+from core.agent_cache import AgentCache
+from core.config import settings
+from core.database import SessionLocal
+from core.metrics import Metrics
+from models import Agent
+
+
+def load_adapter(run, agent_id):
+    async def scenario():
+        entry = await AgentCache.get(agent_id)
+        return DifyAdapter(entry.adapter_config)
+    return run(scenario())
+
+
+def test_stale_pools_are_dropped_after_the_agent_config_changes(run, seed):
+    _, _, agent_id = seed({"base_url": "http://dify-a/v1", "endpoints": [{}, {"base_url": "http://dify-b/v1"}]})
+    _, _, other_id = seed({"base_url": "http://dify-c/v1"})
+    before = load_adapter(run, agent_id)
+    load_adapter(run, other_id)
+    endpoint = before.endpoints.endpoints[0]
+
+    with SessionLocal() as db:
+        agent = db.get(Agent, agent_id)
+        agent.config = {**agent.config, "endpoints": [{}]}
+        db.commit()
+    AgentCache.invalidate(agent_id)
+    after = load_adapter(run, agent_id)
+
+    assert len(EndpointRegistry._pools) == 2
+    assert {endpoint.base_url for endpoint in EndpointRegistry.endpoints()} == {"http://dify-a/v1", "http://dify-c/v1"}
+    # 没有变化的端点保留原来的状态
+    assert after.endpoint is endpoint
+
+
+def test_adapter_without_endpoints_fails_clearly(monkeypatch):
+    monkeypatch.setattr(EndpointRegistry, "pool_for", classmethod(lambda cls, config, default: EndpointPool([])))
+    with pytest.raises(ValueError, match="no upstream endpoint"):
+        DifyAdapter({"api_key": "k"})
+
+
+def make_pool(*latencies):
+    pool = EndpointPool([Endpoint(f"http://dify-{index}/v1", "k") for index in range(len(latencies))])
+    for endpoint, latency in zip(pool.endpoints, latencies):
+        endpoint.latency_ewma = latency
+    return pool
+
+
+def test_pick_weighs_latency_by_in_flight_requests():
+    pool = make_pool(0.1, 0.3)
+    fast, slow = pool.endpoints
+    assert pool.pick() is fast
+    fast.in_flight = 3  # 0.1 × 4 > 0.3 × 1
+    assert pool.pick() is slow
+    assert pool.pick(exclude=slow) is fast
+
+
+def test_endpoint_without_samples_is_estimated_from_the_others():
+    pool = make_pool(0.1, 0.3, None)
+    pool.endpoints[0].in_flight = 2  # 0.3 > 0.2（平均值）
+    assert pool.pick() is pool.endpoints[2]
+
+
+def test_pick_skips_open_breakers(monkeypatch):
+    monkeypatch.setattr(settings, "ENDPOINT_BREAKER_CONSECUTIVE_FAILURES", 1)
+    pool = make_pool(0.1, 0.3)
+    first, second = pool.endpoints
+    first.failure(first.begin()[1])
+    assert pool.pick() is second
+    second.failure(second.begin()[1])
+    # 全部熔断时返回最早熔断的端点，由调用方快速失败
+    assert pool.pick() is first
+
+
+def test_ewma_tracks_recent_latency():
+    endpoint = Endpoint("http://dify/v1", "k")
+    endpoint.success(1.0)
+    endpoint.success(2.0)
+    assert endpoint.latency_ewma == pytest.approx(1.0 + LATENCY_ALPHA)
+
+
+def test_p95_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_HEDGE_MIN_SAMPLES", 20)
+    pool = make_pool(None)
+    for index in range(19):
+        pool.record_latency(index / 100)
+    assert pool.p95() is None
+    pool.record_latency(1.0)
+    assert pool.p95() == 0.18
+
+
+def install_upstreams(monkeypatch, delays):
+    """每个base_url一个上游替身，按delays中的秒数延迟后返回"""
+    calls = []
+    for base_url, delay in delays.items():
+        async def handler(request, base_url=base_url, delay=delay):
+            calls.append(base_url)
+            await asyncio.sleep(delay)
+            return httpx.Response(200, json={"answer": base_url, "conversation_id": "c", "message_id": "m", "task_id": "t"})
+        client = httpx.AsyncClient(base_url=base_url, transport=httpx.MockTransport(handler))
+        monkeypatch.setitem(HttpClientRegistry._clients, (base_url, "k"), client)
+    return calls
+
+
+def hedged_chat(run, config):
+    request = ChatRequest(query="你好", user_id=1, merchant_id=1, agent_id=1)
+
+    async def scenario():
+        adapter = DifyAdapter(config)
+        response = await adapter.chat(request)
+        return response.message, adapter.endpoint
+
+    return run(scenario())
+
+
+HEDGED = {"base_url": "http://dify-a/v1", "api_key": "k", "endpoints": [{}, {"base_url": "http://dify-b/v1"}],
+          "hedge": True, "hedge_delay": 0.05}
+
+
+def test_slow_primary_is_hedged_to_another_endpoint(run, monkeypatch):
+    calls = install_upstreams(monkeypatch, {"http://dify-a/v1": 1.0, "http://dify-b/v1": 0})
+    pool = EndpointRegistry.pool_for(HEDGED, "")
+    primary, backup = pool.endpoints
+    primary.latency_ewma, backup.latency_ewma = 0.01, 0.02
+
+    answer, endpoint = hedged_chat(run, HEDGED)
+    assert (answer, endpoint) == ("http://dify-b/v1", backup)
+    assert calls == ["http://dify-a/v1", "http://dify-b/v1"]
+    # 落败的请求已取消并结束统计
+    assert primary.in_flight == backup.in_flight == 0
+    assert Metrics.snapshot()["upstream_hedge_wins_total"] == [{"labels": {"endpoint": "http://dify-b/v1#k"}, "value": 1}]
+
+
+def test_fast_primary_is_not_hedged(run, monkeypatch):
+    calls = install_upstreams(monkeypatch, {"http://dify-a/v1": 0, "http://dify-b/v1": 0})
+    primary, backup = EndpointRegistry.pool_for(HEDGED, "").endpoints
+    primary.latency_ewma, backup.latency_ewma = 0.01, 0.02
+
+    assert hedged_chat(run, HEDGED)[0] == "http://dify-a/v1"
+    assert calls == ["http://dify-a/v1"]
@@ -0,0 +1,42 @@
+import dataclasses
+import enum
+import uuid
+from datetime import date, datetime, timezone
+
+import pytest
+
+from core import json_codec
+
+
+class Color(enum.Enum):
+    RED = "red"
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: str
+
+
+SAMPLES = [
+    {"text": "你好，世界", "emoji": "🙂", "nested": [1, 2.5, None, True]},
+    {"created_at": datetime(2024, 1, 2, 3, 4, 5, 123), "aware": datetime(2024, 1, 2, tzinfo=timezone.utc), "day": date(2024, 1, 2)},
+    {1: "int key", "id": uuid.UUID("12345678-1234-5678-1234-567812345678")},
+    {"color": Color.RED, "point": Point(1, "中")},
+    {"nan": float("nan"), "inf": [float("inf"), -float("inf")], "point": Point(1, float("nan"))},
+]
+
+
+@pytest.mark.skipif(json_codec.orjson is None, reason="orjson未安装")
+@pytest.mark.parametrize("obj", SAMPLES)
+def test_orjson_and_stdlib_are_byte_identical(obj):
+    assert json_codec.orjson.dumps(obj, default=json_codec._default, option=json_codec._ORJSON_OPTIONS) == json_codec._stdlib_dumps(obj)
+
+
+def test_dumps_is_compact_utf8():
+    assert json_codec.dumps({"a": "中"}) == '{"a":"中"}'.encode("utf-8")
+    assert json_codec.loads(json_codec.dumps(SAMPLES[0])) == SAMPLES[0]
+
+
+def test_stdlib_writes_non_finite_floats_as_null():
+    assert json_codec._stdlib_dumps({"a": float("nan"), "b": (1.5, float("inf"))}) == b'{"a":null,"b":[1.5,null]}'
@@ -0,0 +1,48 @@
+import asyncio
+
+from core.admission import MerchantWeights
+from core.database import SessionLocal
+from models import Merchant
+
+
+def test_weight_is_cached_and_concurrent_misses_share_one_query(run, seed, monkeypatch):
+    merchant_id, _, _ = seed()
+    db = SessionLocal()
+    db.query(Merchant).filter(Merchant.id == merchant_id).update({"weight": 3})
+    db.commit()
+    db.close()
+
+    loads = []
+    original = MerchantWeights._load.__func__
+
+    async def counting_load(cls, merchant_id, fallback):
+        loads.append(merchant_id)
+        return await original(cls, merchant_id, fallback)
+
+    monkeypatch.setattr(MerchantWeights, "_load", classmethod(counting_load))
+
+    async def scenario():
+        weights = await asyncio.gather(*[MerchantWeights.get(merchant_id) for _ in range(5)])
+        weights.append(await MerchantWeights.get(merchant_id))
+        return weights
+
+    assert run(scenario()) == [3.0] * 6
+    assert loads == [merchant_id]
+    MerchantWeights.invalidate(merchant_id)
+
+
+def test_failed_reload_keeps_previous_weight(run, monkeypatch):
+    MerchantWeights._weights["m-stale"] = (4.0, float("-inf"))
+
+    class Unavailable:
+        async def __aenter__(self):
+            raise ConnectionError("database down")
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr("core.admission.async_session_scope", Unavailable)
+    assert run(MerchantWeights.get("m-stale")) == 4.0
+    assert run(MerchantWeights.get("m-unknown")) == 1.0
+    MerchantWeights.invalidate("m-stale")
+    MerchantWeights.invalidate("m-unknown")
@@ -0,0 +1,115 @@
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from core import json_codec
+from core.config import settings
+from core.database import async_session_scope
+from core.message_persister import MessagePersister, PendingChat, write_chats
+from models.message import Message
+
+
+def make_chat(content="你好") -> PendingChat:
+    conversation_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    message = {"conversation_id": conversation_id, "merchant_id": 1, "user_id": 1, "agent_id": 1, "created_at": now}
+    return PendingChat(
+        conversation={"id": conversation_id, "merchant_id": 1, "user_id": 1, "agent_id": 1, "title": "t",
+                      "status": "active", "created_at": now, "updated_at": now, "upstream_conversation_id": None},
+        messages=[{**message, "role": "user", "content": content}, {**message, "role": "agent", "content": "回复"}]
+    )
+
+
+async def count_messages(chats):
+    async with async_session_scope() as db:
+        ids = [chat.conversation["id"] for chat in chats]
+        return await db.scalar(select(func.count()).select_from(Message).where(Message.conversation_id.in_(ids)))
+
+
+@pytest.fixture
+def persister(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MESSAGE_DEAD_LETTER_PATH", str(tmp_path / "dead.jsonl"))
+    monkeypatch.setattr(settings, "MESSAGE_SPOOL_PATH", str(tmp_path / "spool.jsonl"))
+    MessagePersister._spool = open(settings.MESSAGE_SPOOL_PATH, "ab")
+    MessagePersister._pending = []
+    MessagePersister._unsynced = []
+    yield MessagePersister
+    MessagePersister._spool.close()
+    MessagePersister._spool = None
+    MessagePersister._pending = []
+    MessagePersister._unsynced = []
+
+
+def test_replayed_chat_is_not_duplicated(run):
+    chat = make_chat()
+
+    async def scenario():
+        for _ in range(2):
+            async with async_session_scope() as db:
+                await write_chats(db, [PendingChat.from_record(json_codec.loads(json_codec.dumps(chat.to_record())))])
+        return await count_messages([chat])
+
+    assert run(scenario()) == 2
+
+
+def test_invalid_conversation_is_not_silently_skipped(run):
+    chat = make_chat()
+    del chat.conversation["status"]
+
+    async def scenario():
+        async with async_session_scope() as db:
+            with pytest.raises(IntegrityError):
+                await write_chats(db, [chat])
+            await db.rollback()
+        return await count_messages([chat])
+
+    assert run(scenario()) == 0
+
+
+def test_submitted_chats_are_synced_to_the_spool(run, persister):
+    chat = make_chat()
+    persister.submit(chat)
+    assert persister._spool.tell() == 0
+    run(persister._sync_spool())
+    assert [pending.id for pending in persister._load_spool()] == [chat.id]
+
+
+def test_failing_chat_is_split_out_and_dead_lettered(run, persister):
+    good = [make_chat() for _ in range(3)]
+    bad = make_chat(content={"不能写入": "dict"})
+    persister._pending = [good[0], bad, good[1], good[2]]
+
+    async def scenario():
+        results = [await persister.flush() for _ in range(settings.MESSAGE_MAX_ATTEMPTS)]
+        return results, await count_messages(good + [bad])
+
+    results, written = run(scenario())
+    assert results == [False] * (settings.MESSAGE_MAX_ATTEMPTS - 1) + [True]
+    assert written == 6
+    assert persister._pending == []
+    with open(settings.MESSAGE_DEAD_LETTER_PATH, "rb") as f:
+        records = [json_codec.loads(line) for line in f]
+    assert [record["id"] for record in records] == [bad.id]
+    assert records[0]["attempts"] == settings.MESSAGE_MAX_ATTEMPTS
+
+
+def test_database_outage_keeps_batch_without_counting_attempts(run, persister, monkeypatch):
+    chats = [make_chat(), make_chat()]
+    persister._pending = list(chats)
+
+    async def fail(batch):
+        raise ConnectionError("database down")
+
+    async def unavailable():
+        return False
+
+    monkeypatch.setattr(MessagePersister, "_write_batch", fail)
+    monkeypatch.setattr(MessagePersister, "_database_available", unavailable)
+    assert run(persister.flush()) is False
+    assert persister._pending == chats
+    assert [chat.attempts for chat in chats] == [0, 0]
+    assert not os.path.exists(settings.MESSAGE_DEAD_LETTER_PATH)
@@ -0,0 +1,72 @@
+import httpx
+import pytest
+from sqlalchemy import select
+
+from core.adapter import ChatRequest, StreamChunk
+from core.chat_service import ChatService
+from core.database import async_session_scope
+from core.response_cache import MODE_STREAMING, ResponseCache
+from models import Conversation, Message
+
+from fakes import FakeDify
+
+WORKFLOW = {"type": "workflow", "response_cache": True}
+WORKFLOW_RESULT = {"task_id": "t", "workflow_run_id": "r", "data": {"status": "succeeded", "outputs": {"text": "查询结果"}}}
+
+
+class WorkflowDify(FakeDify):
+    """阻塞请求返回workflow的运行结果"""
+
+    async def respond(self, body):
+        if body.get("response_mode") == "streaming":
+            return await super().respond(body)
+        return httpx.Response(200, json=WORKFLOW_RESULT)
+
+
+@pytest.fixture
+def dify(install_dify):
+    return install_dify(WorkflowDify())
+
+
+def test_blocking_hit_is_saved_in_the_callers_own_conversation(run, dify, seed):
+    merchant_id, user_ids, agent_id = seed(WORKFLOW, users=2, stream=False)
+
+    async def scenario():
+        responses = []
+        for user_id in user_ids:
+            request = ChatRequest(query="查 订单", user_id=user_id, merchant_id=merchant_id, agent_id=agent_id)
+            responses.append(await ChatService().chat(request))
+        async with async_session_scope() as db:
+            owners = dict((await db.execute(select(Conversation.id, Conversation.user_id).where(Conversation.agent_id == agent_id))).all())
+            saved = (await db.execute(select(Message.conversation_id, Message.message_metadata).where(
+                Message.agent_id == agent_id, Message.role == "agent"
+            ))).all()
+        return responses, owners, dict(saved)
+
+    responses, owners, saved = run(scenario())
+    assert len(dify.calls) == 1
+    assert [(response.metadata or {}).get("cache_hit") for response in responses] == [None, True]
+    conversation_ids = [response.conversation_id for response in responses]
+    assert None not in conversation_ids and len(set(conversation_ids)) == 2
+    assert owners == dict(zip(conversation_ids, user_ids))
+    assert saved[conversation_ids[1]]["cache_hit"] is True
+
+
+def test_stream_replay_drops_the_original_conversation(run, seed):
+    merchant_id, user_ids, agent_id = seed(WORKFLOW, users=2)
+    original = ChatRequest(query="查订单", user_id=user_ids[0], merchant_id=merchant_id, agent_id=agent_id, conversation_id="c-original")
+    other = ChatRequest(query="查订单", user_id=user_ids[1], merchant_id=merchant_id, agent_id=agent_id, conversation_id="c-other")
+    chunks = [
+        StreamChunk("结果", "c-original", "m1", {"event": "text_chunk", "conversation_id": "dify-1", "data": {"text": "结果"}}),
+        StreamChunk("", "c-original", "m1", {"event": "workflow_finished", "conversation_id": "dify-1", "status": "succeeded"}),
+    ]
+
+    async def scenario():
+        key = ResponseCache.key_for(original, WORKFLOW, MODE_STREAMING)
+        await ResponseCache.put_stream(key, chunks, original, WORKFLOW)
+        return await ResponseCache.get_stream(ResponseCache.key_for(other, WORKFLOW, MODE_STREAMING), other)
+
+    replayed = run(scenario())
+    assert [chunk.message for chunk in replayed] == ["结果", ""]
+    assert all(chunk.conversation_id == "c-other" for chunk in replayed)
+    assert all("conversation_id" not in chunk.metadata for chunk in replayed)
@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import select
+
+from core.adapter import ChatRequest
+from core.chat_service import ChatService
+from core.database import async_session_scope
+from core.similar_query_cache import SimilarIndex, fingerprint, np
+from models import Conversation
+
+pytestmark = pytest.mark.skipif(np is None, reason="numpy未安装")
+
+SIMILAR = {"similar_query_cache": True}
+
+
+def lookup(cached, query):
+    index = SimilarIndex(100, 1 << 20)
+    index.add("scope", *fingerprint(cached), b"answer", 60)
+    return index.lookup("scope", *fingerprint(query), 0.8)
+
+
+def test_rewordings_hit_and_different_numbers_miss():
+    assert lookup("怎么退货？", "怎么 退货呢")[0] == b"answer"
+    assert lookup("订单123怎么退货", "订单124怎么退货") is None
+
+
+async def conversations(agent_id):
+    async with async_session_scope() as db:
+        rows = await db.execute(select(Conversation.id, Conversation.user_id, Conversation.upstream_conversation_id).where(
+            Conversation.agent_id == agent_id
+        ))
+        return {row.user_id: (row.id, row.upstream_conversation_id) for row in rows}
+
+
+def test_blocking_hit_gets_its_own_conversation(run, dify, seed):
+    merchant_id, (first, second), agent_id = seed(SIMILAR, users=2, stream=False)
+
+    async def scenario():
+        responses = [
+            await ChatService().chat(ChatRequest(query=query, user_id=user_id, merchant_id=merchant_id, agent_id=agent_id))
+            for user_id, query in ((first, "怎么退货？"), (second, "怎么退货呢"))
+        ]
+        return responses, await conversations(agent_id)
+
+    (original, hit), saved = run(scenario())
+    assert len(dify.calls) == 1
+    assert hit.metadata["cache_hit"] is True and hit.metadata["similarity"] >= 0.8
+    assert original.conversation_id == dify.conversation_id
+    assert hit.conversation_id not in (None, dify.conversation_id)
+    assert saved[first][0] == original.conversation_id
+    assert saved[second] == (hit.conversation_id, None)
+
+
+def test_stream_hit_does_not_leak_the_upstream_conversation(run, dify, seed):
+    # 开启续用上游对话时才会记录上游对话ID；首轮还没有映射，仍然查近似问题缓存
+    merchant_id, (first, second), agent_id = seed({**SIMILAR, "forward_conversation": True}, users=2)
+
+    async def scenario():
+        replayed = []
+        for user_id, query, conversation_id in ((first, "怎么退货？", "c-first"), (second, "怎么退货呢", "c-second")):
+            request = ChatRequest(query=query, user_id=user_id, merchant_id=merchant_id, agent_id=agent_id, conversation_id=conversation_id)
+            replayed = [chunk async for chunk in ChatService().chat_stream(request)]
+        return replayed, await conversations(agent_id)
+
+    replayed, saved = run(scenario())
+    assert len(dify.calls) == 1
+    assert "".join(chunk.message for chunk in replayed) == "你好，世界"
+    assert all("conversation_id" not in (chunk.metadata or {}) for chunk in replayed)
+    assert saved[first] == ("c-first", dify.conversation_id)
+    assert saved[second] == ("c-second", None)
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from core.adapter import ChatRequest
+from core.chat_service import ChatService
+from core.database import async_session_scope
+from models import Conversation, Message
+
+from fakes import FakeDify
+
+
+class SlowDify(FakeDify):
+    """响应前等待一会儿，让并发请求重叠到同一次上游调用上"""
+
+    async def respond(self, body):
+        await asyncio.sleep(0.1)
+        return await super().respond(body)
+
+
+@pytest.fixture
+def dify(install_dify):
+    return install_dify(SlowDify())
+
+
+def test_coalesced_users_get_separate_conversations(run, dify, seed):
+    merchant_id, user_ids, agent_id = seed({"single_flight": True}, users=2, stream=False)
+
+    async def scenario():
+        responses = await asyncio.gather(*[
+            ChatService().chat(ChatRequest(query="退货怎么申请", user_id=user_id, merchant_id=merchant_id, agent_id=agent_id))
+            for user_id in user_ids
+        ])
+        async with async_session_scope() as db:
+            owners = dict((await db.execute(
+                select(Conversation.id, Conversation.user_id).where(Conversation.agent_id == agent_id)
+            )).all())
+            messages = (await db.execute(
+                select(Message.conversation_id, Message.user_id).where(Message.agent_id == agent_id)
+            )).all()
+        return responses, owners, messages
+
+    responses, owners, messages = run(scenario())
+    assert len(dify.calls) == 1
+    assert [response.message for response in responses] == ["回答", "回答"]
+
+    conversation_ids = [response.conversation_id for response in responses]
+    # 发起调用的请求使用上游对话ID，合并进来的请求新建自己的对话
+    assert conversation_ids.count(dify.conversation_id) == 1
+    assert None not in conversation_ids and len(set(conversation_ids)) == 2
+    assert owners == dict(zip(conversation_ids, user_ids))
+    assert sorted(messages) == sorted((conversation_id, user_id) for conversation_id, user_id in zip(conversation_ids, user_ids) for _ in range(2))
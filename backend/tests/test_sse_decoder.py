@@ -0,0 +1,51 @@
+import pytest
+
+from core.parser.sse_decoder import SSEDecoder, SSEEvent
+
+STREAM = (
+    b"\xef\xbb\xbfevent: message\r\nid: 1\r\n: comment\r\ndata: {\"answer\": \"\xe4\xbd\xa0\"}\r\n\r\n"
+    b"data: line1\rdata: line2\r\r"
+    b"retry: 3000\ndata: plain\n\n"
+)
+EXPECTED = [
+    SSEEvent('{"answer": "你"}', "message", "1", None),
+    SSEEvent("line1\nline2", None, "1", None),
+    SSEEvent("plain", None, "1", 3000),
+]
+
+
+def decode(chunks):
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    return events + decoder.close()
+
+
+def test_whole_stream():
+    assert decode([STREAM]) == EXPECTED
+
+
+@pytest.mark.parametrize("split", range(1, len(STREAM)))
+def test_any_chunk_boundary(split):
+    # 覆盖跨chunk的 \r\n、被切开的BOM和被切开的多字节字符
+    assert decode([STREAM[:split], STREAM[split:]]) == EXPECTED
+
+
+def test_byte_by_byte():
+    assert decode([STREAM[index:index + 1] for index in range(len(STREAM))]) == EXPECTED
+
+
+def test_fast_path_single_line_events():
+    assert decode([b"data: a\n\ndata: b\n\n", b"data: c\n\n"]) == [SSEEvent("a"), SSEEvent("b"), SSEEvent("c")]
+
+
+def test_unterminated_last_event_is_still_dispatched():
+    assert decode([b"data: a\n\ndata: tail"]) == [SSEEvent("a"), SSEEvent("tail")]
+
+
+@pytest.mark.parametrize("split", range(1, 4))
+def test_bom_split_across_chunks_is_stripped(split):
+    stream = b"\xef\xbb\xbfdata: x\n\n"
+    decoder = SSEDecoder()
+    assert decoder.feed(stream[:split]) + decoder.feed(stream[split:]) == [SSEEvent("x")]
@@ -0,0 +1,79 @@
+import asyncio
+
+from core.adapter.base import StreamChunk
+from core.stream_coalescer import TextChunkCoalescer
+
+
+def text(message, event="message"):
+    return StreamChunk(message, "c1", "t1", {"event": event, "content": message})
+
+
+END = StreamChunk("", "c1", "t1", {"event": "message_end"})
+
+
+async def upstream(*items):
+    for item in items:
+        yield item
+
+
+async def frames(coalescer, chunks):
+    return [(chunk.metadata["event"], chunk.message) async for chunk in coalescer.coalesce(chunks)]
+
+
+def test_consecutive_text_of_the_same_event_is_merged(run):
+    chunks = upstream(text("你"), text("好"), text("想", "agent_message"), text("法", "agent_message"), END, text("！"))
+    result = run(frames(TextChunkCoalescer(60), chunks))
+    assert result == [("message", "你好"), ("agent_message", "想法"), ("message_end", ""), ("message", "！")]
+
+
+def test_merged_chunk_keeps_first_metadata_with_merged_content(run):
+    async def scenario():
+        return [chunk async for chunk in TextChunkCoalescer(60).coalesce(upstream(text("a"), text("b")))]
+
+    (chunk,) = run(scenario())
+    assert (chunk.conversation_id, chunk.message_id, chunk.metadata) == ("c1", "t1", {"event": "message", "content": "ab"})
+
+
+def test_byte_budget_flushes_before_the_window(run):
+    chunks = upstream(text("你"), text("好"), text("吗"))
+    # 每个汉字3字节，预算6字节
+    assert run(frames(TextChunkCoalescer(60, max_bytes=6), chunks)) == [("message", "你好"), ("message", "吗")]
+
+
+def test_window_flushes_while_upstream_is_slow(run):
+    async def slow():
+        yield text("a")
+        yield text("b")
+        await asyncio.sleep(0.2)
+        yield text("c")
+
+    assert run(frames(TextChunkCoalescer(0.02), slow())) == [("message", "ab"), ("message", "c")]
+
+
+def test_closing_early_closes_upstream(run):
+    closed = []
+
+    async def chunks():
+        try:
+            yield text("a")
+            yield END
+            await asyncio.sleep(10)
+            yield text("b")
+        finally:
+            closed.append(True)
+
+    async def scenario():
+        stream = TextChunkCoalescer(60).coalesce(chunks())
+        first = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        return [chunk.message for chunk in first]
+
+    assert run(scenario()) == ["a", ""]
+    assert closed == [True]
+
+
+def test_from_agent_config():
+    assert TextChunkCoalescer.from_agent_config({}) is None
+    assert TextChunkCoalescer.from_agent_config({"stream_coalesce_ms": "abc"}) is None
+    coalescer = TextChunkCoalescer.from_agent_config({"stream_coalesce_ms": 20, "stream_coalesce_bytes": 1024})
+    assert (coalescer.window, coalescer.max_bytes) == (0.02, 1024)
@@ -0,0 +1,22 @@
+from core import json_codec
+from core.stream_format import CompactTextEncoder
+
+
+def test_repeated_metadata_reuses_key():
+    encoder = CompactTextEncoder()
+    header, first = encoder.encode({"event": "message", "task_id": "t"}, "你")
+    assert json_codec.loads(header) == {"event": "stream_header", "k": 1, "meta": {"event": "message", "task_id": "t"}}
+    assert encoder.encode({"event": "message", "task_id": "t", "content": "好"}, "好") == (None, b'{"k":1,"d":"\xe5\xa5\xbd"}')
+    encoder.encode({"event": "message", "task_id": "other"}, "x")
+    assert encoder.encode({"event": "message", "task_id": "t"}, "y")[0] is None
+
+
+def test_header_table_is_bounded_and_keys_are_not_reused():
+    encoder = CompactTextEncoder()
+    for index in range(CompactTextEncoder.MAX_HEADERS * 3):
+        encoder.encode({"message_id": index}, "x")
+    assert len(encoder._headers) == CompactTextEncoder.MAX_HEADERS
+
+    header, payload = encoder.encode({"message_id": 0}, "x")
+    assert json_codec.loads(header)["k"] == CompactTextEncoder.MAX_HEADERS * 3 + 1
+    assert json_codec.loads(payload)["k"] == CompactTextEncoder.MAX_HEADERS * 3 + 1
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from core.config import settings
+from core.stream_registry import StreamRegistry
+from routers.chat import resume_stream
+
+
+async def frames(count, size):
+    for index in range(count):
+        yield bytes([65 + index % 26]) * size
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_RESUME_TTL", 60.0)
+    monkeypatch.setattr(settings, "STREAM_REPLAY_MAX_BYTES", 1000)
+    monkeypatch.setattr(settings, "STREAM_REPLAY_TOTAL_MAX_BYTES", 1500)
+    yield StreamRegistry
+    StreamRegistry._streams.clear()
+    StreamRegistry._total_bytes = 0
+
+
+def test_total_replay_bytes_are_capped(run, registry):
+    async def scenario():
+        first = registry.start(frames(10, 100), None, None, "verbose")
+        await first.producer
+        assert registry._total_bytes == 1000
+
+        # 合计超出上限时先移除已结束的流
+        second = registry.start(frames(6, 100), None, None, "verbose")
+        await second.producer
+        assert registry.get(first.id) is None
+        assert registry._total_bytes == second.buffered_bytes == 600
+
+        # 没有可移除的已结束流时缩减当前流的缓冲区
+        registry._streams[second.id].finished = False
+        third = registry.start(frames(10, 100), None, None, "verbose")
+        await third.producer
+        assert registry._total_bytes == 1500
+        assert third.buffered_bytes == 900 and third.first_seq == 2
+
+    run(scenario())
+
+
+def test_only_the_requesting_user_can_resume(run, registry):
+    async def scenario():
+        stream = registry.start(frames(3, 10), 1, 7, "verbose")
+        await stream.producer
+        for user in (SimpleNamespace(merchant_id=1, id=8), SimpleNamespace(merchant_id=2, id=7)):
+            with pytest.raises(HTTPException) as rejected:
+                await resume_stream(stream.id, current_user=user, last_event_id=None, after=None, accept_encoding=None)
+            assert rejected.value.status_code == 404
+        response = await resume_stream(stream.id, current_user=SimpleNamespace(merchant_id=1, id=7),
+                                       last_event_id="1", after=None, accept_encoding=None)
+        assert response.headers["X-Stream-Id"] == stream.id
+
+    run(scenario())
@@ -0,0 +1,80 @@
+import uuid
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from core.adapter import ChatRequest
+from core.chat_service import ChatService
+from core.database import async_session_scope
+from core.metrics import Metrics
+from core.upstream_conversations import UpstreamConversations
+from models import Conversation
+
+from fakes import FakeDify
+
+
+class ExpiringDify(FakeDify):
+    """expired中的上游对话ID返回404（已过期或被删除）"""
+
+    def __init__(self):
+        super().__init__()
+        self.expired = set()
+
+    async def respond(self, body):
+        if body.get("conversation_id") in self.expired:
+            return httpx.Response(404, json={"code": "not_found", "message": "Conversation Not Exists."})
+        return await super().respond(body)
+
+
+@pytest.fixture
+def dify(install_dify):
+    return install_dify(ExpiringDify())
+
+
+def chat_turns(run, merchant_id, user_id, agent_id, conversation_id, turns=2):
+    async def scenario():
+        for _ in range(turns):
+            request = ChatRequest(query="继续", user_id=user_id, merchant_id=merchant_id, agent_id=agent_id, conversation_id=conversation_id)
+            await ChatService().chat(request)
+        async with async_session_scope() as db:
+            return await db.scalar(select(Conversation.upstream_conversation_id).where(
+                Conversation.id == conversation_id, Conversation.agent_id == agent_id
+            ))
+    return run(scenario())
+
+
+def sent_conversation_ids(dify):
+    return [body.get("conversation_id") for _, body in dify.calls]
+
+
+def test_forwarding_is_off_unless_the_agent_enables_it(run, dify, seed):
+    merchant_id, (user_id,), agent_id = seed({"single_flight": True}, stream=False)
+    saved = chat_turns(run, merchant_id, user_id, agent_id, uuid.uuid4().hex)
+    assert sent_conversation_ids(dify) == [None, None]
+    # 未开启时不记录上游返回的对话ID，也不更新conversations表
+    assert saved is None
+    assert not UpstreamConversations._ids
+    assert Metrics.get("single_flight_bypassed_total", agent_id=agent_id) == 0
+
+
+def test_later_turns_continue_the_upstream_conversation(run, dify, seed):
+    merchant_id, (user_id,), agent_id = seed({"forward_conversation": True, "single_flight": True}, stream=False)
+    saved = chat_turns(run, merchant_id, user_id, agent_id, uuid.uuid4().hex)
+    first = dify.conversation_id
+    assert sent_conversation_ids(dify) == [None, first]
+    assert saved == first
+    # 续用上游对话的请求不合并
+    assert Metrics.get("single_flight_bypassed_total", agent_id=agent_id) == 2
+
+
+def test_expired_upstream_conversation_starts_a_new_one(run, dify, seed):
+    merchant_id, (user_id,), agent_id = seed({"forward_conversation": True}, stream=False)
+    conversation_id = uuid.uuid4().hex
+    chat_turns(run, merchant_id, user_id, agent_id, conversation_id, turns=1)
+    expired = dify.conversation_id
+    dify.expired.add(expired)
+
+    saved = chat_turns(run, merchant_id, user_id, agent_id, conversation_id, turns=1)
+    assert sent_conversation_ids(dify) == [None, expired, None]
+    assert saved == dify.conversation_id != expired
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from core.adapter import ChatRequest, DifyAdapter
+from core.adapter.timeouts import PHASE_FIRST_EVENT, PHASE_IDLE, PHASE_TOTAL, UpstreamTimeouts
+
+from fakes import DIFY_KEY, DIFY_URL, FakeDify
+
+PING = {"event": "ping"}
+
+
+def message(answer):
+    return {"event": "message", "task_id": "t1", "id": "m1", "message_id": "m1", "answer": answer}
+
+
+class ScriptedDify(FakeDify):
+    """按 (延迟秒数, 事件) 的脚本逐个发送事件的慢速上游"""
+
+    def __init__(self):
+        super().__init__()
+        self.script = []
+
+    async def respond(self, body: dict) -> httpx.Response:
+        async def stream():
+            for delay, event in self.script:
+                await asyncio.sleep(delay)
+                yield f"data: {json.dumps(event)}\n\n".encode("utf-8")
+
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+
+
+@pytest.fixture
+def dify(install_dify):
+    return install_dify(ScriptedDify())
+
+
+def chat_stream(run, dify, script, **timeouts):
+    dify.script = script
+    config = {"base_url": DIFY_URL, "api_key": DIFY_KEY, "type": "chat",
+              **{f"timeout_{phase}": seconds for phase, seconds in timeouts.items()}}
+    request = ChatRequest(query="你好", user_id=1, merchant_id=1, agent_id=1)
+
+    async def scenario():
+        chunks = [chunk async for chunk in DifyAdapter(config).chat_stream(request)]
+        return [chunk.message or (chunk.metadata.get("code"), chunk.metadata.get("phase")) for chunk in chunks]
+
+    return run(scenario())
+
+
+def test_first_event_timeout_ignores_pings(run, dify):
+    script = [(0.02, PING)] * 10 + [(0, message("迟到"))]
+    assert chat_stream(run, dify, script, first_event=0.1) == [("upstream_timeout", PHASE_FIRST_EVENT)]
+
+
+def test_idle_timeout_after_the_first_event(run, dify):
+    script = [(0, message("你")), (0.3, message("好"))]
+    assert chat_stream(run, dify, script, first_event=0.1, idle=0.1) == ["你", ("upstream_timeout", PHASE_IDLE)]
+
+
+def test_pings_keep_an_idle_stream_alive(run, dify):
+    script = [(0, message("你"))] + [(0.03, PING)] * 5 + [(0, message("好"))]
+    assert chat_stream(run, dify, script, idle=0.1) == ["你", "好"]
+
+
+def test_total_timeout_cuts_off_a_steady_stream(run, dify):
+    script = [(0.02, message("字"))] * 50
+    result = chat_stream(run, dify, script, idle=1, total=0.15)
+    assert result[-1] == ("upstream_timeout", PHASE_TOTAL)
+    assert 0 < len(result) - 1 < 50
+
+
+def test_zero_disables_a_phase():
+    timeouts = UpstreamTimeouts.from_config({"timeout_idle": 0, "timeout_total": "bad", "timeout_connect": 2})
+    assert timeouts.idle == float("inf") and timeouts.connect == 2
+    assert timeouts.http_timeout(read=timeouts.idle).read is None